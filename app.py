@@ -2,29 +2,54 @@ import streamlit as st
 import pandas as pd
 import time
 import os
+import re
 import hashlib
-from datetime import datetime
+import heapq
+import io
+import ipaddress
+import itertools
+import cProfile
+import pstats
+import socket
+import threading
 import urllib.parse
-from selenium import webdriver
+import requests
+from collections import deque
+from datetime import datetime, timedelta, time as dtime
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.webdriver.common.keys import Keys
 from streamlit_gsheets import GSheetsConnection
 
-# Importação segura do pywhatkit (pode falhar em servidores sem tela)
-try:
-    import pywhatkit as kit
-    HAS_PYWHATKIT = True
-except Exception:
-    HAS_PYWHATKIT = False
+import broker
+import coordinator
+import results_store
+from transports import (
+    FALHA_TRANSIENTE,
+    FALHA_PERMANENTE,
+    FALHA_SESSAO,
+    RETRY_MAX_TENTATIVAS,
+    RECONEXAO_MAX,
+    Anexo,
+    backoff_delay,
+    EnvioError,
+    classify_error,
+    create_chrome_driver,
+    wait_whatsapp_login,
+    SeleniumTransport,
+    PyWhatKitTransport,
+    HttpApiTransport,
+)
+from writeback import ResultWriteback, excel_destination, gsheets_destination
 
 # Variáveis globais para manter a sessão do navegador
 if 'driver' not in st.session_state:
     st.session_state.driver = None
 
+# Lock do navegador: envio, coleta de recibos e coleta de respostas não usam o driver ao mesmo tempo
+if 'driver_lock' not in st.session_state:
+    st.session_state.driver_lock = threading.Lock()
+
 def check_driver_alive():
     """Verifica se o driver ainda está ativo e funcional"""
     if st.session_state.driver:
@@ -52,81 +77,7 @@ def init_browser(headless=False):
     """Inicializa o navegador Chrome controlado pelo Selenium"""
     if st.session_state.driver is None:
         try:
-            options = webdriver.ChromeOptions()
-            
-            # Detectar se estamos em ambiente Linux/Cloud
-            is_cloud = os.name != 'nt'
-            
-            if is_cloud or headless:
-                # === Flags obrigatórias para containers (Streamlit Cloud / Docker) ===
-                options.add_argument("--headless=new")          # Modo headless novo (mais estável)
-                options.add_argument("--no-sandbox")            # Obrigatório em containers
-                options.add_argument("--disable-dev-shm-usage") # Evita crash por /dev/shm pequeno
-                options.add_argument("--disable-gpu")           # Sem placa de vídeo
-                options.add_argument("--disable-software-rasterizer")
-                options.add_argument("--remote-debugging-port=9222")  # Necessário para DevTools
-                options.add_argument("--window-size=1920,1080")
-                options.add_argument("--disable-extensions")
-                options.add_argument("--disable-background-timer-throttling")
-                options.add_argument("--disable-backgrounding-occluded-windows")
-                options.add_argument("--disable-renderer-backgrounding")
-                options.add_argument("--disable-features=VizDisplayCompositor")
-                options.add_argument("--single-process")        # Mais estável em containers
-                
-                # User-Agent moderno para o WhatsApp Web aceitar a conexão
-                # (o Chromium do Streamlit Cloud pode ser antigo e o WhatsApp exige Chrome 85+)
-                options.add_argument(
-                    '--user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
-                    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-                )
-                
-                # Definir localização do Chromium no Linux
-                if os.path.exists("/usr/bin/chromium"):
-                    options.binary_location = "/usr/bin/chromium"
-                elif os.path.exists("/usr/bin/chromium-browser"):
-                    options.binary_location = "/usr/bin/chromium-browser"
-                elif os.path.exists("/usr/bin/google-chrome"):
-                    options.binary_location = "/usr/bin/google-chrome"
-            else:
-                # === Modo local (Windows com janela visível) ===
-                options.add_argument("--start-maximized")
-                options.add_argument("--disable-blink-features=AutomationControlled")
-                options.add_experimental_option("excludeSwitches", ["enable-automation"])
-                options.add_experimental_option('useAutomationExtension', False)
-            
-            # Tentar iniciar o driver
-            driver = None
-            errors = []
-            
-            # Tentativa 1: webdriver_manager (funciona bem no local/Windows)
-            if not is_cloud:
-                try:
-                    service = Service(ChromeDriverManager().install())
-                    driver = webdriver.Chrome(service=service, options=options)
-                except Exception as e1:
-                    errors.append(f"webdriver_manager: {str(e1)[:100]}")
-            
-            # Tentativa 2: ChromeDriver no PATH (Cloud/Linux)
-            if driver is None:
-                try:
-                    driver = webdriver.Chrome(options=options)
-                except Exception as e2:
-                    errors.append(f"PATH: {str(e2)[:100]}")
-            
-            # Tentativa 3: Chromium-driver em caminhos conhecidos
-            if driver is None:
-                for chromedriver_path in ["/usr/bin/chromedriver", "/usr/lib/chromium/chromedriver", "/usr/lib/chromium-browser/chromedriver"]:
-                    if os.path.exists(chromedriver_path):
-                        try:
-                            service = Service(chromedriver_path)
-                            driver = webdriver.Chrome(service=service, options=options)
-                            break
-                        except Exception as e3:
-                            errors.append(f"{chromedriver_path}: {str(e3)[:100]}")
-            
-            if driver is None:
-                raise Exception(" | ".join(errors))
-            
+            driver = create_chrome_driver(headless=headless)
             st.session_state.driver = driver
             return driver
         except Exception as e:
@@ -137,6 +88,7 @@ def init_browser(headless=False):
 
 def close_browser():
     """Fecha o navegador e limpa a sessão"""
+    stop_reply_collector()
     if st.session_state.driver:
         try:
             st.session_state.driver.quit()
@@ -144,103 +96,1194 @@ def close_browser():
             pass
         st.session_state.driver = None
 
-# Função para enviar mensagens
-def send_messages_selenium(df, delay):
-    """Envia mensagens via WhatsApp Web usando Selenium"""
-    driver = st.session_state.driver
-    
+# =====================================================
+# FILA DE REENVIO E RECONEXÃO
+# =====================================================
+
+# Tentativas, backoff e limite de reconexões vêm de transports.py (os mesmos dos nós e do broker)
+RECONEXAO_TIMEOUT = 120       # Segundos aguardando o login após reconectar
+
+def reconnect_browser(headless=False, timeout=RECONEXAO_TIMEOUT):
+    """Reinicia o navegador após uma falha de sessão e aguarda o login no WhatsApp Web"""
+    close_browser()
+    driver = init_browser(headless=headless)
     if driver is None:
-        st.error("O navegador não foi iniciado. Clique em '1. Abrir WhatsApp Web' primeiro.")
+        return None
+    
+    # Mostrar a tela enquanto aguarda, para o operador escanear o QR Code se necessário
+    tela = st.empty()
+    try:
+        driver.get("https://web.whatsapp.com")
+        logado = wait_whatsapp_login(
+            driver, timeout,
+            aguardando=lambda d: tela.image(d.get_screenshot_as_png(),
+                                            caption="Sessão perdida — escaneie o QR Code para continuar o envio"),
+        )
+        return driver if logado else None
+    except Exception:
+        return None
+    finally:
+        tela.empty()
+
+def reconnect_transport(transport, headless=False):
+    """Tenta recuperar o transporte após uma falha de sessão. Retorna True se puder continuar"""
+    if isinstance(transport, SeleniumTransport):
+        driver = reconnect_browser(headless=headless)
+        transport.driver = driver
+        return driver is not None
+    # API HTTP (token inválido) e PyWhatKit não têm como reconectar sozinhos
+    return False
+
+# =====================================================
+# RESULTADOS E CONFIRMAÇÕES DE ENTREGA
+# =====================================================
+
+RESULTADOS_LOTE = 25        # Resultados acumulados antes de gravar no banco
+RECIBOS_MAX_ROLAGENS = 200  # Limite de rolagens da lista de conversas por coleta
+
+# Coleta, num único script no navegador, título e ícone de status de cada conversa visível
+_JS_LISTA_CONVERSAS = """
+const pane = document.querySelector('#pane-side');
+if (!pane) { return null; }
+const linhas = [];
+pane.querySelectorAll('div[role="listitem"], div[role="row"]').forEach(function (row) {
+    const titulo = row.querySelector('span[title]');
+    if (!titulo) { return; }
+    const icone = row.querySelector('span[data-icon^="msg-"]');
+    linhas.push([
+        titulo.getAttribute('title'),
+        icone ? icone.getAttribute('data-icon') : null,
+        icone ? (icone.getAttribute('aria-label') || '') : ''
+    ]);
+});
+return linhas;
+"""
+
+def normalize_phone_key(phone):
+    """Telefone só com dígitos (55...), usado como chave para cruzar contatos"""
+    return format_phone(phone).lstrip('+')
+
+def _result_row(contato, status, erro=None):
+    """Linha de resultado de um contato para o results_store"""
+    return {
+        'telefone': normalize_phone_key(contato['telefone']),
+        'nome': str(contato['nome']),
+        'status': status,
+        'erro': erro,
+        'enviado_em': datetime.now().isoformat(timespec="seconds"),
+    }
+
+def _register_result(contato, status, resultados_lote, writeback=None, erro=None):
+    """Acumula o resultado do contato no lote do banco e, se houver, no buffer da planilha"""
+    linha = _result_row(contato, status, erro)
+    resultados_lote.append(linha)
+    if writeback is not None:
+        # Agrupado, cada linha da planilha leva o próprio nome (não o da primeira linha do grupo)
+        for linha_id, nome in zip(contato['ids'], contato['nomes']):
+            writeback.add(linha_id, str(nome), linha['telefone'], status, linha['enviado_em'], erro)
+
+def receipt_from_icon(icone, rotulo):
+    """Converte o ícone de status da última mensagem (ticks) em um status de recibo"""
+    if not icone:
+        return None
+    rotulo = (rotulo or '').lower()
+    if icone == "msg-dblcheck-ack" or "read" in rotulo or "lid" in rotulo:
+        return "lido"
+    if icone == "msg-dblcheck" or "delivered" in rotulo or "entregue" in rotulo:
+        return "entregue"
+    if icone == "msg-check":
+        return "enviado"
+    if icone == "msg-time":
+        return "pendente"
+    return None
+
+def harvest_receipts(driver, campanha_id):
+    """Atualiza entregue/lido dos contatos da campanha lendo os ticks da lista de conversas
+    
+    Percorre a lista lateral (já carregada) uma única vez, rolando até achar
+    todos os contatos pendentes ou chegar ao fim, e grava tudo em um lote.
+    Retorna (contatos encontrados, recibos atualizados).
+    """
+    pendentes = results_store.pending_receipts(campanha_id)
+    if not pendentes:
         return 0, 0
+    por_telefone = {p['telefone'] for p in pendentes}
+    por_nome = {str(p['nome']).strip().lower(): p['telefone'] for p in pendentes}
     
-    # Verificar se o login foi feito (esperar aparecer a barra lateral do WhatsApp)
-    with st.spinner("⏳ Verificando login no WhatsApp Web..."):
+    recibos = {}
+    vistos = set()
+    driver.execute_script("const p = document.querySelector('#pane-side'); if (p) { p.scrollTop = 0; }")
+    
+    for _ in range(RECIBOS_MAX_ROLAGENS):
+        linhas = driver.execute_script(_JS_LISTA_CONVERSAS)
+        if linhas is None:
+            raise EnvioError("Lista de conversas não encontrada (WhatsApp Web desconectado?).", FALHA_SESSAO)
+        
+        for titulo, icone, rotulo in linhas:
+            if titulo in vistos:
+                continue
+            vistos.add(titulo)
+            # Contato não salvo aparece pelo número; salvo, pelo nome
+            digitos = ''.join(filter(str.isdigit, titulo))
+            telefone = digitos if digitos in por_telefone else por_nome.get(titulo.strip().lower())
+            status = receipt_from_icon(icone, rotulo)
+            if telefone and status:
+                recibos[telefone] = status
+        
+        if len(recibos) >= len(por_telefone):
+            break
+        
+        # Rolar uma "tela" da lista; parar quando não houver mais o que carregar
+        rolou = driver.execute_script(
+            "const p = document.querySelector('#pane-side');"
+            "const antes = p.scrollTop; p.scrollTop = antes + p.clientHeight;"
+            "return p.scrollTop > antes;"
+        )
+        if not rolou:
+            break
+        time.sleep(0.5)
+    
+    return len(recibos), results_store.update_receipts(campanha_id, recibos)
+
+# =====================================================
+# COLETA INCREMENTAL DE RESPOSTAS
+# =====================================================
+
+COLETA_INTERVALO_PADRAO = 300      # Segundos entre passagens da coleta automática
+COLETA_MAX_ROLAGENS = 50           # Limite de rolagens da lista de conversas por passagem
+COLETA_PARADA_INALTERADAS = 10     # Conversas seguidas sem novidade para encerrar a passagem
+
+# Título e "assinatura" (texto visível: prévia, horário, não lidas) das conversas visíveis, em ordem na tela
+_JS_RESUMO_CONVERSAS = """
+const pane = document.querySelector('#pane-side');
+if (!pane) { return null; }
+const linhas = [];
+pane.querySelectorAll('div[role="listitem"], div[role="row"]').forEach(function (row) {
+    const titulo = row.querySelector('span[title]');
+    if (!titulo) { return; }
+    linhas.push([row.getBoundingClientRect().top, titulo.getAttribute('title'), row.innerText]);
+});
+linhas.sort(function (a, b) { return a[0] - b[0]; });
+return linhas.map(function (l) { return [l[1], l[2]]; });
+"""
+
+# Localiza a conversa pelo título na lista lateral; com arguments[1] verdadeiro, clica para abri-la.
+# Retorna a assinatura atual da linha (ou null se não estiver visível)
+_JS_CONVERSA = """
+const alvo = arguments[0];
+const rows = document.querySelectorAll('#pane-side div[role="listitem"], #pane-side div[role="row"]');
+for (const row of rows) {
+    const titulo = row.querySelector('span[title]');
+    if (titulo && titulo.getAttribute('title') === alvo) {
+        if (arguments[1]) { (row.querySelector('div[tabindex]') || row).click(); }
+        return row.innerText;
+    }
+}
+return null;
+"""
+
+# Mensagens recebidas da conversa aberta, das mais antigas para as mais novas, parando no cursor
+_JS_MENSAGENS_RECEBIDAS = """
+const ultimo = arguments[0];
+const msgs = Array.from(document.querySelectorAll('#main div.message-in'));
+const saida = [];
+for (let i = msgs.length - 1; i >= 0; i--) {
+    const el = msgs[i].closest('[data-id]') || msgs[i].querySelector('[data-id]');
+    const id = el ? el.getAttribute('data-id') : null;
+    if (!id) { continue; }
+    if (id === ultimo) { break; }
+    const meta = msgs[i].querySelector('[data-pre-plain-text]');
+    const texto = msgs[i].querySelector('span.selectable-text');
+    saida.push([id, meta ? meta.getAttribute('data-pre-plain-text') : '', texto ? texto.innerText : '']);
+}
+return saida.reverse();
+"""
+
+def _parse_pre_plain_text(meta):
+    """Extrai a data/hora do atributo data-pre-plain-text ("[10:32, 18/10/2026] Nome: ")"""
+    match = re.search(r'\[(\d{1,2}:\d{2}), (\d{1,2}/\d{1,2}/\d{4})\]', meta or '')
+    if not match:
+        return None
+    try:
+        return datetime.strptime(f"{match.group(2)} {match.group(1)}", "%d/%m/%Y %H:%M").isoformat(timespec="minutes")
+    except ValueError:
+        return None
+
+def collect_replies_pass(driver, usuario):
+    """Uma passagem da coleta: abre só as conversas de contatos de campanha que mudaram desde o cursor
+    
+    A lista lateral é ordenada pela última atividade, então a passagem termina
+    após COLETA_PARADA_INALTERADAS conversas seguidas sem novidade. Retorna
+    (conversas processadas, respostas novas).
+    """
+    por_telefone, por_nome = results_store.campaign_contacts_index(usuario)
+    if not por_telefone:
+        return 0, 0
+    cursores = results_store.load_cursors(usuario)
+    
+    alterados = {}
+    respostas = []
+    vistos = set()
+    inalteradas_seguidas = 0
+    driver.execute_script("const p = document.querySelector('#pane-side'); if (p) { p.scrollTop = 0; }")
+    
+    for _ in range(COLETA_MAX_ROLAGENS):
+        linhas = driver.execute_script(_JS_RESUMO_CONVERSAS)
+        if linhas is None:
+            raise EnvioError("Lista de conversas não encontrada (WhatsApp Web desconectado?).", FALHA_SESSAO)
+        
+        for titulo, assinatura in linhas:
+            if titulo in vistos:
+                continue
+            vistos.add(titulo)
+            cursor = cursores.get(titulo, {})
+            if cursor.get('assinatura') == assinatura:
+                inalteradas_seguidas += 1
+                continue
+            inalteradas_seguidas = 0
+            
+            # Só abrir conversas de contatos das campanhas
+            digitos = ''.join(filter(str.isdigit, titulo))
+            telefone = digitos if digitos in por_telefone else por_nome.get(titulo.strip().lower())
+            if telefone is None:
+                alterados[titulo] = {'assinatura': assinatura}
+                continue
+            
+            if driver.execute_script(_JS_CONVERSA, titulo, True) is None:
+                continue
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'main')))
+            time.sleep(1)
+            mensagens = driver.execute_script(_JS_MENSAGENS_RECEBIDAS, cursor.get('ultimo_id'))
+            
+            for mensagem_id, meta, texto in mensagens:
+                respostas.append({
+                    'mensagem_id': mensagem_id,
+                    'telefone': telefone,
+                    'campanha_id': por_telefone.get(telefone),
+                    'conversa': titulo,
+                    'texto': texto,
+                    'recebida_em': _parse_pre_plain_text(meta),
+                })
+            # Assinatura relida após abrir (abrir zera o contador de não lidas)
+            alterados[titulo] = {
+                'assinatura': driver.execute_script(_JS_CONVERSA, titulo, False) or assinatura,
+                'ultimo_id': mensagens[-1][0] if mensagens else None,
+            }
+        
+        if inalteradas_seguidas >= COLETA_PARADA_INALTERADAS:
+            break
+        
+        rolou = driver.execute_script(
+            "const p = document.querySelector('#pane-side');"
+            "const antes = p.scrollTop; p.scrollTop = antes + p.clientHeight;"
+            "return p.scrollTop > antes;"
+        )
+        if not rolou:
+            break
+        time.sleep(0.5)
+    
+    novas = results_store.save_replies(usuario, respostas, alterados)
+    return len(alterados), novas
+
+def reply_collector_loop(driver, lock, parar, estado, usuario, intervalo=COLETA_INTERVALO_PADRAO):
+    """Coleta automática de respostas em segundo plano (roda numa thread, sem chamar st.*)
+    
+    Cada passagem só roda se o navegador estiver livre (lock), para não
+    disputar o WhatsApp Web com um envio em andamento.
+    """
+    estado['ativa'] = True
+    while not parar.is_set():
+        if lock.acquire(blocking=False):
+            try:
+                conversas, novas = collect_replies_pass(driver, usuario)
+                estado.update(ultima=datetime.now(), conversas=conversas,
+                              novas=estado.get('novas', 0) + novas, erro=None)
+            except Exception as e:
+                estado['erro'] = str(e)
+                if classify_error(e) == FALHA_SESSAO:
+                    break
+            finally:
+                lock.release()
+        parar.wait(intervalo)
+    estado['ativa'] = False
+
+def stop_reply_collector():
+    """Sinaliza para a coleta automática da sessão parar"""
+    if st.session_state.get('coleta_parar') is not None:
+        st.session_state.coleta_parar.set()
+
+# =====================================================
+# JANELAS DE ENVIO E ESTIMATIVA DE TEMPO
+# =====================================================
+
+DIAS_SEMANA = ["Seg", "Ter", "Qua", "Qui", "Sex", "Sáb", "Dom"]
+OVERHEAD_PADRAO_SEGUNDOS = 30   # Custo por mensagem (abrir conversa + enviar) antes de haver medições
+LATENCIA_AMOSTRAS = 200         # Quantas medições recentes usar por conta
+
+def default_send_window():
+    """Janela de envio padrão: dias úteis, horário comercial, sem limite diário"""
+    return {
+        'ativa': False,
+        'dias': [0, 1, 2, 3, 4],
+        'inicio': dtime(8, 0),
+        'fim': dtime(18, 0),
+        'limite_diario': 0,  # 0 = sem limite
+    }
+
+@st.cache_resource
+def get_send_windows():
+    """Janelas de envio por conta (usuário), compartilhadas entre as sessões do processo"""
+    return {}
+
+@st.cache_resource
+def get_latency_store():
+    """Latências medidas por conta (usuário), compartilhadas entre as sessões do processo"""
+    return {}
+
+@st.cache_resource
+def get_daily_sent_store():
+    """Mensagens enviadas hoje por conta (usuário), somando todas as campanhas e sessões do processo"""
+    return {}
+
+def record_sent_today(username, quantidade):
+    """Soma mensagens enviadas hoje à conta (base do limite diário da janela de envio)"""
+    store = get_daily_sent_store()
+    hoje = datetime.now().date()
+    dia, enviados = store.get(username, (hoje, 0))
+    store[username] = (hoje, (enviados if dia == hoje else 0) + quantidade)
+
+def sent_today(username):
+    """Mensagens que a conta já enviou hoje"""
+    dia, enviados = get_daily_sent_store().get(username, (None, 0))
+    return enviados if dia == datetime.now().date() else 0
+
+def record_send_latency(username, segundos):
+    """Registra quanto tempo um envio levou (navegação + envio, sem o intervalo)"""
+    store = get_latency_store()
+    store.setdefault(username, deque(maxlen=LATENCIA_AMOSTRAS)).append(segundos)
+
+def measured_latency(username):
+    """Mediana das latências medidas para a conta, ou None se ainda não houver medições"""
+    amostras = sorted(get_latency_store().get(username, ()))
+    if not amostras:
+        return None
+    return amostras[len(amostras) // 2]
+
+def seconds_per_message(username, delay):
+    """Tempo total estimado por mensagem: latência medida (ou padrão) + intervalo configurado"""
+    latencia = measured_latency(username)
+    return (latencia if latencia is not None else OVERHEAD_PADRAO_SEGUNDOS) + delay
+
+def next_window_start(agora, janela, enviados_no_dia=0):
+    """Próximo instante permitido para envio (o próprio 'agora' se já estiver dentro da janela)"""
+    if not janela or not janela['ativa']:
+        return agora
+    
+    limite = janela['limite_diario']
+    for offset in range(8):
+        dia = agora.date() + timedelta(days=offset)
+        if dia.weekday() not in janela['dias']:
+            continue
+        abre = datetime.combine(dia, janela['inicio'])
+        fecha = datetime.combine(dia, janela['fim'])
+        if offset == 0:
+            if agora >= fecha or (limite and enviados_no_dia >= limite):
+                continue
+            return max(agora, abre)
+        return abre
+    
+    # Nenhum dia da semana permitido
+    return None
+
+def plan_campaign(total, inicio, janela, segundos_por_msg, max_dias=366, enviados_hoje=0):
+    """Distribui a campanha nas janelas permitidas
+    
+    Retorna (blocos, término previsto). Cada bloco é um dia de envio com
+    início, fim e quantidade de mensagens. O término é None se a campanha
+    não couber nas janelas configuradas. enviados_hoje (da conta, em outras
+    campanhas) já ocupa parte do limite diário de hoje.
+    """
+    blocos = []
+    restante = total
+    agora = inicio
+    hoje = datetime.now().date()
+    
+    while restante > 0 and len(blocos) < max_dias:
+        comeco = next_window_start(agora, janela, enviados_hoje if agora.date() == hoje else 0)
+        if comeco is None:
+            return blocos, None
+        
+        if janela and janela['ativa']:
+            fecha = datetime.combine(comeco.date(), janela['fim'])
+            capacidade = int((fecha - comeco).total_seconds() // segundos_por_msg)
+            if janela['limite_diario']:
+                capacidade = min(capacidade, janela['limite_diario'] - (enviados_hoje if comeco.date() == hoje else 0))
+        else:
+            capacidade = restante
+        
+        qtd = min(restante, capacidade)
+        if qtd > 0:
+            blocos.append({
+                'Dia': f"{comeco.strftime('%d/%m')} ({DIAS_SEMANA[comeco.weekday()]})",
+                'Início': comeco.strftime("%H:%M"),
+                'Fim': (comeco + timedelta(seconds=qtd * segundos_por_msg)).strftime("%H:%M"),
+                'Mensagens': qtd,
+            })
+            restante -= qtd
+            if restante == 0:
+                return blocos, comeco + timedelta(seconds=qtd * segundos_por_msg)
+        
+        # Continuar no dia seguinte
+        agora = datetime.combine(comeco.date() + timedelta(days=1), dtime(0, 0))
+    
+    return blocos, None
+
+def wait_until(momento, status_text, motivo):
+    """Bloqueia até o horário indicado, atualizando a mensagem de status"""
+    while True:
+        espera = (momento - datetime.now()).total_seconds()
+        if espera <= 0:
+            return
+        status_text.markdown(f"🕐 {motivo} Retomando em {momento.strftime('%d/%m %H:%M')} ({espera / 60:.0f} min).")
+        time.sleep(min(espera, 30))
+
+def wait_for_start(inicio_agendado, janela, status_text, username):
+    """Aguarda o início agendado e a abertura da janela de envio (antes de ocupar uma vaga na fila)"""
+    if inicio_agendado and inicio_agendado > datetime.now():
+        wait_until(inicio_agendado, status_text, "Envio agendado.")
+    agora = datetime.now()
+    liberado_em = next_window_start(agora, janela, sent_today(username))
+    if liberado_em is not None and liberado_em > agora:
+        wait_until(liberado_em, status_text, "Fora da janela de envio.")
+    status_text.empty()
+
+# =====================================================
+# FILA DE CAMPANHAS COMPARTILHADA ENTRE OPERADORES
+# =====================================================
+
+MAX_CAMPANHAS_SIMULTANEAS = 2   # Campanhas enviando ao mesmo tempo no servidor
+MAX_CAMPANHAS_POR_USUARIO = 1   # Campanhas simultâneas de um mesmo operador
+PRIORIDADES = {"Alta": 2, "Normal": 1, "Baixa": 0}
+
+class CampaignQueue:
+    """Fila de campanhas compartilhada por todas as sessões do processo
+    
+    A ordem de início é justa entre operadores: maior prioridade primeiro e,
+    dentro da mesma prioridade, o operador que menos enviou até agora.
+    """
+    def __init__(self, max_concorrentes=MAX_CAMPANHAS_SIMULTANEAS, max_por_usuario=MAX_CAMPANHAS_POR_USUARIO):
+        self.max_concorrentes = max_concorrentes
+        self.max_por_usuario = max_por_usuario
+        self._cond = threading.Condition()
+        self._seq = itertools.count(1)
+        self._aguardando = {}   # job_id -> job
+        self._executando = {}   # job_id -> job
+        self._pausados = {}     # job_id -> job fora da janela de envio (não ocupa vaga)
+        self._uso = {}          # usuário -> mensagens já processadas (serviço recebido)
+    
+    def submit(self, username, total, segundos_por_msg, prioridade=PRIORIDADES["Normal"]):
+        """Coloca uma campanha na fila e retorna o id do job"""
+        with self._cond:
+            job_id = next(self._seq)
+            self._aguardando[job_id] = {
+                'id': job_id,
+                'usuario': username,
+                'prioridade': prioridade,
+                'restantes': total,
+                'segundos_por_msg': segundos_por_msg,
+                'enfileirado_em': datetime.now(),
+                'iniciado_em': None,
+            }
+            self._cond.notify_all()
+            return job_id
+    
+    def _ordem(self):
+        """Jobs aguardando, na ordem justa de atendimento"""
+        return sorted(
+            self._aguardando.values(),
+            key=lambda j: (-j['prioridade'], self._uso.get(j['usuario'], 0), j['id'])
+        )
+    
+    def _em_execucao(self, username):
+        return sum(1 for j in self._executando.values() if j['usuario'] == username)
+    
+    def _proximo(self):
+        """Próximo job que pode iniciar agora (ou None)"""
+        if len(self._executando) >= self.max_concorrentes:
+            return None
+        for job in self._ordem():
+            if self._em_execucao(job['usuario']) < self.max_por_usuario:
+                return job
+        return None
+    
+    def wait_turn(self, job_id, timeout=None):
+        """Aguarda a vez do job. Retorna True quando ele passa a executar"""
+        with self._cond:
+            if job_id in self._executando:
+                return True
+            proximo = self._proximo()
+            if proximo is None or proximo['id'] != job_id:
+                self._cond.wait(timeout)
+                proximo = self._proximo()
+            if proximo is not None and proximo['id'] == job_id:
+                job = self._aguardando.pop(job_id)
+                job['iniciado_em'] = datetime.now()
+                self._executando[job_id] = job
+                self._cond.notify_all()
+                return True
+            return False
+    
+    def progress(self, job_id, restantes):
+        """Atualiza quantos contatos faltam e contabiliza o serviço recebido pelo operador"""
+        with self._cond:
+            job = self._executando.get(job_id)
+            if job is not None:
+                self._uso[job['usuario']] = self._uso.get(job['usuario'], 0) + max(job['restantes'] - restantes, 0)
+                job['restantes'] = restantes
+    
+    def pause(self, job_id):
+        """Libera a vaga de um job em execução enquanto ele espera a janela de envio"""
+        with self._cond:
+            job = self._executando.pop(job_id, None)
+            if job is not None:
+                self._pausados[job_id] = job
+                self._cond.notify_all()
+    
+    def resume(self, job_id):
+        """Devolve um job pausado à fila (ele volta a executar pelo wait_turn)"""
+        with self._cond:
+            job = self._pausados.pop(job_id, None)
+            if job is not None:
+                self._aguardando[job_id] = job
+                self._cond.notify_all()
+    
+    def finish(self, job_id):
+        """Remove o job (concluído ou cancelado) e libera a vaga"""
+        with self._cond:
+            self._aguardando.pop(job_id, None)
+            self._executando.pop(job_id, None)
+            self._pausados.pop(job_id, None)
+            self._cond.notify_all()
+    
+    def _previsao(self):
+        """Início previsto de cada job aguardando, simulando a liberação das vagas"""
+        agora = datetime.now()
+        vagas = sorted(
+            agora + timedelta(seconds=j['restantes'] * j['segundos_por_msg'])
+            for j in self._executando.values()
+        )
+        vagas += [agora] * max(self.max_concorrentes - len(vagas), 0)
+        previsao = {}
+        for job in self._ordem():
+            vagas.sort()
+            inicio = vagas.pop(0)
+            previsao[job['id']] = inicio
+            vagas.append(inicio + timedelta(seconds=job['restantes'] * job['segundos_por_msg']))
+        return previsao
+    
+    def position(self, job_id):
+        """Posição do job na fila (1 = próximo) ou 0 se já está executando"""
+        with self._cond:
+            if job_id in self._executando:
+                return 0
+            for pos, job in enumerate(self._ordem(), start=1):
+                if job['id'] == job_id:
+                    return pos
+            return None
+    
+    def expected_start(self, job_id):
+        """Horário previsto de início do job"""
+        with self._cond:
+            if job_id in self._executando:
+                return self._executando[job_id]['iniciado_em']
+            return self._previsao().get(job_id)
+    
+    def snapshot(self):
+        """Linhas para exibir a fila na interface"""
+        with self._cond:
+            previsao = self._previsao()
+            nomes = {v: k for k, v in PRIORIDADES.items()}
+            linhas = []
+            for job in self._executando.values():
+                linhas.append({
+                    'Operador': job['usuario'],
+                    'Status': "▶️ Enviando",
+                    'Prioridade': nomes.get(job['prioridade'], job['prioridade']),
+                    'Contatos restantes': job['restantes'],
+                    'Início': job['iniciado_em'].strftime("%H:%M"),
+                })
+            for job in self._pausados.values():
+                linhas.append({
+                    'Operador': job['usuario'],
+                    'Status': "🕐 Pausada (fora da janela)",
+                    'Prioridade': nomes.get(job['prioridade'], job['prioridade']),
+                    'Contatos restantes': job['restantes'],
+                    'Início': job['iniciado_em'].strftime("%H:%M"),
+                })
+            for pos, job in enumerate(self._ordem(), start=1):
+                linhas.append({
+                    'Operador': job['usuario'],
+                    'Status': f"⏳ Na fila ({pos}º)",
+                    'Prioridade': nomes.get(job['prioridade'], job['prioridade']),
+                    'Contatos restantes': job['restantes'],
+                    'Início': f"~{previsao[job['id']].strftime('%H:%M')}",
+                })
+            return linhas
+
+@st.cache_resource
+def get_campaign_queue():
+    """Fila de campanhas única do processo (compartilhada entre todas as sessões)"""
+    return CampaignQueue()
+
+def wait_for_queue_turn(fila, job_id):
+    """Bloqueia a sessão até a campanha ser liberada pela fila, mostrando posição e previsão"""
+    aviso = st.empty()
+    while not fila.wait_turn(job_id, timeout=5):
+        posicao = fila.position(job_id)
+        inicio = fila.expected_start(job_id)
+        previsao = f" Início previsto às {inicio.strftime('%H:%M')}." if inicio else ""
+        aviso.info(f"🧾 Sua campanha está na fila de envio: posição {posicao}.{previsao}")
+    aviso.empty()
+
+# =====================================================
+# CAMPANHAS DELTA (SÓ LINHAS NOVAS OU ALTERADAS)
+# =====================================================
+# Cada linha enviada deixa uma impressão: hash de (telefone normalizado,
+# texto). Na próxima carga da mesma lista, as impressões são calculadas de
+# uma vez para a coluna inteira e comparadas com o snapshot por conjunto,
+# sem comparar linha a linha.
+
+DELTA_NOVA = "nova"          # Telefone nunca enviado desta lista
+DELTA_ALTERADA = "alterada"  # Telefone já enviado, mas com outro texto
+DELTA_ENVIADA = "enviada"    # Mesmo telefone e mesmo texto já enviados
+
+def normalize_phone_column(telefones):
+    """Mesma normalização de format_phone (sem o +), aplicada na coluna inteira de uma vez"""
+    telefones = telefones.astype(str).str.replace(r'\..*|\D', '', regex=True)
+    return telefones.where(telefones.str.startswith('55'), '55' + telefones)
+
+def row_fingerprints(df):
+    """Impressões vetorizadas das linhas: DataFrame (mesmo índice) com impressao e telefone_hash (int64)"""
+    telefones = normalize_phone_column(df['Telefone'])
+    chaves = pd.DataFrame({'telefone': telefones, 'texto': df['texto'].astype(str)}, index=df.index)
+    return pd.DataFrame({
+        'impressao': pd.util.hash_pandas_object(chaves, index=False).to_numpy().view('int64'),
+        'telefone_hash': pd.util.hash_pandas_object(chaves['telefone'], index=False).to_numpy().view('int64'),
+    }, index=df.index)
+
+def classify_delta(df, usuario, fonte):
+    """Classifica cada linha como nova, alterada ou já enviada em relação ao snapshot. Retorna (Series, impressões)"""
+    impressoes = row_fingerprints(df)
+    enviadas, telefones_enviados = results_store.load_snapshot(usuario, fonte)
+    ja_enviada = impressoes['impressao'].isin(enviadas)
+    telefone_conhecido = impressoes['telefone_hash'].isin(telefones_enviados)
+    classes = pd.Series(DELTA_NOVA, index=df.index)
+    classes[telefone_conhecido] = DELTA_ALTERADA
+    classes[ja_enviada] = DELTA_ENVIADA
+    return classes, impressoes
+
+def save_sent_fingerprints(impressoes, linha_ids):
+    """Grava no snapshot da lista as impressões das linhas enviadas. impressoes: (usuario, fonte, tabela)"""
+    if not linha_ids:
+        return
+    usuario, fonte, tabela = impressoes
+    linhas = tabela.loc[linha_ids]
+    results_store.save_snapshot(usuario, fonte, list(zip(linhas['impressao'], linhas['telefone_hash'])))
+    bump_snapshot_version(usuario, fonte)
+
+@st.cache_resource
+def get_snapshot_versions():
+    """Versão do snapshot delta por (usuário, lista): muda a cada gravação ou limpeza (invalida os caches)"""
+    return {}
+
+def snapshot_version(usuario, fonte):
+    return get_snapshot_versions().get((usuario, fonte), 0)
+
+def bump_snapshot_version(usuario, fonte):
+    versoes = get_snapshot_versions()
+    versoes[(usuario, fonte)] = versoes.get((usuario, fonte), 0) + 1
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_delta_classes(_df, file_id, usuario, fonte, versao):
+    """classify_delta da lista carregada, recalculado só quando muda o arquivo ou o snapshot"""
+    classes, _ = classify_delta(_df, usuario, fonte)
+    return classes
+
+# =====================================================
+# ANEXOS DA CAMPANHA
+# =====================================================
+# Um arquivo para a campanha inteira (barra lateral) ou um por linha, na
+# coluna opcional "Anexo" (link http/https ou arquivo dentro de
+# ANEXOS_PASTA). Cada arquivo é lido uma vez por campanha e o transporte
+# guarda o que já preparou (cache da página no WhatsApp Web, id da mídia na
+# API): os bytes não voltam a passar pelo WebDriver nem pela API a cada
+# contato. No WhatsApp Web, a mídia ainda sobe para o WhatsApp a cada envio.
+
+ANEXO_MAX_BYTES = 100 * 1024 * 1024   # Limite do WhatsApp para documentos
+# Única pasta de onde a coluna Anexo pode ler arquivos locais (a planilha não escolhe arquivos do servidor)
+ANEXOS_PASTA = os.path.realpath(os.environ.get("WHATSAPP_ANEXOS_PASTA", "anexos"))
+# Links para a rede interna (localhost, IPs privados) só com WHATSAPP_ANEXOS_REDE_INTERNA=1
+ANEXOS_REDE_INTERNA = os.environ.get("WHATSAPP_ANEXOS_REDE_INTERNA") == "1"
+ANEXO_REDIRECIONAMENTOS = 5
+ANEXO_PARTE_DOWNLOAD = 1024 * 1024
+
+def check_attachment_url(url):
+    """Recusa links da coluna Anexo que apontem para o próprio servidor ou para a rede interna"""
+    host = urllib.parse.urlsplit(url).hostname
+    if not host:
+        raise ValueError(f"Link de anexo inválido: {url}")
+    if ANEXOS_REDE_INTERNA:
+        return
+    try:
+        enderecos = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror as e:
+        raise EnvioError(f"Não foi possível resolver o endereço do anexo {url}: {e}", FALHA_TRANSIENTE)
+    for endereco in enderecos:
+        ip = ipaddress.ip_address(endereco.split("%")[0])
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Anexo em endereço interno recusado ({host} -> {ip}): {url}")
+
+def download_attachment(url):
+    """Baixa o link do anexo em partes, parando assim que passar de ANEXO_MAX_BYTES: (bytes, mime)"""
+    limite_mb = ANEXO_MAX_BYTES // (1024 * 1024)
+    for _ in range(ANEXO_REDIRECIONAMENTOS + 1):
+        check_attachment_url(url)
         try:
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, '//div[@id="pane-side"]'))
-            )
-        except:
-            st.warning("⚠️ Não detectamos o WhatsApp logado. Se você já escaneou o QR Code, pode ignorar esta mensagem e o robô tentará enviar assim mesmo.")
+            # Redirecionamentos seguidos à mão: cada destino passa pela mesma verificação
+            resp = requests.get(url, timeout=60, stream=True, allow_redirects=False)
+        except requests.RequestException as e:
+            raise EnvioError(f"Falha ao baixar o anexo {url}: {e}", FALHA_TRANSIENTE)
+        with resp:
+            if resp.is_redirect:
+                url = urllib.parse.urljoin(url, resp.headers["Location"])
+                continue
+            if not resp.ok:
+                raise ValueError(f"Anexo {url} indisponível (HTTP {resp.status_code}).")
+            tamanho = resp.headers.get("Content-Length", "")
+            if tamanho.isdigit() and int(tamanho) > ANEXO_MAX_BYTES:
+                raise ValueError(f"Anexo {url} maior que {limite_mb} MB.")
+            dados = bytearray()
+            try:
+                for parte in resp.iter_content(ANEXO_PARTE_DOWNLOAD):
+                    dados += parte
+                    if len(dados) > ANEXO_MAX_BYTES:
+                        raise ValueError(f"Anexo {url} maior que {limite_mb} MB.")
+            except requests.RequestException as e:
+                raise EnvioError(f"Falha ao baixar o anexo {url}: {e}", FALHA_TRANSIENTE)
+            return bytes(dados), resp.headers.get("Content-Type", "").split(";")[0] or None
+    raise ValueError(f"Anexo {url}: redirecionamentos demais.")
+
+def attachment_reference(valor):
+    """Referência do anexo numa célula da coluna Anexo (None se vazia)"""
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)):
+        return None
+    valor = str(valor).strip()
+    return valor or None
+
+def load_attachment(referencia, cache):
+    """Lê o anexo de um link ou da pasta de anexos, uma vez por referência. Levanta ValueError se não puder"""
+    if referencia in cache:
+        return cache[referencia]
+    if referencia.lower().startswith(("http://", "https://")):
+        dados, mime = download_attachment(referencia)
+        nome = os.path.basename(referencia.split("?")[0].rstrip("/")) or "anexo"
+        anexo = Anexo(nome, dados, mime)
+    else:
+        caminho = os.path.realpath(os.path.join(ANEXOS_PASTA, referencia))
+        if os.path.commonpath([caminho, ANEXOS_PASTA]) != ANEXOS_PASTA:
+            raise ValueError(f"Anexo fora da pasta de anexos ({ANEXOS_PASTA}): {referencia}")
+        if not os.path.isfile(caminho):
+            raise ValueError(f"Anexo não encontrado em {ANEXOS_PASTA}: {referencia}")
+        anexo = Anexo.from_path(caminho)
+    if len(anexo.dados) > ANEXO_MAX_BYTES:
+        raise ValueError(f"Anexo {anexo.nome} maior que {ANEXO_MAX_BYTES // (1024 * 1024)} MB.")
+    cache[referencia] = anexo
+    return anexo
+
+# =====================================================
+# MENSAGENS REPETIDAS PARA O MESMO TELEFONE
+# =====================================================
+# Antes do disparo, as linhas com o mesmo telefone normalizado podem virar
+# um único envio: uma mensagem combinada ou várias mensagens digitadas na
+# conversa já aberta. Cada grupo abre a conversa (e paga o intervalo) uma vez.
+
+AGRUPAR_NAO = "Enviar separadas"
+AGRUPAR_COMBINADA = "Juntar numa mensagem só"
+AGRUPAR_MESMO_CHAT = "Várias mensagens na mesma conversa"
+AGRUPAR_MODOS = [AGRUPAR_NAO, AGRUPAR_COMBINADA, AGRUPAR_MESMO_CHAT]
+SEPARADOR_COMBINADA = "\n\n"
+SEGUNDOS_MSG_MESMO_CHAT = 3   # Custo de digitar cada mensagem extra na conversa já aberta
+
+def group_contacts(df, agrupar=AGRUPAR_NAO):
+    """Contatos do envio, na ordem da planilha. Agrupando, um por telefone (textos repetidos saem uma vez só)
+
+    Cada contato leva em "ids" as linhas da planilha que ele cobre (com o
+    nome e o texto de cada uma em "nomes" e "textos"). No modo "mesma
+    conversa", "mensagem" é a lista de textos do grupo.
+    """
+    anexos = [attachment_reference(v) for v in df['Anexo']] if 'Anexo' in df.columns else [None] * len(df)
+    linhas = zip(df.index, df['Nome'], df['Telefone'], df['texto'], anexos)
+    if agrupar == AGRUPAR_NAO:
+        return [
+            {'id': linha_id, 'ids': [linha_id], 'nomes': [nome], 'textos': [texto], 'nome': nome,
+             'telefone': telefone, 'mensagem': texto, 'anexo': anexo, 'tentativa': 0}
+            for linha_id, nome, telefone, texto, anexo in linhas
+        ]
+    grupos = {}
+    for (linha_id, nome, telefone, texto, anexo), chave in zip(linhas, normalize_phone_column(df['Telefone'])):
+        if len(chave) < 12:
+            # Telefone incompleto: não agrupar (cada linha falha sozinha com o próprio erro)
+            chave = ('linha', linha_id)
+        # Anexos diferentes para o mesmo telefone continuam em envios separados
+        grupo = grupos.setdefault((chave, anexo), {
+            'id': linha_id, 'ids': [], 'nomes': [], 'textos': [], 'nome': nome, 'telefone': telefone,
+            'mensagem': [], 'anexo': anexo, 'tentativa': 0
+        })
+        grupo['ids'].append(linha_id)
+        grupo['nomes'].append(nome)
+        grupo['textos'].append(texto)
+        if texto not in grupo['mensagem']:
+            grupo['mensagem'].append(texto)
+    contatos = list(grupos.values())
+    for contato in contatos:
+        if agrupar == AGRUPAR_COMBINADA or len(contato['mensagem']) == 1:
+            contato['mensagem'] = SEPARADOR_COMBINADA.join(str(m) for m in contato['mensagem'])
+    return contatos
+
+def _message_count(contato):
+    return len(contato['mensagem']) if isinstance(contato['mensagem'], list) else 1
+
+def grouping_counts(contatos):
+    """Linhas cobertas, mensagens e conversas dos contatos agrupados: (linhas, mensagens, conversas)"""
+    linhas = sum(len(c['ids']) for c in contatos)
+    mensagens = sum(_message_count(c) for c in contatos)
+    return linhas, mensagens, len(contatos)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_grouping_counts(_df, file_id, agrupar, versao_delta):
+    """grouping_counts da fila carregada, recalculado só quando muda o arquivo, o modo ou o snapshot delta"""
+    return grouping_counts(group_contacts(_df, agrupar))
+
+def grouping_savings(contagem, segundos_msg):
+    """Aberturas de conversa e minutos economizados pelo agrupamento: (navegações, minutos)"""
+    linhas, mensagens, conversas = contagem
+    navegacoes = linhas - conversas
+    # Textos repetidos deixam de ser enviados; os demais extras só custam a digitação no chat aberto
+    segundos = (linhas - mensagens) * segundos_msg + (mensagens - conversas) * max(segundos_msg - SEGUNDOS_MSG_MESMO_CHAT, 0)
+    return navegacoes, segundos / 60
+
+# Função para enviar mensagens
+def send_campaign(df, delay, transport, headless=False, janela=None, job_id=None,
+                  campanha_id=None, writeback=None, impressoes=None, agrupar=AGRUPAR_NAO, anexo=None):
+    """Envia as mensagens da campanha pelo transporte escolhido
+    
+    Os contatos são entregues ao transporte em lotes de transport.lote (1
+    para o navegador; vários em paralelo para a API HTTP). Falhas transientes
+    vão para uma fila de reenvio com backoff exponencial, processada ao final
+    da campanha. Falhas permanentes são apenas registradas e falhas de sessão
+    disparam a reconexão. Com uma janela de envio ativa, os envios pausam fora
+    do horário/dias permitidos e ao atingir o limite diário. Com campanha_id,
+    o resultado de cada contato é gravado em lotes no results_store; com
+    writeback, também na planilha de origem. Com impressoes (usuario, fonte,
+    tabela de row_fingerprints), a impressão de cada linha enviada entra no
+    snapshot da lista para as próximas campanhas delta. Com agrupar, as
+    linhas do mesmo telefone viram um envio só (ver group_contacts). O
+    anexo (Anexo) vai com todas as mensagens, a não ser que a linha indique
+    o próprio na coluna Anexo; cada arquivo é lido uma vez por campanha.
+    """
+    if transport.usa_navegador:
+        if transport.driver is None:
+            st.error("O navegador não foi iniciado. Clique em '1. Abrir WhatsApp Web' primeiro.")
+            return 0, 0
         
-    total = len(df)
+        # Verificar se o login foi feito (esperar aparecer a barra lateral do WhatsApp)
+        with st.spinner("⏳ Verificando login no WhatsApp Web..."):
+            try:
+                WebDriverWait(transport.driver, 10).until(
+                    EC.presence_of_element_located((By.XPATH, '//div[@id="pane-side"]'))
+                )
+            except:
+                st.warning("⚠️ Não detectamos o WhatsApp logado. Se você já escaneou o QR Code, pode ignorar esta mensagem e o robô tentará enviar assim mesmo.")
+        
+    # Contatos ainda não tentados (em ordem) e fila de reenvio (heap por horário de liberação)
+    pendentes = deque(group_contacts(df, agrupar))
+    fila_reenvio = []
+    seq = itertools.count()
+    
+    total = len(pendentes)
     success_count = 0
     error_count = 0
+    concluidos = 0
+    reconexoes = 0
     
     # Containers para feedback
     progress_bar = st.progress(0)
     status_text = st.empty()
     log_container = st.expander("📋 Log de Envios", expanded=True)
+    if total < len(df):
+        navegacoes, minutos = grouping_savings(grouping_counts(pendentes), seconds_per_message(st.session_state.username, delay))
+        with log_container:
+            st.info(
+                f"👥 {len(df)} linhas agrupadas em {total} conversas ({agrupar.lower()}): "
+                f"{navegacoes} aberturas de conversa a menos, ~{minutos:.0f} min economizados."
+            )
     
-    for index, row in df.iterrows():
-        try:
-            nome = row['Nome']
-            telefone = format_phone(row['Telefone']) # Garante formato +55...
-            mensagem = row['texto']
-            
-            # Remover o + para o link do WhatsApp (ele aceita apenas números)
-            phone_no = telefone.replace('+', '')
+    anexos = {}          # Referência da coluna Anexo -> Anexo já lido
+    resultados_lote = []
+    enviados_lote = []   # Linhas enviadas cuja impressão ainda não foi gravada
+    interrompida = None
+    
+    gravou_planilha = True
+    try:
+        while pendentes or fila_reenvio:
+            # Respeitar a janela de envio da conta (horário, dias e limite diário)
+            if janela and janela['ativa']:
+                agora = datetime.now()
+                # Limite diário por conta: conta também o que outras campanhas dela enviaram hoje
+                liberado_em = next_window_start(agora, janela, sent_today(st.session_state.username))
+                if liberado_em is None:
+                    interrompida = "Nenhum dia permitido na janela de envio."
+                    break
+                if liberado_em > agora:
+                    # A vaga na fila de campanhas fica livre para outros operadores durante a pausa
+                    if job_id is not None:
+                        get_campaign_queue().pause(job_id)
+                    wait_until(liberado_em, status_text, "Fora da janela de envio.")
+                    if job_id is not None:
+                        get_campaign_queue().resume(job_id)
+                        wait_for_queue_turn(get_campaign_queue(), job_id)
+        
+            # Montar o lote: primeiro a lista principal, depois a fila de reenvio
+            lote = []
+            while pendentes and len(lote) < transport.lote:
+                lote.append(pendentes.popleft())
+            if not lote:
+                pronto_em, _, contato = heapq.heappop(fila_reenvio)
+                espera = pronto_em - time.time()
+                if espera > 0:
+                    status_text.markdown(f"🔁 Fila de reenvio: aguardando {espera:.0f} segundos...")
+                    time.sleep(espera)
+                lote.append(contato)
+                while fila_reenvio and len(lote) < transport.lote and fila_reenvio[0][0] <= time.time():
+                    lote.append(heapq.heappop(fila_reenvio)[2])
+        
+            # Telefones inválidos falham aqui, sem ocupar o transporte
+            itens = []
+            falhas = {}
+            anexos_lote = {}
+            for i, contato in enumerate(lote):
+                try:
+                    telefone = format_phone(contato['telefone']) # Garante formato +55...
+                    if contato.get('anexo_enviado'):
+                        anexos_lote[i] = None
+                    else:
+                        anexos_lote[i] = load_attachment(contato['anexo'], anexos) if contato.get('anexo') else anexo
+                    itens.append((i, telefone))
+                except Exception as e:
+                    falhas[i] = e
+        
+            if len(lote) == 1:
+                status_text.markdown(f"**Enviando para:** {lote[0]['nome']} ({itens[0][1] if itens else lote[0]['telefone']})")
+            else:
+                status_text.markdown(f"**Enviando lote de {len(lote)} mensagens** ({transport.nome})...")
+        
+            inicio_envio = time.time()
+            retornos = transport.send_batch([(telefone, lote[i]['mensagem'], anexos_lote[i]) for i, telefone in itens])
+            falhas.update((i, erro) for (i, _), erro in zip(itens, retornos) if erro is not None)
+            duracao_envio = (time.time() - inicio_envio) / len(itens) if itens else 0
+            if itens:
+                record_send_latency(st.session_state.username, duracao_envio)
+        
+            sessao_perdida = []
+            for i, contato in enumerate(lote):
+                nome = contato['nome']
+                e = falhas.get(i)
             
-            status_text.markdown(f"**Enviando para:** {nome} ({telefone})")
+                if e is None:
+                    record_sent_today(st.session_state.username, _message_count(contato))
+                    success_count += len(contato['ids'])
+                    concluidos += 1
+                    _register_result(contato, "enviado", resultados_lote, writeback)
+                    enviados_lote.extend(contato['ids'])
+                    with log_container:
+                        if anexos_lote.get(i) is not None:
+                            st.success(f"✅ {nome} - Mensagem enviada com 📎 {anexos_lote[i].nome} ({duracao_envio:.1f}s)")
+                        else:
+                            st.success(f"✅ {nome} - Mensagem enviada!")
+                    continue
             
-            # Codificar mensagem para URL
-            msg_encoded = urllib.parse.quote(mensagem)
+                if getattr(e, 'enviadas', 0) and isinstance(contato['mensagem'], list):
+                    # Parte das mensagens do grupo já saiu: as linhas dessas mensagens ficam como
+                    # enviadas e as próximas tentativas enviam só o resto (e sem o anexo, que foi
+                    # junto com a primeira)
+                    enviadas = contato['mensagem'][:e.enviadas]
+                    saiu = [texto in enviadas for texto in contato['textos']]
+                    parcial = {**contato, **{
+                        chave: [v for v, ok in zip(contato[chave], saiu) if ok] for chave in ('ids', 'nomes', 'textos')
+                    }}
+                    for chave in ('ids', 'nomes', 'textos'):
+                        contato[chave] = [v for v, ok in zip(contato[chave], saiu) if not ok]
+                    record_sent_today(st.session_state.username, e.enviadas)
+                    success_count += len(parcial['ids'])
+                    _register_result(parcial, "enviado", resultados_lote, writeback)
+                    enviados_lote.extend(parcial['ids'])
+                    contato['mensagem'] = contato['mensagem'][e.enviadas:]
+                    contato['anexo_enviado'] = True
+                if getattr(e, 'anexo_enviado', False):
+                    # O anexo saiu e só o texto separado falhou: reenviar apenas o texto
+                    contato['anexo_enviado'] = True
             
-            # Navegar para o chat específico
-            link = f"https://web.whatsapp.com/send?phone={phone_no}&text={msg_encoded}"
-            driver.get(link)
+                categoria = classify_error(e)
+                if categoria == FALHA_SESSAO:
+                    # Não é culpa do contato: volta para o início da fila depois da reconexão
+                    if not sessao_perdida:
+                        with log_container:
+                            st.warning(f"🔌 Sessão perdida ao enviar para {nome} ({e}). Reconectando...")
+                    sessao_perdida.append(contato)
+                    continue
             
-            # Esperar até que a caixa de texto ou o botão de envio esteja carregado
-            try:
-                # Esperar o botão de enviar aparecer e ser clicável
-                send_button = WebDriverWait(driver, 25).until(
-                    EC.element_to_be_clickable((By.XPATH, '//span[@data-icon="send"]'))
-                )
-                time.sleep(1) 
-                send_button.click()
-                success_sent = True
-            except:
-                # Fallback: Tentar pressionar ENTER na caixa de texto
-                try:
-                    chat_box = driver.find_element(By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]')
-                    chat_box.send_keys(Keys.ENTER)
-                    success_sent = True
-                except:
-                    success_sent = False
-
-            if success_sent:
-                # Esperar um pouco para garantir o envio
-                time.sleep(3) 
-                success_count += 1
-                with log_container:
-                    st.success(f"✅ {nome} - Mensagem enviada!")
-            else:
-                # Se falhar ambos, verificar se o número é inválido
-                try:
-                    invalid_popup = driver.find_element(By.XPATH, '//div[contains(text(), "inválido")]')
+                contato['tentativa'] += 1
+                if categoria == FALHA_TRANSIENTE and contato['tentativa'] < RETRY_MAX_TENTATIVAS:
+                    espera = backoff_delay(contato['tentativa'])
+                    heapq.heappush(fila_reenvio, (time.time() + espera, next(seq), contato))
                     with log_container:
-                        st.warning(f"⚠️ {nome} - Número inválido ou não tem WhatsApp.")
-                    error_count += 1
-                except:
-                    raise Exception("Não foi possível encontrar o botão de enviar nem a caixa de texto.")
-
+                        st.info(f"🔁 {nome} - Falha temporária ({e}). Nova tentativa em {espera}s.")
+                else:
+                    error_count += len(contato['ids'])
+                    concluidos += 1
+                    _register_result(contato, "erro", resultados_lote, writeback, str(e))
+                    with log_container:
+                        if categoria == FALHA_PERMANENTE:
+                            st.warning(f"⚠️ {nome} - {e}")
+                        else:
+                            st.error(f"❌ {nome} - Erro após {contato['tentativa']} tentativas: {str(e)}")
+        
+            if sessao_perdida:
+                pendentes.extendleft(reversed(sessao_perdida))
+                reconectou = False
+                if reconexoes < RECONEXAO_MAX:
+                    reconexoes += 1
+                    status_text.markdown(f"🔌 Reconectando ({transport.nome}, tentativa {reconexoes}/{RECONEXAO_MAX})...")
+                    reconectou = reconnect_transport(transport, headless=headless)
+                if not reconectou:
+                    interrompida = f"Não foi possível reconectar ({transport.nome})."
+                    break
+                with log_container:
+                    st.info("✅ Sessão restabelecida. Continuando o envio.")
+                continue
+        
+            progress_bar.progress(concluidos / total)
+            if job_id is not None:
+                get_campaign_queue().progress(job_id, total - concluidos)
+            if campanha_id is not None and len(resultados_lote) >= RESULTADOS_LOTE:
+                results_store.record_results(campanha_id, resultados_lote)
+                resultados_lote = []
+            if impressoes is not None and len(enviados_lote) >= RESULTADOS_LOTE:
+                save_sent_fingerprints(impressoes, enviados_lote)
+                enviados_lote = []
+            if writeback is not None:
+                writeback.maybe_flush()
+        
             # Aguardar antes do próximo envio
-            if index < total - 1:
+            if pendentes or fila_reenvio:
                 status_text.markdown(f"⏳ Aguardando {delay} segundos...")
                 time.sleep(delay)
-                
-        except Exception as e:
-            error_count += 1
+    
+        if interrompida:
+            restantes = list(pendentes) + [c for _, _, c in fila_reenvio]
+            error_count += sum(len(c['ids']) for c in restantes)
+            for c in restantes:
+                _register_result(c, "erro", resultados_lote, writeback, f"Campanha interrompida: {interrompida}")
             with log_container:
-                st.error(f"❌ {nome} - Erro: {str(e)}")
-        
-        progress = (index + 1) / total
-        progress_bar.progress(progress)
+                st.error(f"⛔ Campanha interrompida: {interrompida} {len(restantes)} contatos não foram enviados.")
+    
+    finally:
+        # Um clique em qualquer widget reexecuta o script e interrompe o laço no meio:
+        # os resultados e impressões ainda em buffer são gravados mesmo assim
+        if campanha_id is not None:
+            results_store.record_results(campanha_id, resultados_lote)
+        if impressoes is not None:
+            save_sent_fingerprints(impressoes, enviados_lote)
+        if writeback is not None:
+            gravou_planilha = writeback.flush()
+    if not gravou_planilha and writeback.ultimo_erro:
+        st.warning(f"⚠️ Não foi possível gravar o status na planilha: {writeback.ultimo_erro}")
         
     status_text.empty()
     progress_bar.empty()
     
     return success_count, error_count
 
+# =====================================================
+# MODO DE PERFIL (TEMPO DE CADA SEÇÃO DO RERUN)
+# =====================================================
+# Cada interação reexecuta o app.py inteiro. Com o modo de perfil ligado,
+# profile_lap("seção") marca o fim de cada trecho da página e o tempo desde
+# a marca anterior é atribuído a ele. O histórico dos últimos reruns fica
+# na sessão e o painel da barra lateral mostra as seções mais lentas.
+
+PERFIL_HISTORICO = 50      # Reruns guardados no histórico
+PERFIL_CPROFILE_LINHAS = 40
+
+def profile_finish():
+    """Fecha as medições do rerun atual (se houver) e o cProfile pedido"""
+    rerun = st.session_state.get('perfil_rerun')
+    if rerun is not None:
+        del st.session_state['perfil_rerun']
+        if 'perfil_historico' not in st.session_state:
+            st.session_state.perfil_historico = deque(maxlen=PERFIL_HISTORICO)
+        st.session_state.perfil_historico.append({
+            'secoes': rerun['secoes'],
+            'total': rerun['ultimo'] - rerun['inicio'],
+        })
+    
+    prof = st.session_state.get('perfil_cprofile')
+    if prof is not None:
+        del st.session_state['perfil_cprofile']
+        prof.disable()
+        saida = io.StringIO()
+        pstats.Stats(prof, stream=saida).sort_stats('cumulative').print_stats(PERFIL_CPROFILE_LINHAS)
+        st.session_state.perfil_cprofile_texto = saida.getvalue()
+        # Arquivo .prof para abrir no snakeviz / pstats
+        path = f"perfil_{st.session_state.get('username') or 'anonimo'}.prof"
+        prof.dump_stats(path)
+        st.session_state.perfil_cprofile_arquivo = path
+
+def profile_start():
+    """Início do rerun: fecha as medições pendentes do rerun anterior e começa as deste"""
+    profile_finish()
+    if not st.session_state.get('perfil_ativo'):
+        return
+    agora = time.perf_counter()
+    st.session_state.perfil_rerun = {'inicio': agora, 'ultimo': agora, 'secoes': {}}
+    if st.session_state.get('perfil_cprofile_pedido'):
+        st.session_state.perfil_cprofile_pedido = False
+        prof = cProfile.Profile()
+        prof.enable()
+        st.session_state.perfil_cprofile = prof
+
+def profile_lap(secao):
+    """Atribui à seção o tempo desde a marca anterior (sem efeito com o modo de perfil desligado)"""
+    rerun = st.session_state.get('perfil_rerun')
+    if rerun is None:
+        return
+    agora = time.perf_counter()
+    rerun['secoes'][secao] = rerun['secoes'].get(secao, 0) + agora - rerun['ultimo']
+    rerun['ultimo'] = agora
+
+def profile_summary():
+    """Média, máximo e último tempo (ms) de cada seção no histórico, da mais lenta para a mais rápida"""
+    historico = st.session_state.get('perfil_historico') or []
+    tempos = {}
+    for rerun in historico:
+        for secao, segundos in rerun['secoes'].items():
+            tempos.setdefault(secao, []).append(segundos * 1000)
+    linhas = [
+        {'Seção': secao, 'Média (ms)': sum(v) / len(v), 'Máx (ms)': max(v), 'Último (ms)': v[-1], 'Reruns': len(v)}
+        for secao, v in tempos.items()
+    ]
+    return sorted(linhas, key=lambda l: l['Média (ms)'], reverse=True)
+
 # Configuração da página
 st.set_page_config(
     page_title="WhatsApp Massa",
@@ -249,6 +1292,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+profile_start()
+
 # =====================================================
 # SISTEMA DE LOGIN
 # =====================================================
@@ -289,6 +1334,7 @@ def check_login(username, password):
 def do_logout():
     """Realiza logout e limpa a sessão"""
     # Fechar navegador se estiver aberto
+    stop_reply_collector()
     if st.session_state.get('driver'):
         try:
             st.session_state.driver.quit()
@@ -410,6 +1456,7 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
+profile_lap("CSS")
 
 # =====================================================
 # TELA DE LOGIN (aparece se não está logado)
@@ -537,6 +1584,12 @@ with st.sidebar:
     
     use_gsheets = st.toggle("Usar Dados do Google Sheets", value=False)
     
+    gravar_status = st.toggle(
+        "📝 Gravar status na planilha",
+        value=False,
+        help="Grava status, data/hora e erro de cada linha numa aba 'Resultados Envio' (em lotes, durante o envio)"
+    )
+    
     st.markdown("---")
     
     # Configurações de envio
@@ -548,6 +1601,101 @@ with st.sidebar:
         value=20,
         help="Tempo de espera entre cada envio para evitar bloqueios"
     )
+    modo_delta = st.toggle(
+        "🔁 Só linhas novas ou alteradas",
+        value=False,
+        help="Envia apenas para as linhas desta lista que ainda não receberam este mesmo texto "
+             "(telefones novos ou com texto alterado desde o último envio)"
+    )
+    modo_agrupar = st.selectbox(
+        "Mesmo telefone em várias linhas",
+        AGRUPAR_MODOS,
+        index=0,
+        help="Agrupar abre a conversa uma vez por telefone: ou junta os textos numa mensagem só, "
+             "ou digita as mensagens em sequência na conversa já aberta"
+    )
+    arquivo_anexo = st.file_uploader(
+        "📎 Anexo da campanha (opcional)",
+        help="Imagem, vídeo, áudio ou PDF enviado com todas as mensagens (a mensagem vira a legenda). "
+             "Para um anexo por contato, use a coluna 'Anexo' da planilha com o link do arquivo ou o nome dele "
+             "na pasta de anexos do servidor."
+    )
+    anexo_campanha = None
+    if arquivo_anexo is not None:
+        anexo_campanha = Anexo(arquivo_anexo.name, arquivo_anexo.getvalue(), arquivo_anexo.type or None)
+        if len(anexo_campanha.dados) > ANEXO_MAX_BYTES:
+            st.error(f"❌ O anexo passa do limite de {ANEXO_MAX_BYTES // (1024 * 1024)} MB do WhatsApp.")
+            anexo_campanha = None
+        else:
+            st.caption(f"📎 {anexo_campanha.nome} · {len(anexo_campanha.dados) / (1024 * 1024):.1f} MB · preparado uma vez por sessão")
+
+    st.markdown("---")
+    
+    # Janela de envio da conta (guardada por usuário, vale para todas as sessões dele)
+    st.markdown("### 📅 Janela de Envio")
+    janela_envio = get_send_windows().setdefault(st.session_state.username, default_send_window())
+    janela_envio['ativa'] = st.toggle(
+        "Enviar somente na janela permitida",
+        value=janela_envio['ativa'],
+        help="Fora do horário/dias permitidos (ou ao atingir o limite diário) o envio pausa e continua na próxima janela"
+    )
+    col_jan_ini, col_jan_fim = st.columns(2)
+    with col_jan_ini:
+        janela_envio['inicio'] = st.time_input("Das", value=janela_envio['inicio'], disabled=not janela_envio['ativa'])
+    with col_jan_fim:
+        janela_envio['fim'] = st.time_input("Até", value=janela_envio['fim'], disabled=not janela_envio['ativa'])
+    dias_escolhidos = st.multiselect(
+        "Dias permitidos",
+        DIAS_SEMANA,
+        default=[DIAS_SEMANA[d] for d in janela_envio['dias']],
+        disabled=not janela_envio['ativa']
+    )
+    janela_envio['dias'] = [DIAS_SEMANA.index(d) for d in dias_escolhidos]
+    janela_envio['limite_diario'] = st.number_input(
+        "Limite diário de mensagens (0 = sem limite)",
+        min_value=0,
+        value=janela_envio['limite_diario'],
+        step=50,
+        disabled=not janela_envio['ativa']
+    )
+    if janela_envio['ativa'] and janela_envio['limite_diario']:
+        st.caption(f"Hoje esta conta já enviou {sent_today(st.session_state.username)} de {janela_envio['limite_diario']} mensagens.")
+    if janela_envio['ativa'] and janela_envio['inicio'] >= janela_envio['fim']:
+        st.error("❌ O horário inicial da janela deve ser anterior ao final.")
+        janela_envio['ativa'] = False
+    
+    # Agendamento do início da campanha
+    inicio_agendado = None
+    if st.toggle("Agendar início do envio", value=False):
+        col_ag_dia, col_ag_hora = st.columns(2)
+        with col_ag_dia:
+            dia_agendado = st.date_input("Dia", value=datetime.now().date(), format="DD/MM/YYYY")
+        with col_ag_hora:
+            hora_agendada = st.time_input("Hora", value=janela_envio['inicio'])
+        inicio_agendado = datetime.combine(dia_agendado, hora_agendada)
+
+    st.markdown("---")
+    
+    # Meio de envio
+    st.markdown("### 📡 Meio de Envio")
+    meio_envio = st.selectbox(
+        "Transporte",
+        [SeleniumTransport.nome, HttpApiTransport.nome, PyWhatKitTransport.nome],
+        help="WhatsApp Web (navegador controlado pelo robô), API HTTP no estilo WhatsApp Business ou PyWhatKit (somente local)"
+    )
+    if meio_envio == HttpApiTransport.nome:
+        api_url = st.text_input("URL base da API", value="https://graph.facebook.com/v19.0")
+        api_phone_id = st.text_input("ID do número remetente (phone_number_id)")
+        api_token = st.text_input("Token de acesso", type="password")
+        api_batch_path = st.text_input(
+            "Endpoint de lote (opcional)",
+            help="Se a API aceitar vários envios numa requisição, informe o caminho (ex: messages/batch)"
+        )
+        col_api1, col_api2 = st.columns(2)
+        with col_api1:
+            api_concorrencia = st.number_input("Requisições simultâneas", min_value=1, max_value=64, value=8)
+        with col_api2:
+            api_lote = st.number_input("Mensagens por lote", min_value=1, max_value=500, value=20)
 
     st.markdown("---")
     
@@ -562,10 +1710,61 @@ with st.sidebar:
         key="force_visible",
         help="Ative para ver o navegador abrindo uma janela. Desative para rodar em segundo plano (Headless)."
     )
+    
+    # Broker: processo separado que mantém navegadores e campanhas vivos quando o app reinicia
+    broker_online = broker.is_running()
+    usar_broker = st.toggle(
+        "Usar o broker de navegadores",
+        value=broker_online,
+        disabled=not broker_online,
+        help="Com o broker (python broker.py) rodando, o navegador e o envio pelo WhatsApp Web ficam nele: "
+             "reiniciar ou reimplantar o app não derruba a sessão nem a campanha em andamento."
+    ) and broker_online
+    if broker_online:
+        st.caption(f"🟢 Broker ativo em {broker.ENDERECO_PADRAO}")
+    else:
+        st.caption("⚪ Broker não encontrado (rode `python broker.py` para usar).")
 
     
     st.markdown("---")
     
+    # Modo de perfil: tempo de cada seção do rerun
+    st.markdown("### ⏱️ Desempenho")
+    st.toggle(
+        "Modo de Perfil",
+        key="perfil_ativo",
+        help="Mede quanto tempo cada seção da página leva a cada interação"
+    )
+    if st.session_state.get('perfil_ativo'):
+        resumo_perfil = profile_summary()
+        if resumo_perfil:
+            historico_perfil = st.session_state.perfil_historico
+            st.caption(
+                f"Últimos {len(historico_perfil)} reruns · média "
+                f"{sum(r['total'] for r in historico_perfil) / len(historico_perfil) * 1000:.0f} ms"
+            )
+            st.dataframe(
+                pd.DataFrame(resumo_perfil[:8]).round(1),
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("Interaja com a página para coletar medições.")
+        
+        if st.button("🧪 Gerar cProfile do próximo rerun", use_container_width=True):
+            st.session_state.perfil_cprofile_pedido = True
+            st.rerun()
+        if st.session_state.get('perfil_cprofile_texto'):
+            with st.expander("cProfile (por tempo acumulado)"):
+                st.code(st.session_state.perfil_cprofile_texto)
+            arquivo_perfil = st.session_state.get('perfil_cprofile_arquivo')
+            if arquivo_perfil and os.path.exists(arquivo_perfil):
+                with open(arquivo_perfil, "rb") as f:
+                    st.download_button("📥 Baixar .prof", data=f.read(), file_name=arquivo_perfil,
+                                       use_container_width=True)
+    
+    st.markdown("---")
+    
     # Informações
     st.markdown("### ℹ️ Informações")
     st.info("""
@@ -583,6 +1782,7 @@ with st.sidebar:
     - Não use o mouse durante o envio
     - Intervalos curtos podem causar bloqueio
     """)
+profile_lap("Cabeçalho e barra lateral")
 
 # Função para carregar dados
 @st.cache_data
@@ -628,72 +1828,262 @@ def format_phone(phone):
         
     return '+' + phone_str
 
-# Função para enviar mensagens
-def send_messages(df, delay):
-    """Envia mensagens via WhatsApp"""
-    total = len(df)
-    success_count = 0
-    error_count = 0
+# =====================================================
+# EDITOR PAGINADO DE CONTATOS (DELTA SOBRE A TABELA ORIGINAL)
+# =====================================================
+# A tabela carregada fica imutável em st.session_state.editor_source e as
+# edições feitas na tela são guardadas como um log compacto de alterações
+# (st.session_state.editor_delta). Só a página atual é enviada ao navegador;
+# o delta é aplicado na lista inteira apenas no momento do envio.
+
+EDITOR_COLUMNS = ['Nome', 'Telefone', 'texto']
+EDITOR_OPTIONAL_COLUMNS = ['Anexo']   # Mantidas no editor quando existem na planilha
+EDITOR_PAGE_SIZES = [25, 50, 100, 250]
+
+def empty_editor_delta():
+    """Log de alterações vazio"""
+    return {
+        'edits': {},          # id da linha -> {coluna: novo valor}
+        'deleted': set(),     # ids de linhas removidas da tabela original
+        'added': {},          # id novo -> {coluna: valor} (linhas incluídas na tela)
+        'normalizar': False,  # "Limpar e Corrigir Números" aplicado (lazy)
+    }
+
+def reset_editor(df):
+    """Define a tabela original do editor e descarta as edições"""
+    colunas = EDITOR_COLUMNS + [c for c in EDITOR_OPTIONAL_COLUMNS if c in df.columns]
+    source = df[colunas].copy().reset_index(drop=True)
+    # Forçar Telefone para string para evitar erros no st.data_editor
+    source['Telefone'] = source['Telefone'].astype(str)
+    st.session_state.editor_source = source
+    # Coluna de busca pré-calculada (evita converter 3 colunas a cada rerun)
+    st.session_state.editor_busca = (
+        source['Nome'].astype(str) + ' ' + source['Telefone'] + ' ' + source['texto'].astype(str)
+    ).str.lower()
+    st.session_state.editor_delta = empty_editor_delta()
+    st.session_state.editor_next_id = len(source)
+    st.session_state.editor_versao = st.session_state.get('editor_versao', 0) + 1
+
+def count_editor_changes(delta):
+    """Quantidade de alterações registradas no delta"""
+    return len(delta['edits']) + len(delta['deleted']) + len(delta['added'])
+
+def count_editor_rows(source, delta):
+    """Quantidade de linhas da lista editada, sem materializá-la"""
+    return len(source) - len(delta['deleted']) + len(delta['added'])
+
+def _normalize_editor_phones(df):
+    """Aplica format_phone na coluna Telefone (quando "Limpar e Corrigir" foi acionado)"""
+    df['Telefone'] = df['Telefone'].fillna('').astype(str).apply(format_phone)
+    return df
+
+def editor_view_ids(source, busca, delta, filtro=""):
+    """Ids das linhas visíveis no editor (na ordem), aplicando remoções e o filtro de busca"""
+    visivel = ~source.index.isin(list(delta['deleted']))
+    termo = filtro.strip().lower()
     
-    # Containers para feedback
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    if termo:
+        visivel &= busca.str.contains(termo, regex=False).to_numpy()
+        # Linhas editadas: o filtro deve considerar o valor novo, não o original
+        for rid, cols in delta['edits'].items():
+            if rid in delta['deleted']:
+                continue
+            valores = {**source.loc[rid].to_dict(), **cols}
+            visivel[rid] = termo in ' '.join(str(valores[c]) for c in EDITOR_COLUMNS).lower()
     
-    # Log de envios
-    log_container = st.expander("📋 Log de Envios", expanded=True)
+    ids = source.index[visivel].tolist()
+    for rid, valores in delta['added'].items():
+        if not termo or termo in ' '.join(str(valores.get(c) or '') for c in EDITOR_COLUMNS).lower():
+            ids.append(rid)
+    return ids
+
+def materialize_editor_rows(source, delta, ids):
+    """Monta somente as linhas pedidas, com as edições aplicadas"""
+    src_ids = [rid for rid in ids if rid not in delta['added']]
+    page = source.loc[src_ids].copy()
+    for rid in src_ids:
+        for col, valor in delta['edits'].get(rid, {}).items():
+            page.at[rid, col] = valor
     
-    for index, row in df.iterrows():
-        try:
-            nome = row['Nome']
-            telefone_bruto = row['Telefone']
-            telefone = format_phone(telefone_bruto)
-            mensagem = row['texto']
-            
-            # Validação básica de comprimento (DDI + DDD + 9 + 8 dígitos = 13 dígitos, ou sem o 9 extra = 12)
-            if len(telefone) < 13:
-                raise ValueError(f"Número de telefone inválido (muito curto): {telefone}")
+    novos = [rid for rid in ids if rid in delta['added']]
+    if novos:
+        added_df = pd.DataFrame.from_dict(
+            {rid: delta['added'][rid] for rid in novos}, orient='index', columns=source.columns
+        )
+        page = pd.concat([page, added_df]).reindex(ids)
+    
+    if delta['normalizar']:
+        page = _normalize_editor_phones(page)
+    return page
 
-            # Atualizar status
-            status_text.markdown(f"**Enviando para:** {nome} ({telefone})")
-            
-            # Enviar mensagem instantaneamente usando pywhatkit (Se disponível)
-            if not HAS_PYWHATKIT:
-                raise Exception("O módulo PyWhatKit não está disponível neste ambiente.")
-                
-            kit.sendwhatmsg_instantly(
-                phone_no=telefone, 
-                message=mensagem, 
-                wait_time=25, 
-                tab_close=True, 
-                close_time=10
-            )
-            
-            success_count += 1
-            
-            with log_container:
-                st.success(f"✅ {nome} ({telefone}) - Mensagem enviada!")
-            
-            # Aguardar antes do próximo envio
-            if index < total - 1:  # Não esperar no último envio
-                status_text.markdown(f"⏳ Aguardando {delay} segundos antes do próximo envio...")
-                time.sleep(delay)
-            
-        except Exception as e:
-            error_count += 1
-            with log_container:
-                st.error(f"❌ {nome} - Erro: {str(e)}")
-        
-        # Atualizar barra de progresso
-        progress = (index + 1) / total
-        progress_bar.progress(progress)
+def apply_editor_delta(source, delta):
+    """Aplica o log de alterações na tabela original inteira (usado no disparo da campanha)
     
-    # Finalizar
-    status_text.empty()
-    progress_bar.empty()
+    O índice do resultado é o id de cada linha: para linhas da planilha, a
+    posição original (usada para gravar o status de volta na linha certa).
+    """
+    df = source.drop(index=list(delta['deleted']))
+    for rid, cols in delta['edits'].items():
+        if rid in df.index:
+            for col, valor in cols.items():
+                df.at[rid, col] = valor
+    if delta['added']:
+        added_df = pd.DataFrame.from_dict(delta['added'], orient='index', columns=source.columns)
+        df = pd.concat([df, added_df])
+    if delta['normalizar']:
+        df = _normalize_editor_phones(df)
+    return df
+
+def _register_page_changes(widget_key, page_ids):
+    """Callback do st.data_editor: converte as alterações da página (por posição) em entradas do delta"""
+    mudancas = st.session_state.get(widget_key) or {}
+    delta = st.session_state.editor_delta
     
-    return success_count, error_count
+    for pos, cols in mudancas.get('edited_rows', {}).items():
+        rid = page_ids[int(pos)]
+        if rid in delta['added']:
+            delta['added'][rid].update(cols)
+        else:
+            delta['edits'].setdefault(rid, {}).update(cols)
+    
+    for pos in mudancas.get('deleted_rows', []):
+        rid = page_ids[int(pos)]
+        if rid in delta['added']:
+            del delta['added'][rid]
+        else:
+            delta['deleted'].add(rid)
+            delta['edits'].pop(rid, None)
+    
+    for novo in mudancas.get('added_rows', []):
+        rid = st.session_state.editor_next_id
+        st.session_state.editor_next_id += 1
+        delta['added'][rid] = {col: novo.get(col) for col in st.session_state.editor_source.columns}
+    
+    # Nova chave para o widget: a página é remontada a partir do delta atualizado
+    st.session_state.editor_versao += 1
+
+def build_transport():
+    """Cria o transporte (meio de envio) escolhido na barra lateral"""
+    if meio_envio == HttpApiTransport.nome:
+        return HttpApiTransport(
+            api_url,
+            token=api_token,
+            phone_number_id=api_phone_id,
+            concorrencia=api_concorrencia,
+            lote=api_lote,
+            batch_path=api_batch_path or None,
+        )
+    if meio_envio == PyWhatKitTransport.nome:
+        return PyWhatKitTransport()
+    return SeleniumTransport(st.session_state.driver)
+
+def build_writeback(df_origem):
+    """Cria o buffer de gravação do status conforme a fonte de dados atual. Retorna (writeback, descrição)"""
+    if use_gsheets and gsheets_url:
+        conn = st.connection("gsheets", type=GSheetsConnection)
+        destino = gsheets_destination(conn, gsheets_url)
+        descricao = "a aba 'Resultados Envio' da planilha Google"
+    elif uploaded_file is not None:
+        # O arquivo enviado só existe em memória: gravar numa cópia local, oferecida para download
+        path = f"resultados_{os.path.splitext(uploaded_file.name)[0]}.xlsx"
+        df_origem.to_excel(path, sheet_name="Contatos", index=False)
+        st.session_state.writeback_arquivo = path
+        destino = excel_destination(path)
+        descricao = f"o arquivo {path}"
+    else:
+        destino = excel_destination(default_file)
+        descricao = f"a aba 'Resultados Envio' de {default_file}"
+    return ResultWriteback(destino, linhas_origem=len(df_origem)), descricao
+
+def delta_source_key():
+    """Identifica a lista atual (planilha Google, arquivo enviado ou padrão) para o snapshot delta"""
+    if use_gsheets and gsheets_url:
+        return f"gsheets:{gsheets_url}"
+    if uploaded_file is not None:
+        return f"arquivo:{uploaded_file.name}"
+    return f"arquivo:{default_file}"
+
+def broker_command(comando, **argumentos):
+    """Executa um comando no broker para o operador logado. Mostra o erro e retorna None se falhar"""
+    try:
+        return broker.call(comando, usuario=st.session_state.username, **argumentos)
+    except (OSError, EOFError, broker.BrokerError) as e:
+        st.error(f"❌ Broker: {e}")
+        return None
+
+def broker_unsupported_options(campanha_df):
+    """Opções ligadas nesta campanha que o envio pelo broker ainda não respeita"""
+    opcoes = []
+    if anexo_campanha is not None or (
+        'Anexo' in campanha_df.columns and campanha_df['Anexo'].map(attachment_reference).notna().any()
+    ):
+        opcoes.append("anexos")
+    if janela_envio['ativa']:
+        opcoes.append("janela de envio")
+    if inicio_agendado is not None:
+        opcoes.append("agendamento do início")
+    if modo_agrupar != AGRUPAR_NAO:
+        opcoes.append("agrupamento por telefone")
+    if modo_delta:
+        opcoes.append("registro do envio para o modo delta")
+    return opcoes
+
+def coordinator_rows(campanha_df):
+    """Linhas da campanha no formato do banco de coordenação (broker e nós distribuídos)"""
+    return [
+        {
+            "linha_id": int(linha_id),
+            "nome": str(row['Nome']),
+            "telefone": format_phone(row['Telefone']),
+            "mensagem": str(row['texto']),
+        }
+        for linha_id, row in campanha_df.iterrows()
+    ]
+
+def sync_distributed_fingerprints(campanhas):
+    """Grava no snapshot delta as linhas que os nós já enviaram das campanhas publicadas no modo delta
+
+    Cada linha é gravada uma vez por sessão (a gravação é idempotente, então
+    reabrir o app só grava de novo o que já estava lá).
+    """
+    gravadas = st.session_state.setdefault('delta_distribuidas_gravadas', {})
+    for campanha in campanhas:
+        if not campanha.get('delta_fonte'):
+            continue
+        ja_gravadas = gravadas.setdefault(campanha['id'], set())
+        enviadas = coordinator.progress_summary(campanha['id'])['status'].get(coordinator.ENVIADO, 0)
+        if enviadas <= len(ja_gravadas):
+            continue
+        novas = [linha for linha in coordinator.sent_rows(campanha['id']) if linha['linha_id'] not in ja_gravadas]
+        tabela = row_fingerprints(pd.DataFrame({
+            'Telefone': [linha['telefone'] for linha in novas],
+            'texto': [linha['mensagem'] for linha in novas],
+        }))
+        results_store.save_snapshot(
+            campanha['usuario'], campanha['delta_fonte'], list(zip(tabela['impressao'], tabela['telefone_hash']))
+        )
+        bump_snapshot_version(campanha['usuario'], campanha['delta_fonte'])
+        ja_gravadas.update(linha['linha_id'] for linha in novas)
+
+def rows_to_send():
+    """Lista completa com as edições aplicadas e, no modo delta, só as linhas novas/alteradas
+
+    Retorna (DataFrame, impressoes) - impressoes é None fora do modo delta.
+    """
+    campanha_df = apply_editor_delta(st.session_state.editor_source, st.session_state.editor_delta)
+    if not modo_delta or campanha_df.empty:
+        return campanha_df, None
+    fonte = delta_source_key()
+    # O que os nós distribuídos já enviaram desta lista também conta como enviado
+    sync_distributed_fingerprints(
+        c for c in coordinator.list_campaigns(st.session_state.username) if c['delta_fonte'] == fonte
+    )
+    classes, tabela = classify_delta(campanha_df, st.session_state.username, fonte)
+    fila = classes != DELTA_ENVIADA
+    return campanha_df[fila], (st.session_state.username, fonte, tabela[fila])
 
 # Determinar fonte de dados
+default_file = "contatos.xlsx"
 if use_gsheets and gsheets_url:
     try:
         # Tentar ler usando o método direto de exportação (mais robusto para links públicos)
@@ -716,15 +2106,44 @@ elif uploaded_file is not None:
     df = load_data(uploaded_file)
 else:
     # Tentar carregar arquivo padrão
-    default_file = "contatos.xlsx"
     if os.path.exists(default_file):
         df = load_data(default_file)
     else:
         df = None
+profile_lap("Fonte de dados")
 
 # Interface principal
 if df is not None:
     if validate_data(df):
+        profile_lap("Validação")
+        
+        # Identificador simples para o arquivo (nome, link ou tamanho): chave do editor e dos caches abaixo
+        if use_gsheets and gsheets_url:
+            file_id = f"gsheets_{gsheets_url}_{df.shape}"
+        else:
+            file_id = f"{uploaded_file.name if uploaded_file else 'default'}_{df.shape}"
+        
+        # Modo delta: só entram na fila as linhas novas ou alteradas desde o último envio desta lista
+        # (hash da lista inteira: em cache até mudar o arquivo ou o snapshot)
+        total_fila = len(df)
+        versao_delta = None
+        if modo_delta:
+            fonte_delta = delta_source_key()
+            versao_delta = snapshot_version(st.session_state.username, fonte_delta)
+            classes_delta = cached_delta_classes(df, file_id, st.session_state.username, fonte_delta, versao_delta)
+            contagem_delta = classes_delta.value_counts()
+            total_fila = len(df) - int(contagem_delta.get(DELTA_ENVIADA, 0))
+            profile_lap("Delta (impressões)")
+        
+        # Agrupamento por telefone: cada grupo é um envio (uma abertura de conversa)
+        envios_fila = total_fila
+        if modo_agrupar != AGRUPAR_NAO:
+            contagem_grupos = cached_grouping_counts(
+                df[classes_delta != DELTA_ENVIADA] if modo_delta else df, file_id, modo_agrupar, versao_delta
+            )
+            envios_fila = contagem_grupos[2]
+            profile_lap("Agrupamento por telefone")
+        
         # Estatísticas
         col1, col2, col3 = st.columns(3)
         
@@ -745,8 +2164,15 @@ if df is not None:
             </div>
             """, unsafe_allow_html=True)
         
+        # Estimativa com a latência medida da conta (não só o intervalo do slider)
+        segundos_msg = seconds_per_message(st.session_state.username, delay_between_messages)
+        inicio_plano = max(inicio_agendado or datetime.now(), datetime.now())
+        plano_envio, termino_previsto = plan_campaign(
+            envios_fila, inicio_plano, janela_envio, segundos_msg, enviados_hoje=sent_today(st.session_state.username)
+        )
+        
         with col3:
-            estimated_time = len(df) * delay_between_messages / 60
+            estimated_time = envios_fila * segundos_msg / 60
             st.markdown(f"""
             <div class="stat-card">
                 <p class="stat-number">{estimated_time:.1f}</p>
@@ -754,49 +2180,107 @@ if df is not None:
             </div>
             """, unsafe_allow_html=True)
         
+        latencia = measured_latency(st.session_state.username)
+        origem_latencia = (
+            f"latência medida de {latencia:.0f}s" if latencia is not None
+            else f"latência padrão de {OVERHEAD_PADRAO_SEGUNDOS}s (ainda sem medições)"
+        )
+        if envios_fila == 0:
+            st.caption("✅ Nada a enviar: nenhuma linha na fila.")
+        elif termino_previsto:
+            st.caption(
+                f"🏁 Término previsto: **{termino_previsto.strftime('%d/%m/%Y %H:%M')}** "
+                f"em {len(plano_envio)} dia(s) de envio · {segundos_msg:.0f}s por mensagem ({origem_latencia} + intervalo)"
+            )
+        else:
+            st.caption("⚠️ A campanha não cabe nas janelas de envio configuradas. Revise horários, dias ou limite diário.")
+        if janela_envio['ativa'] and plano_envio:
+            with st.expander("📅 Planejamento por dia", expanded=False):
+                st.dataframe(pd.DataFrame(plano_envio), use_container_width=True, hide_index=True)
+        if modo_delta:
+            col_delta, col_esquecer = st.columns([3, 1])
+            with col_delta:
+                st.caption(
+                    f"🔁 Modo delta: **{total_fila}** de {len(df)} linhas na fila — "
+                    f"{int(contagem_delta.get(DELTA_NOVA, 0))} novas, "
+                    f"{int(contagem_delta.get(DELTA_ALTERADA, 0))} com texto alterado, "
+                    f"{int(contagem_delta.get(DELTA_ENVIADA, 0))} já enviadas (ignoradas)."
+                )
+            with col_esquecer:
+                if st.button("🗑️ Esquecer envios", use_container_width=True,
+                             help="Apaga o histórico de envios desta lista: a próxima campanha vai para todos"):
+                    apagadas = results_store.clear_snapshot(st.session_state.username, delta_source_key())
+                    bump_snapshot_version(st.session_state.username, delta_source_key())
+                    st.toast(f"🗑️ {apagadas} impressões apagadas.")
+                    st.rerun()
+        if modo_agrupar != AGRUPAR_NAO:
+            if envios_fila < total_fila:
+                navegacoes, minutos_economizados = grouping_savings(contagem_grupos, segundos_msg)
+                st.caption(
+                    f"👥 {total_fila} linhas em {envios_fila} conversas: {navegacoes} aberturas de conversa "
+                    f"a menos, ~{minutos_economizados:.0f} min economizados."
+                )
+            else:
+                st.caption("👥 Nenhum telefone repetido na fila.")
+        
         st.markdown("---")
+        profile_lap("Estatísticas e estimativa")
         
         # Edição dos dados
         st.markdown("### ✏️ Editar e Visualizar Contatos")
         st.info("💡 **Dica:** Você pode adicionar, remover ou editar contatos diretamente na tabela abaixo. Clique em **Limpar e Corrigir** para ajustar automaticamente os números.")
         
         # Inicializar estado da tabela se não existir ou se for um novo arquivo
-        # Identificador simples para o arquivo (nome, link ou tamanho)
-        if use_gsheets and gsheets_url:
-            file_id = f"gsheets_{gsheets_url}_{df.shape}"
-        else:
-            file_id = f"{uploaded_file.name if uploaded_file else 'default'}_{df.shape}"
-        
         if "current_file_id" not in st.session_state or st.session_state.current_file_id != file_id:
             st.session_state.current_file_id = file_id
-            new_df = df[['Nome', 'Telefone', 'texto']].copy()
-            # Forçar Telefone para string para evitar erros no st.data_editor
-            new_df['Telefone'] = new_df['Telefone'].astype(str)
-            st.session_state.editor_data = new_df
+            reset_editor(df)
+        
+        editor_source = st.session_state.editor_source
+        editor_delta = st.session_state.editor_delta
         
         # Botões de Ação para a Tabela
         col_actions1, col_actions2, col_dummy = st.columns([1, 1, 2])
         
         with col_actions1:
             if st.button("🧹 Limpar e Corrigir Números", help="Remove formatação errada e padroniza para +55..."):
-                # Aplicar formatação em todos os números da tabela atual
-                try:
-                    st.session_state.editor_data['Telefone'] = st.session_state.editor_data['Telefone'].apply(format_phone)
-                    st.toast("✅ Números corrigidos com sucesso!", icon="✨")
-                    st.rerun()
-                except Exception as e:
-                    st.error(f"Erro ao corrigir: {e}")
+                # Marcar a correção no delta: ela é aplicada em cada linha só quando exibida/enviada
+                editor_delta['normalizar'] = True
+                st.session_state.editor_versao += 1
+                st.toast("✅ Números corrigidos com sucesso!", icon="✨")
+                st.rerun()
 
         with col_actions2:
             if st.button("🔄 Recarregar do Arquivo Origem", help="Descarta edições e volta para o arquivo original"):
-                st.session_state.editor_data = df[['Nome', 'Telefone', 'texto']].copy()
+                reset_editor(df)
                 st.rerun()
 
-        # Tabela editável (lendo e escrevendo no session_state)
-        edited_df = st.data_editor(
-            st.session_state.editor_data,
+        # Filtro e paginação (só a página atual vai para o navegador)
+        col_filtro, col_tamanho, col_pagina = st.columns([2, 1, 1])
+        with col_filtro:
+            filtro = st.text_input("🔎 Filtrar contatos", placeholder="Nome, telefone ou trecho da mensagem")
+        with col_tamanho:
+            page_size = st.selectbox("Linhas por página", EDITOR_PAGE_SIZES, index=1)
+        
+        view_ids = editor_view_ids(editor_source, st.session_state.editor_busca, editor_delta, filtro)
+        total_paginas = max(1, -(-len(view_ids) // page_size))
+        with col_pagina:
+            pagina = st.number_input("Página", min_value=1, max_value=total_paginas, value=1, step=1)
+        
+        page_ids = view_ids[(pagina - 1) * page_size:pagina * page_size]
+        page_df = materialize_editor_rows(editor_source, editor_delta, page_ids)
+        
+        st.caption(
+            f"Exibindo {len(page_ids)} de {len(view_ids)} contatos (página {pagina} de {total_paginas}) · "
+            f"{count_editor_changes(editor_delta)} alterações pendentes"
+        )
+        
+        # Tabela editável da página atual; as alterações vão para o delta via callback
+        widget_key = f"editor_contatos_ui_{st.session_state.editor_versao}_{pagina}_{page_size}_{filtro}"
+        st.data_editor(
+            page_df,
             num_rows="dynamic",
             use_container_width=True,
+            hide_index=True,
             column_config={
                 "Telefone": st.column_config.TextColumn(
                     "Telefone",
@@ -806,25 +2290,27 @@ if df is not None:
                 "texto": st.column_config.TextColumn(
                     "Mensagem",
                     width="large"
+                ),
+                "Anexo": st.column_config.TextColumn(
+                    "Anexo",
+                    help="Link ou nome do arquivo na pasta de anexos para este contato (vazio = anexo da campanha)"
                 )
             },
-            key="editor_contatos_ui"  # Key diferente para não conflitar
+            key=widget_key,
+            on_change=_register_page_changes,
+            args=(widget_key, page_ids),
         )
-        
-        # Sincronizar edições manuais de volta para o session_state para persistir
-        st.session_state.editor_data = edited_df
+        profile_lap("Editor de contatos")
 
-        # Preview da formatação (baseado no que está na tela)
+        # Preview da formatação (somente a página atual)
         with st.expander("👀 Ver Preview dos Números Formatados (Como será enviado)", expanded=False):
             try:
-                preview_df = edited_df.copy()
+                preview_df = page_df[['Nome', 'Telefone']].copy()
                 preview_df['Telefone Formatado'] = preview_df['Telefone'].apply(format_phone)
-                st.dataframe(
-                    preview_df[['Nome', 'Telefone', 'Telefone Formatado']],
-                    use_container_width=True
-                )
+                st.dataframe(preview_df, use_container_width=True, hide_index=True)
             except Exception:
                 st.warning("Preencha os dados corretamente para ver o preview.")
+        profile_lap("Preview")
 
         st.markdown("---")
         
@@ -832,8 +2318,17 @@ if df is not None:
         st.markdown("---")
         st.markdown("### 🚀 Controle de Envio")
         
-        # Verificar se há sessão ativa
-        has_active_session = check_driver_alive()
+        # Verificar se há sessão ativa (no broker ou neste processo)
+        estado_broker = None
+        if usar_broker:
+            try:
+                estado_broker = broker.call("status", usuario=st.session_state.username)
+            except (OSError, EOFError, broker.BrokerError) as e:
+                st.error(f"Erro ao consultar o broker: {e}")
+            has_active_session = bool(estado_broker and estado_broker["navegador"])
+        else:
+            has_active_session = check_driver_alive()
+        profile_lap("Verificação do navegador")
         
         # === INDICADOR DE STATUS DA SESSÃO ===
         if has_active_session:
@@ -891,15 +2386,20 @@ if df is not None:
             # --- BOTÃO: CONECTAR (só aparece se NÃO está conectado) ---
             if st.button("🔗 1. Conectar Meu WhatsApp", type="primary", use_container_width=True, 
                          help="Inicia um navegador e abre o WhatsApp Web para você escanear o QR Code"):
-                # Limpar driver antigo se estiver quebrado
-                check_driver_alive()
-                
-                with st.spinner("⏳ Iniciando navegador..."):
-                    driver = init_browser(headless=is_headless)
-                    if driver:
-                        driver.get("https://web.whatsapp.com")
-                        st.success("✅ Navegador iniciado! Expanda a seção abaixo para ver o QR Code.")
-                        st.rerun()
+                if usar_broker:
+                    with st.spinner("⏳ Iniciando navegador no broker..."):
+                        if broker_command("connect", headless=is_headless):
+                            st.rerun()
+                else:
+                    # Limpar driver antigo se estiver quebrado
+                    check_driver_alive()
+                    
+                    with st.spinner("⏳ Iniciando navegador..."):
+                        driver = init_browser(headless=is_headless)
+                        if driver:
+                            driver.get("https://web.whatsapp.com")
+                            st.success("✅ Navegador iniciado! Expanda a seção abaixo para ver o QR Code.")
+                            st.rerun()
         else:
             # --- BOTÕES: DESCONECTAR + NOVA SESSÃO (só aparecem se está conectado) ---
             col_disc1, col_disc2 = st.columns(2)
@@ -907,23 +2407,39 @@ if df is not None:
             with col_disc1:
                 if st.button("🔌 Desconectar WhatsApp", use_container_width=True,
                              help="Encerra sua sessão para que outro usuário possa usar"):
-                    close_browser()
+                    if usar_broker:
+                        broker_command("disconnect")
+                    else:
+                        close_browser()
                     st.info("✅ Sessão encerrada! Outro usuário pode conectar agora.")
                     st.rerun()
             
             with col_disc2:
                 if st.button("🔄 Reconectar (Novo QR Code)", use_container_width=True,
                              help="Fecha a sessão atual e inicia uma nova"):
-                    close_browser()
-                    with st.spinner("⏳ Reiniciando..."):
-                        driver = init_browser(headless=is_headless)
-                        if driver:
-                            driver.get("https://web.whatsapp.com")
-                            st.success("✅ Nova sessão iniciada! Escaneie o QR Code abaixo.")
-                            st.rerun()
+                    if usar_broker:
+                        with st.spinner("⏳ Reiniciando no broker..."):
+                            if broker_command("connect", headless=is_headless):
+                                st.rerun()
+                    else:
+                        close_browser()
+                        with st.spinner("⏳ Reiniciando..."):
+                            driver = init_browser(headless=is_headless)
+                            if driver:
+                                driver.get("https://web.whatsapp.com")
+                                st.success("✅ Nova sessão iniciada! Escaneie o QR Code abaixo.")
+                                st.rerun()
 
         # === VISUALIZAÇÃO DO WHATSAPP WEB ===
-        if st.session_state.driver:
+        if usar_broker and has_active_session:
+            with st.expander("📸 Ver Tela do WhatsApp (QR Code / Monitoramento)", expanded=not estado_broker["logado"]):
+                if st.button("🔄 Atualizar Captura de Tela"):
+                    pass  # Força rerun
+                screenshot = broker_command("screenshot")
+                if screenshot:
+                    st.image(screenshot, caption="Captura do WhatsApp Web (navegador no broker)",
+                             use_container_width=True)
+        elif st.session_state.driver:
             with st.expander("📸 Ver Tela do WhatsApp (QR Code / Monitoramento)", expanded=True):
                 if st.button("🔄 Atualizar Captura de Tela"):
                     pass  # Força rerun
@@ -935,20 +2451,320 @@ if df is not None:
                 except Exception as e:
                     st.error(f"Erro ao capturar tela: {e}")
                     st.info("💡 Tente clicar em 'Reconectar' para iniciar uma nova sessão.")
+        profile_lap("Controle da sessão e captura de tela")
 
         # === BOTÃO DE ENVIO ===
-        if has_active_session:
+        # Transportes que não usam o navegador (API HTTP, PyWhatKit) dispensam a sessão do WhatsApp Web
+        if has_active_session or meio_envio != SeleniumTransport.nome:
             st.markdown("---")
+            
+            # Fila compartilhada: campanhas de todos os operadores deste servidor
+            fila_campanhas = get_campaign_queue()
+            with st.expander("🧾 Fila de Campanhas do Servidor", expanded=False):
+                linhas_fila = fila_campanhas.snapshot()
+                if linhas_fila:
+                    st.dataframe(pd.DataFrame(linhas_fila), use_container_width=True, hide_index=True)
+                else:
+                    st.caption("Nenhuma campanha em andamento ou aguardando.")
+                st.caption(
+                    f"Até {fila_campanhas.max_concorrentes} campanhas simultâneas "
+                    f"({fila_campanhas.max_por_usuario} por operador)."
+                )
+            
+            prioridade = st.selectbox("Prioridade da campanha", list(PRIORIDADES), index=1)
+            if usar_broker and meio_envio == SeleniumTransport.nome:
+                st.caption(
+                    "🧩 Com o broker, a campanha começa na hora e roda fora da fila de campanhas do app "
+                    "(a prioridade não se aplica)."
+                )
+            
             if st.button("📨 2. Iniciar Envio em Massa", type="primary", use_container_width=True):
-                if len(edited_df) == 0:
-                    st.error("❌ A lista de contatos está vazia!")
+                # Aplicar as edições (e o filtro delta) na lista completa só agora, no disparo
+                campanha_df, impressoes_envio = rows_to_send()
+                total_campanha = len(campanha_df)
+                if total_campanha == 0:
+                    if modo_delta and count_editor_rows(st.session_state.editor_source, st.session_state.editor_delta):
+                        st.info("✅ Nenhuma linha nova ou alterada desde o último envio desta lista.")
+                    else:
+                        st.error("❌ A lista de contatos está vazia!")
+                elif usar_broker and meio_envio == SeleniumTransport.nome and broker_unsupported_options(campanha_df):
+                    st.error(
+                        f"❌ O broker ainda não suporta: {', '.join(broker_unsupported_options(campanha_df))}. "
+                        "Desative o broker (barra lateral) ou essas opções para enviar esta campanha."
+                    )
+                elif usar_broker and meio_envio == SeleniumTransport.nome:
+                    # O envio roda no broker, com o navegador dele: continua mesmo se o app reiniciar
+                    campanha_broker = broker_command(
+                        "submit", linhas=coordinator_rows(campanha_df), intervalo=delay_between_messages
+                    )
+                    if campanha_broker is not None:
+                        estado_broker = broker_command("status")
+                        st.success(f"✅ Campanha {campanha_broker} entregue ao broker ({total_campanha} linhas).")
                 else:
-                    st.markdown("### 📤 Enviando...")
-                    with st.spinner("O robô está trabalhando... Aguarde o envio ser concluído."):
-                        success, errors = send_messages_selenium(edited_df, delay_between_messages)
+                    # Agendamento e janela fechada: esperar fora da fila, sem ocupar vaga
+                    wait_for_start(inicio_agendado, janela_envio, st.empty(), st.session_state.username)
+                    job_id = fila_campanhas.submit(
+                        st.session_state.username, total_campanha, segundos_msg, PRIORIDADES[prioridade]
+                    )
+                    transport = None
+                    try:
+                        wait_for_queue_turn(fila_campanhas, job_id)
+                        transport = build_transport()
+                        campanha_id = results_store.create_campaign(st.session_state.username, total_campanha)
+                        st.session_state.ultima_campanha = campanha_id
+                        writeback, writeback_destino = build_writeback(df) if gravar_status else (None, None)
+                        st.markdown(f"### 📤 Enviando via {transport.nome}...")
+                        with st.spinner("O robô está trabalhando... Aguarde o envio ser concluído."), st.session_state.driver_lock:
+                            success, errors = send_campaign(
+                                campanha_df, delay_between_messages, transport, headless=is_headless,
+                                janela=janela_envio, job_id=job_id,
+                                campanha_id=campanha_id, writeback=writeback, impressoes=impressoes_envio,
+                                agrupar=modo_agrupar, anexo=anexo_campanha
+                            )
+                    except RuntimeError as e:
+                        st.error(f"❌ {e}")
+                        st.stop()
+                    finally:
+                        # Libera a vaga mesmo se a sessão for interrompida
+                        fila_campanhas.finish(job_id)
+                        if transport is not None:
+                            transport.close()
                     
                     st.success(f"✅ Finalizado! {success} enviados, {errors} erros.")
+                    if writeback is not None and writeback.gravacoes:
+                        st.info(f"📝 Status gravado em {writeback_destino} ({writeback.gravacoes} gravações em lote).")
                     st.balloons()
+            
+            # Campanha em execução no broker (sobrevive a reinícios do app)
+            if estado_broker and estado_broker["campanha_id"] is not None:
+                contagem_broker = estado_broker["progresso"] or {}
+                total_broker = sum(contagem_broker.values())
+                concluidas_broker = contagem_broker.get(coordinator.ENVIADO, 0) + contagem_broker.get(coordinator.ERRO, 0)
+                st.markdown(f"#### 🧩 Campanha {estado_broker['campanha_id']} no broker")
+                st.progress(concluidas_broker / total_broker if total_broker else 0.0)
+                st.caption(
+                    ("🟢 Enviando" if estado_broker["enviando"] else "⏸️ Parada") + " · "
+                    f"{contagem_broker.get(coordinator.ENVIADO, 0)} enviados · "
+                    f"{contagem_broker.get(coordinator.ERRO, 0)} erros · "
+                    f"{total_broker - concluidas_broker} restantes"
+                )
+                resultado_broker = estado_broker["resultado"] or {}
+                if resultado_broker.get("erro"):
+                    st.error(f"❌ A campanha parou com erro no broker: {resultado_broker['erro']}")
+                col_b1, col_b2 = st.columns(2)
+                with col_b1:
+                    st.button("🔄 Atualizar progresso", key="broker_atualizar", use_container_width=True)
+                with col_b2:
+                    if estado_broker["enviando"]:
+                        if st.button("⏹️ Cancelar envio no broker", use_container_width=True):
+                            broker_command("cancel")
+                            st.rerun()
+                    elif total_broker - concluidas_broker > 0:
+                        if st.button("▶️ Retomar campanha no broker", use_container_width=True):
+                            broker_command("submit", campanha_id=estado_broker["campanha_id"])
+                            st.rerun()
+            
+            # Cópia do arquivo enviado com a aba de resultados
+            writeback_arquivo = st.session_state.get('writeback_arquivo')
+            if writeback_arquivo and os.path.exists(writeback_arquivo):
+                with open(writeback_arquivo, "rb") as f:
+                    st.download_button(
+                        "📥 Baixar Planilha com Status de Envio",
+                        data=f.read(),
+                        file_name=os.path.basename(writeback_arquivo),
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        use_container_width=True
+                    )
+
+        # === MODO DISTRIBUÍDO ===
+        # A campanha vai para o banco compartilhado e é enviada por nós externos (worker.py)
+        with st.expander("🌐 Modo Distribuído (vários nós de envio)", expanded=False):
+            st.caption(
+                f"Banco de coordenação: `{coordinator.DB_PATH}`. Cada nó reserva lotes de linhas com "
+                f"lease de {coordinator.LEASE_PADRAO}s; se um nó cair, as linhas dele voltam para a fila. "
+                "Anexos não são enviados pelos nós. No modo delta, as linhas que os nós enviarem entram "
+                "no registro da lista quando este painel ou um novo envio é aberto."
+            )
+            if st.button("📡 Publicar campanha para os nós", use_container_width=True):
+                campanha_df, impressoes_dist = rows_to_send()
+                if campanha_df.empty:
+                    st.error("❌ Nenhuma linha para enviar!")
+                else:
+                    linhas_dist = coordinator_rows(campanha_df)
+                    st.session_state.campanha_distribuida = coordinator.publish_campaign(
+                        st.session_state.username, linhas_dist, delay_between_messages,
+                        delta_fonte=impressoes_dist[1] if impressoes_dist is not None else None,
+                    )
+                    st.success(f"✅ Campanha {st.session_state.campanha_distribuida} publicada com {len(linhas_dist)} linhas.")
+
+            campanhas_dist = coordinator.list_campaigns(st.session_state.username)
+            sync_distributed_fingerprints(campanhas_dist)
+            if campanhas_dist:
+                ids_dist = [c["id"] for c in campanhas_dist]
+                atual = st.session_state.get("campanha_distribuida")
+                campanha_dist = st.selectbox(
+                    "Campanha distribuída",
+                    ids_dist,
+                    index=ids_dist.index(atual) if atual in ids_dist else 0,
+                    format_func=lambda i: next(
+                        f"#{c['id']} · {c['criada_em']} · {c['total']} linhas" + (" · encerrada" if c['encerrada'] else "")
+                        for c in campanhas_dist if c["id"] == i
+                    ),
+                )
+                st.code(f"python worker.py --campanha {campanha_dist} --db {coordinator.DB_PATH} --headless", language="bash")
+
+                progresso_dist = coordinator.progress_summary(campanha_dist)
+                contagem = progresso_dist["status"]
+                cols_dist = st.columns(5)
+                cols_dist[0].metric("Pendentes", contagem.get(coordinator.PENDENTE, 0))
+                cols_dist[1].metric("Em envio", contagem.get(coordinator.RESERVADA, 0) + contagem.get(coordinator.ENVIANDO, 0))
+                cols_dist[2].metric("Enviados", contagem.get(coordinator.ENVIADO, 0))
+                cols_dist[3].metric("Erros", contagem.get(coordinator.ERRO, 0))
+                cols_dist[4].metric("Incertas", contagem.get(coordinator.INCERTA, 0))
+
+                if progresso_dist["nos"]:
+                    agora_ts = time.time()
+                    st.dataframe(
+                        pd.DataFrame([
+                            {
+                                "Nó": n["no"],
+                                "Estado": n["estado"],
+                                "Último sinal": f"há {agora_ts - n['ultimo_sinal']:.0f}s" if n["ultimo_sinal"] else "-",
+                                "Enviados": n["enviados"],
+                                "Erros": n["erros"],
+                            }
+                            for n in progresso_dist["nos"]
+                        ]),
+                        use_container_width=True, hide_index=True,
+                    )
+                else:
+                    st.caption("Nenhum nó conectado ainda.")
+
+                if contagem.get(coordinator.INCERTA):
+                    st.warning(
+                        "⚠️ Linhas **incertas**: o nó caiu durante o envio e a mensagem pode ou não ter saído. "
+                        "Confira no WhatsApp antes de reenfileirar."
+                    )
+
+                col_d1, col_d2, col_d3 = st.columns(3)
+                with col_d1:
+                    st.button("🔄 Atualizar", key="dist_atualizar", use_container_width=True)
+                with col_d2:
+                    if st.button("↩️ Reenfileirar incertas", use_container_width=True,
+                                 disabled=not contagem.get(coordinator.INCERTA)):
+                        st.toast(f"↩️ {coordinator.requeue_uncertain(campanha_dist)} linhas de volta na fila.")
+                with col_d3:
+                    if st.button("⏹️ Encerrar campanha", use_container_width=True):
+                        coordinator.close_campaign(campanha_dist)
+                        st.toast("⏹️ Os nós não vão reservar novas linhas desta campanha.")
+
+                st.download_button(
+                    "📥 Baixar status da campanha distribuída (CSV)",
+                    data=pd.DataFrame(coordinator.campaign_rows(campanha_dist)).to_csv(index=False).encode("utf-8"),
+                    file_name=f"campanha_distribuida_{campanha_dist}.csv",
+                    mime="text/csv",
+                    use_container_width=True,
+                )
+
+        profile_lap("Envio e fila")
+        
+        # Recibos e respostas usam o navegador deste processo (não o do broker)
+        if has_active_session and st.session_state.driver is not None:
+            # === CONFIRMAÇÕES DE ENTREGA / LEITURA ===
+            campanha_recibos = st.session_state.get("ultima_campanha") or results_store.latest_campaign(st.session_state.username)
+            if campanha_recibos:
+                st.markdown("---")
+                st.markdown("### 📬 Confirmações de Entrega")
+                if st.button("🔄 Atualizar Confirmações (entregue / lido)", use_container_width=True,
+                             help="Lê os ticks da lista de conversas do WhatsApp Web de uma vez, sem abrir cada conversa"):
+                    with st.spinner("⏳ Lendo a lista de conversas..."), st.session_state.driver_lock:
+                        try:
+                            encontrados, atualizados = harvest_receipts(st.session_state.driver, campanha_recibos)
+                            st.toast(f"📬 {encontrados} conversas encontradas, {atualizados} recibos atualizados.")
+                        except Exception as e:
+                            st.error(f"Erro ao coletar confirmações: {e}")
+                
+                resumo_recibos = results_store.receipt_summary(campanha_recibos)
+                if resumo_recibos:
+                    st.caption(f"Campanha nº {campanha_recibos}")
+                    st.dataframe(
+                        pd.DataFrame(resumo_recibos).rename(columns={'status': 'Envio', 'recibo': 'Recibo', 'total': 'Contatos'}),
+                        use_container_width=True,
+                        hide_index=True
+                    )
+            
+            # === RESPOSTAS DAS CAMPANHAS ===
+            st.markdown("---")
+            st.markdown("### 💬 Respostas das Campanhas")
+            col_resp1, col_resp2 = st.columns(2)
+            
+            with col_resp1:
+                if st.button("📥 Coletar Respostas Agora", use_container_width=True,
+                             help="Abre apenas as conversas de contatos das campanhas que mudaram desde a última coleta"):
+                    with st.spinner("⏳ Coletando respostas..."), st.session_state.driver_lock:
+                        try:
+                            conversas, novas = collect_replies_pass(st.session_state.driver, st.session_state.username)
+                            st.toast(f"💬 {conversas} conversas verificadas, {novas} respostas novas.")
+                        except Exception as e:
+                            st.error(f"Erro ao coletar respostas: {e}")
+            
+            with col_resp2:
+                coleta_thread = st.session_state.get('coleta_thread')
+                coleta_ativa = coleta_thread is not None and coleta_thread.is_alive()
+                coleta_auto = st.toggle(
+                    f"Coleta automática (a cada {COLETA_INTERVALO_PADRAO // 60} min)",
+                    value=coleta_ativa,
+                    help="Roda em segundo plano enquanto o navegador estiver livre"
+                )
+                if coleta_auto and not coleta_ativa:
+                    st.session_state.coleta_parar = threading.Event()
+                    st.session_state.coleta_estado = {}
+                    st.session_state.coleta_thread = threading.Thread(
+                        target=reply_collector_loop,
+                        args=(
+                            st.session_state.driver, st.session_state.driver_lock,
+                            st.session_state.coleta_parar, st.session_state.coleta_estado,
+                            st.session_state.username,
+                        ),
+                        daemon=True,
+                    )
+                    st.session_state.coleta_thread.start()
+                elif not coleta_auto and coleta_ativa:
+                    stop_reply_collector()
+            
+            coleta_estado = st.session_state.get('coleta_estado') or {}
+            if coleta_estado.get('ultima'):
+                st.caption(
+                    f"Última coleta automática: {coleta_estado['ultima'].strftime('%H:%M:%S')} · "
+                    f"{coleta_estado.get('novas', 0)} respostas novas desde que foi ativada"
+                )
+            if coleta_estado.get('erro'):
+                st.warning(f"⚠️ Coleta automática: {coleta_estado['erro']}")
+            
+            colunas_respostas = {
+                'campanha_id': 'Campanha', 'telefone': 'Telefone', 'nome': 'Nome',
+                'texto': 'Resposta', 'recebida_em': 'Recebida em', 'coletada_em': 'Coletada em'
+            }
+            respostas = results_store.list_replies(st.session_state.username, limite=200)
+            if respostas:
+                st.dataframe(pd.DataFrame(respostas).rename(columns=colunas_respostas),
+                             use_container_width=True, hide_index=True)
+                
+                # Exportação completa (não só as 200 exibidas)
+                export_buffer = io.BytesIO()
+                pd.DataFrame(results_store.list_replies(st.session_state.username)).rename(
+                    columns=colunas_respostas
+                ).to_excel(export_buffer, index=False, sheet_name="Respostas")
+                st.download_button(
+                    "📤 Exportar Respostas (Excel)",
+                    data=export_buffer.getvalue(),
+                    file_name=f"respostas_{st.session_state.username}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
+            else:
+                st.caption("Nenhuma resposta coletada ainda.")
+        profile_lap("Recibos e respostas")
 
 else:
     # Tela inicial quando não há dados
@@ -974,3 +2790,5 @@ else:
         'texto': ['Olá João, tudo bem?', 'Oi Maria, como vai?']
     })
     st.dataframe(example_df, use_container_width=True)
+
+profile_finish()
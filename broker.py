@@ -0,0 +1,309 @@
+# =====================================================
+# BROKER DE NAVEGADORES E CAMPANHAS
+# =====================================================
+# Processo de longa duração que é dono dos navegadores (um por operador) e
+# da execução das campanhas pelo WhatsApp Web. O app Streamlit conversa com
+# ele por IPC local (multiprocessing.connection, com chave de autenticação),
+# então reiniciar ou reimplantar o app não derruba as sessões nem os envios
+# em andamento:
+#
+#   python broker.py
+#
+# Cada campanha enviada pelo broker é publicada no banco de coordenação
+# (coordinator.py) e executada pelo mesmo laço do worker.py, usando o
+# navegador do operador. Se o próprio broker reiniciar, as linhas não
+# enviadas continuam no banco e a campanha pode ser retomada.
+
+import argparse
+import os
+import secrets
+import signal
+import sys
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from selenium.webdriver.common.by import By
+
+import coordinator
+import worker
+from transports import create_chrome_driver, wait_whatsapp_login, SeleniumTransport
+
+ENDERECO_PADRAO = os.environ.get("WHATSAPP_BROKER_ENDERECO", "127.0.0.1:6150")
+# Chave do IPC: WHATSAPP_BROKER_CHAVE ou, se não definida, uma chave aleatória que o
+# broker gera no primeiro início num arquivo legível só pelo usuário (0600). Sem
+# chave padrão: quem conecta ao broker controla as sessões do WhatsApp de todos.
+CHAVE_ARQUIVO = os.environ.get(
+    "WHATSAPP_BROKER_CHAVE_ARQUIVO", os.path.join(os.path.expanduser("~"), ".whatsapp_broker_chave")
+)
+TIMEOUT_RESPOSTA = 90        # Segundos aguardando a resposta de um comando (iniciar o Chrome demora)
+RECONEXAO_TIMEOUT = 120      # Segundos aguardando o login após reiniciar o navegador no meio de uma campanha
+
+class BrokerError(Exception):
+    """Erro devolvido pelo broker para um comando"""
+
+def auth_key(criar=False):
+    """Chave de autenticação do IPC (bytes), ou None se ainda não existir e criar=False"""
+    chave = os.environ.get("WHATSAPP_BROKER_CHAVE")
+    if chave:
+        return chave.encode()
+    try:
+        with open(CHAVE_ARQUIVO, "rb") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        if not criar:
+            return None
+    chave = secrets.token_hex(32).encode()
+    fd = os.open(CHAVE_ARQUIVO, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(chave)
+    return chave
+
+def _address(endereco):
+    host, porta = endereco.rsplit(":", 1)
+    return host, int(porta)
+
+def call(comando, endereco=ENDERECO_PADRAO, chave=None, timeout=TIMEOUT_RESPOSTA, **argumentos):
+    """Envia um comando ao broker e devolve o resultado. Levanta BrokerError ou OSError"""
+    chave = chave or auth_key()
+    if chave is None:
+        raise BrokerError(
+            f"Chave do broker não encontrada: defina WHATSAPP_BROKER_CHAVE ou inicie o broker (gera {CHAVE_ARQUIVO})."
+        )
+    try:
+        conn = Client(_address(endereco), authkey=chave)
+    except AuthenticationError:
+        raise BrokerError("O broker recusou a chave (WHATSAPP_BROKER_CHAVE diferente da do broker).")
+    with conn:
+        conn.send({"comando": comando, "argumentos": argumentos})
+        if not conn.poll(timeout):
+            raise BrokerError(f"O broker não respondeu ao comando '{comando}' em {timeout}s.")
+        resposta = conn.recv()
+    if not resposta["ok"]:
+        raise BrokerError(resposta["erro"])
+    return resposta["resultado"]
+
+def is_running(endereco=ENDERECO_PADRAO, chave=None):
+    """Verifica se há um broker respondendo no endereço"""
+    try:
+        return call("ping", endereco=endereco, chave=chave, timeout=2) == "pong"
+    except (OSError, EOFError, BrokerError):
+        return False
+
+class _Sessao:
+    """Navegador e campanha em andamento de um operador"""
+    def __init__(self, usuario, headless):
+        self.usuario = usuario
+        self.headless = headless
+        self.driver = None
+        self.lock = threading.Lock()       # Serializa iniciar/fechar o navegador e iniciar campanhas
+        self.job = None
+        self.cancelar = threading.Event()
+        self.campanha_id = None
+        self.resultado = None
+
+class Broker:
+    """Atende os comandos do app: ping, connect, status, screenshot, disconnect, submit e cancel"""
+
+    def __init__(self, db_path=coordinator.DB_PATH):
+        self.db_path = db_path
+        self.sessoes = {}
+        self._lock = threading.Lock()
+
+    def _session(self, usuario, headless=True):
+        with self._lock:
+            if usuario not in self.sessoes:
+                self.sessoes[usuario] = _Sessao(usuario, headless)
+            return self.sessoes[usuario]
+
+    def _alive(self, sessao):
+        if sessao.driver is None:
+            return False
+        try:
+            _ = sessao.driver.title
+            return True
+        except Exception:
+            sessao.driver = None
+            return False
+
+    def _start_browser(self, sessao):
+        if sessao.driver is not None:
+            try:
+                sessao.driver.quit()
+            except Exception:
+                pass
+        sessao.driver = None
+        driver = create_chrome_driver(headless=sessao.headless)
+        driver.get("https://web.whatsapp.com")
+        sessao.driver = driver
+        return driver
+
+    def handle(self, comando, argumentos):
+        metodo = getattr(self, f"cmd_{comando}", None)
+        if metodo is None:
+            raise BrokerError(f"Comando desconhecido: {comando}")
+        return metodo(**argumentos)
+
+    def cmd_ping(self):
+        return "pong"
+
+    def cmd_connect(self, usuario, headless=True):
+        """Inicia (ou reinicia) o navegador do operador e abre o WhatsApp Web"""
+        sessao = self._session(usuario, headless)
+        with sessao.lock:
+            if sessao.job is not None and sessao.job.is_alive():
+                raise BrokerError("Há uma campanha em andamento nesta sessão. Cancele-a antes de reconectar.")
+            sessao.headless = headless
+            self._start_browser(sessao)
+        return True
+
+    def cmd_status(self, usuario):
+        """Navegador ativo, login feito, campanha atual e contagem por status das linhas"""
+        sessao = self._session(usuario)
+        navegador = self._alive(sessao)
+        logado = False
+        if navegador:
+            try:
+                logado = bool(sessao.driver.find_elements(By.XPATH, '//div[@id="pane-side"]'))
+            except Exception:
+                pass
+        progresso = None
+        if sessao.campanha_id is not None:
+            progresso = coordinator.progress_summary(sessao.campanha_id, db_path=self.db_path)["status"]
+        return {
+            "navegador": navegador,
+            "logado": logado,
+            "campanha_id": sessao.campanha_id,
+            "enviando": sessao.job is not None and sessao.job.is_alive(),
+            "progresso": progresso,
+            "resultado": sessao.resultado,
+        }
+
+    def cmd_screenshot(self, usuario):
+        """Captura da tela do WhatsApp Web do operador (PNG)"""
+        sessao = self._session(usuario)
+        if not self._alive(sessao):
+            raise BrokerError("Nenhum navegador ativo para este operador.")
+        return sessao.driver.get_screenshot_as_png()
+
+    def cmd_disconnect(self, usuario):
+        """Cancela a campanha em andamento (se houver) e fecha o navegador do operador"""
+        sessao = self._session(usuario)
+        self.cmd_cancel(usuario, aguardar=True)
+        with sessao.lock:
+            if sessao.driver is not None:
+                try:
+                    sessao.driver.quit()
+                except Exception:
+                    pass
+            sessao.driver = None
+        return True
+
+    def cmd_submit(self, usuario, linhas=None, intervalo=None, campanha_id=None):
+        """Publica as linhas como nova campanha (ou retoma campanha_id) e começa a enviar. Retorna o id"""
+        sessao = self._session(usuario)
+        with sessao.lock:
+            if sessao.job is not None and sessao.job.is_alive():
+                raise BrokerError("Já existe uma campanha em andamento nesta sessão.")
+            if not self._alive(sessao):
+                raise BrokerError("Conecte o WhatsApp antes de enviar.")
+            if campanha_id is None:
+                campanha_id = coordinator.publish_campaign(usuario, linhas, intervalo, db_path=self.db_path)
+            elif coordinator.campaign_info(campanha_id, db_path=self.db_path) is None:
+                raise BrokerError(f"Campanha {campanha_id} não encontrada.")
+            sessao.campanha_id = campanha_id
+            sessao.resultado = None
+            sessao.cancelar = threading.Event()
+            sessao.job = threading.Thread(
+                target=self._run_job, args=(sessao, campanha_id), name=f"campanha-{usuario}", daemon=True
+            )
+            sessao.job.start()
+        return campanha_id
+
+    def cmd_cancel(self, usuario, aguardar=False):
+        """Interrompe a campanha em andamento; as linhas não enviadas ficam pendentes no banco"""
+        sessao = self._session(usuario)
+        job = sessao.job
+        if job is None or not job.is_alive():
+            return False
+        sessao.cancelar.set()
+        if aguardar:
+            job.join(TIMEOUT_RESPOSTA - 5)
+        return True
+
+    def _run_job(self, sessao, campanha_id):
+        args = worker.parse_args([
+            "--campanha", str(campanha_id), "--db", self.db_path, "--no", f"broker-{sessao.usuario}",
+        ])
+        transport = SeleniumTransport(sessao.driver)
+        try:
+            codigo, enviados, erros = worker.process_campaign(
+                args, transport, lambda t: self._reconnect(sessao, t), sessao.cancelar
+            )
+            sessao.resultado = {"codigo": codigo, "enviados": enviados, "erros": erros,
+                                "cancelada": sessao.cancelar.is_set()}
+        except Exception as e:
+            sessao.resultado = {"codigo": 1, "erro": str(e)}
+
+    def _reconnect(self, sessao, transport):
+        """Reinicia o navegador após perda de sessão e aguarda o login (o app mostra o QR Code pela captura)"""
+        try:
+            driver = self._start_browser(sessao)
+        except Exception:
+            return False
+        transport.driver = driver
+        return wait_whatsapp_login(driver, RECONEXAO_TIMEOUT, cancelar=sessao.cancelar)
+
+    def shutdown(self):
+        """Cancela as campanhas (devolvendo as reservas) e fecha todos os navegadores"""
+        for usuario in list(self.sessoes):
+            self.cmd_disconnect(usuario)
+
+def _serve_connection(broker, conn):
+    with conn:
+        try:
+            pedido = conn.recv()
+        except EOFError:
+            return
+        try:
+            resultado = broker.handle(pedido["comando"], pedido.get("argumentos", {}))
+            resposta = {"ok": True, "resultado": resultado}
+        except Exception as e:
+            resposta = {"ok": False, "erro": str(e)}
+        try:
+            conn.send(resposta)
+        except (OSError, EOFError):
+            pass
+
+def serve(endereco=ENDERECO_PADRAO, chave=None, db_path=coordinator.DB_PATH):
+    """Atende comandos até receber SIGTERM/Ctrl+C. Cada conexão (um comando) roda na sua própria thread"""
+    chave = chave or auth_key(criar=True)
+    broker = Broker(db_path)
+    # SIGTERM encerra pelo mesmo caminho do Ctrl+C, fechando os navegadores
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with Listener(_address(endereco), authkey=chave) as listener:
+        print(f"Broker de navegadores ouvindo em {endereco} (banco {db_path})", flush=True)
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception:
+                    # Cliente com chave errada ou que desistiu no meio do handshake
+                    continue
+                threading.Thread(target=_serve_connection, args=(broker, conn), daemon=True).start()
+        finally:
+            broker.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Broker de navegadores do WhatsApp Sender Pro")
+    parser.add_argument("--endereco", default=ENDERECO_PADRAO, help="host:porta para o IPC local")
+    parser.add_argument("--db", default=coordinator.DB_PATH, help="Banco de coordenação das campanhas")
+    args = parser.parse_args(argv)
+    try:
+        serve(args.endereco, db_path=args.db)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
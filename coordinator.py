@@ -0,0 +1,400 @@
+# =====================================================
+# CAMPANHAS DISTRIBUÍDAS (VÁRIOS NÓS DE ENVIO)
+# =====================================================
+# As linhas de uma campanha ficam num SQLite compartilhado entre os nós
+# (mesma máquina ou volume de rede com lock de arquivo). Cada nó (worker.py)
+# reserva um lote de linhas com um "lease" de tempo limitado, renova o lease
+# enquanto envia (heartbeat) e, se morrer, as linhas voltam para a fila
+# quando o lease expira.
+#
+# Para nunca enviar duas vezes, cada linha passa por "enviando" antes do
+# envio propriamente dito, e só o dono de um lease válido consegue fazer essa
+# transição. Uma linha que expira em "enviando" (o nó caiu no meio do envio)
+# não volta para a fila: fica como "incerta" para o operador decidir.
+
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+
+from transports import RETRY_MAX_TENTATIVAS, backoff_delay
+
+DB_PATH = os.environ.get("WHATSAPP_COORDENADOR_DB", "campanhas_distribuidas.db")
+
+LEASE_PADRAO = 120        # Segundos de validade da reserva de um lote
+LOTE_PADRAO = 10          # Linhas reservadas por vez em cada nó
+
+# Status das linhas
+PENDENTE = "pendente"     # Na fila, disponível a partir de disponivel_em
+RESERVADA = "reservada"   # Reservada por um nó (lease), ainda não enviada
+ENVIANDO = "enviando"     # O nó começou o envio desta linha
+INCERTA = "incerta"       # O lease expirou durante o envio: pode ou não ter sido enviada
+ENVIADO = "enviado"
+ERRO = "erro"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campanhas_dist (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario TEXT,
+    criada_em TEXT,
+    total INTEGER,
+    intervalo INTEGER,
+    encerrada INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS campanhas_dist_delta (
+    campanha_id INTEGER PRIMARY KEY,
+    fonte TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS linhas_dist (
+    campanha_id INTEGER NOT NULL,
+    linha_id INTEGER NOT NULL,
+    nome TEXT,
+    telefone TEXT,
+    mensagem TEXT,
+    status TEXT NOT NULL DEFAULT 'pendente',
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    disponivel_em REAL NOT NULL DEFAULT 0,
+    lease_no TEXT,
+    lease_expira REAL,
+    no TEXT,
+    erro TEXT,
+    concluida_em TEXT,
+    PRIMARY KEY (campanha_id, linha_id)
+);
+CREATE INDEX IF NOT EXISTS idx_linhas_dist_fila ON linhas_dist (campanha_id, status, lease_expira);
+CREATE TABLE IF NOT EXISTS nos_dist (
+    no TEXT NOT NULL,
+    campanha_id INTEGER NOT NULL,
+    ultimo_sinal REAL,
+    enviados INTEGER DEFAULT 0,
+    erros INTEGER DEFAULT 0,
+    estado TEXT,
+    PRIMARY KEY (no, campanha_id)
+);
+"""
+
+def connect(db_path=DB_PATH):
+    """Abre uma conexão com o banco compartilhado, criando as tabelas se necessário"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+class _Transacao:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK: trava a escrita entre nós durante a reserva"""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, tipo, *_):
+        self.conn.execute("ROLLBACK" if tipo else "COMMIT")
+        return False
+
+def _agora_iso():
+    return datetime.now().isoformat(timespec="seconds")
+
+def publish_campaign(usuario, linhas, intervalo, delta_fonte=None, db_path=DB_PATH):
+    """Publica uma campanha para os nós. linhas: dicts com linha_id, nome, telefone e mensagem. Retorna o id
+
+    delta_fonte: lista de origem no modo delta (o app grava as linhas enviadas no snapshot dela).
+    """
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        cur = conn.execute(
+            "INSERT INTO campanhas_dist (usuario, criada_em, total, intervalo) VALUES (?, ?, ?, ?)",
+            (usuario, _agora_iso(), len(linhas), intervalo),
+        )
+        campanha_id = cur.lastrowid
+        conn.executemany(
+            """
+            INSERT INTO linhas_dist (campanha_id, linha_id, nome, telefone, mensagem)
+            VALUES (:campanha_id, :linha_id, :nome, :telefone, :mensagem)
+            """,
+            [{**linha, "campanha_id": campanha_id} for linha in linhas],
+        )
+        if delta_fonte is not None:
+            conn.execute(
+                "INSERT INTO campanhas_dist_delta (campanha_id, fonte) VALUES (?, ?)", (campanha_id, delta_fonte)
+            )
+        return campanha_id
+
+_CAMPANHAS_SQL = """
+    SELECT c.*, d.fonte AS delta_fonte
+    FROM campanhas_dist c LEFT JOIN campanhas_dist_delta d ON d.campanha_id = c.id
+"""
+
+def campaign_info(campanha_id, db_path=DB_PATH):
+    """Dados da campanha (usuario, total, intervalo, encerrada, delta_fonte) ou None"""
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(_CAMPANHAS_SQL + " WHERE c.id = ?", (campanha_id,)).fetchone()
+        return dict(row) if row else None
+
+def list_campaigns(usuario=None, limite=20, db_path=DB_PATH):
+    """Campanhas publicadas, mais recentes primeiro"""
+    sql = _CAMPANHAS_SQL
+    params = []
+    if usuario is not None:
+        sql += " WHERE c.usuario = ?"
+        params.append(usuario)
+    sql += " ORDER BY c.id DESC LIMIT ?"
+    params.append(limite)
+    with closing(connect(db_path)) as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+def close_campaign(campanha_id, db_path=DB_PATH):
+    """Encerra a campanha: os nós param de reservar linhas dela"""
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        conn.execute("UPDATE campanhas_dist SET encerrada = 1 WHERE id = ?", (campanha_id,))
+
+def _expire_leases(conn, campanha_id, agora):
+    """Leases vencidos: reservadas voltam para a fila, em envio viram incertas"""
+    conn.execute(
+        """
+        UPDATE linhas_dist SET status = 'pendente', lease_no = NULL, lease_expira = NULL
+        WHERE campanha_id = ? AND status = 'reservada' AND lease_expira < ?
+        """,
+        (campanha_id, agora),
+    )
+    conn.execute(
+        """
+        UPDATE linhas_dist SET status = 'incerta', erro = 'Lease expirou durante o envio (nó ' || lease_no || ')',
+            lease_expira = NULL
+        WHERE campanha_id = ? AND status = 'enviando' AND lease_expira < ?
+        """,
+        (campanha_id, agora),
+    )
+
+def claim_batch(campanha_id, no, quantidade=LOTE_PADRAO, lease=LEASE_PADRAO, db_path=DB_PATH):
+    """Reserva até `quantidade` linhas disponíveis para o nó. Retorna a lista de linhas (dicts)"""
+    agora = time.time()
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        encerrada = conn.execute("SELECT encerrada FROM campanhas_dist WHERE id = ?", (campanha_id,)).fetchone()
+        if encerrada is None or encerrada["encerrada"]:
+            return []
+        _expire_leases(conn, campanha_id, agora)
+        ids = [
+            r["linha_id"]
+            for r in conn.execute(
+                """
+                SELECT linha_id FROM linhas_dist
+                WHERE campanha_id = ? AND status = 'pendente' AND disponivel_em <= ?
+                ORDER BY disponivel_em, linha_id LIMIT ?
+                """,
+                (campanha_id, agora, quantidade),
+            )
+        ]
+        conn.executemany(
+            """
+            UPDATE linhas_dist SET status = 'reservada', lease_no = ?, lease_expira = ?
+            WHERE campanha_id = ? AND linha_id = ?
+            """,
+            [(no, agora + lease, campanha_id, linha_id) for linha_id in ids],
+        )
+        _touch_node(conn, no, campanha_id, agora, "enviando" if ids else "ocioso")
+        if not ids:
+            return []
+        marcadores = ",".join("?" * len(ids))
+        rows = conn.execute(
+            f"SELECT * FROM linhas_dist WHERE campanha_id = ? AND linha_id IN ({marcadores}) ORDER BY linha_id",
+            [campanha_id, *ids],
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+def _touch_node(conn, no, campanha_id, agora, estado, enviados=0, erros=0):
+    conn.execute(
+        """
+        INSERT INTO nos_dist (no, campanha_id, ultimo_sinal, enviados, erros, estado)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (no, campanha_id) DO UPDATE SET
+            ultimo_sinal = excluded.ultimo_sinal,
+            enviados = nos_dist.enviados + excluded.enviados,
+            erros = nos_dist.erros + excluded.erros,
+            estado = excluded.estado
+        """,
+        (no, campanha_id, agora, enviados, erros, estado),
+    )
+
+def heartbeat(campanha_id, no, lease=LEASE_PADRAO, estado="enviando", db_path=DB_PATH):
+    """Renova os leases ainda válidos do nó. Retorna o conjunto de linha_id que continuam dele"""
+    agora = time.time()
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        conn.execute(
+            """
+            UPDATE linhas_dist SET lease_expira = ?
+            WHERE campanha_id = ? AND lease_no = ? AND status IN ('reservada', 'enviando') AND lease_expira >= ?
+            """,
+            (agora + lease, campanha_id, no, agora),
+        )
+        _touch_node(conn, no, campanha_id, agora, estado)
+        return {
+            r["linha_id"]
+            for r in conn.execute(
+                """
+                SELECT linha_id FROM linhas_dist
+                WHERE campanha_id = ? AND lease_no = ? AND status IN ('reservada', 'enviando')
+                """,
+                (campanha_id, no),
+            )
+        }
+
+def begin_send(campanha_id, no, linha_id, lease=LEASE_PADRAO, db_path=DB_PATH):
+    """Marca a linha como "enviando" se o lease do nó ainda vale. Só envie se retornar True"""
+    agora = time.time()
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        cur = conn.execute(
+            """
+            UPDATE linhas_dist SET status = 'enviando', lease_expira = ?
+            WHERE campanha_id = ? AND linha_id = ? AND lease_no = ? AND status = 'reservada' AND lease_expira >= ?
+            """,
+            (agora + lease, campanha_id, linha_id, no, agora),
+        )
+        return cur.rowcount == 1
+
+def complete(campanha_id, no, linha_id, db_path=DB_PATH):
+    """Registra o envio bem-sucedido (também de uma linha que já tinha virado incerta)"""
+    agora = time.time()
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        cur = conn.execute(
+            """
+            UPDATE linhas_dist SET status = 'enviado', erro = NULL, no = ?, concluida_em = ?,
+                lease_no = NULL, lease_expira = NULL
+            WHERE campanha_id = ? AND linha_id = ? AND lease_no = ? AND status IN ('enviando', 'incerta')
+            """,
+            (no, _agora_iso(), campanha_id, linha_id, no),
+        )
+        _touch_node(conn, no, campanha_id, agora, "enviando", enviados=cur.rowcount)
+        return cur.rowcount == 1
+
+def fail(campanha_id, no, linha_id, erro, definitiva=False, db_path=DB_PATH):
+    """Registra uma falha. Transiente volta para a fila com backoff; definitiva (ou sem tentativas) vira erro
+
+    Retorna o novo status da linha (ou None se o nó já não era o dono).
+    """
+    agora = time.time()
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        row = conn.execute(
+            """
+            SELECT tentativas FROM linhas_dist
+            WHERE campanha_id = ? AND linha_id = ? AND lease_no = ? AND status IN ('enviando', 'incerta')
+            """,
+            (campanha_id, linha_id, no),
+        ).fetchone()
+        if row is None:
+            return None
+        tentativas = row["tentativas"] + 1
+        if definitiva or tentativas >= RETRY_MAX_TENTATIVAS:
+            conn.execute(
+                """
+                UPDATE linhas_dist SET status = 'erro', tentativas = ?, erro = ?, no = ?, concluida_em = ?,
+                    lease_no = NULL, lease_expira = NULL
+                WHERE campanha_id = ? AND linha_id = ?
+                """,
+                (tentativas, erro, no, _agora_iso(), campanha_id, linha_id),
+            )
+            _touch_node(conn, no, campanha_id, agora, "enviando", erros=1)
+            return ERRO
+        conn.execute(
+            """
+            UPDATE linhas_dist SET status = 'pendente', tentativas = ?, erro = ?, disponivel_em = ?,
+                lease_no = NULL, lease_expira = NULL
+            WHERE campanha_id = ? AND linha_id = ?
+            """,
+            (tentativas, erro, agora + backoff_delay(tentativas), campanha_id, linha_id),
+        )
+        return PENDENTE
+
+def release(campanha_id, no, linha_ids=None, db_path=DB_PATH):
+    """Devolve para a fila as linhas reservadas (ou em envio que não chegou a sair) do nó
+
+    Sem linha_ids, devolve só as reservadas (saída normal do nó). Com linha_ids,
+    devolve também as que estavam "enviando" - usado quando o envio falhou
+    por perda de sessão antes de a mensagem sair.
+    """
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        if linha_ids is None:
+            cur = conn.execute(
+                """
+                UPDATE linhas_dist SET status = 'pendente', lease_no = NULL, lease_expira = NULL
+                WHERE campanha_id = ? AND lease_no = ? AND status = 'reservada'
+                """,
+                (campanha_id, no),
+            )
+        else:
+            cur = conn.executemany(
+                """
+                UPDATE linhas_dist SET status = 'pendente', lease_no = NULL, lease_expira = NULL
+                WHERE campanha_id = ? AND linha_id = ? AND lease_no = ? AND status IN ('reservada', 'enviando')
+                """,
+                [(campanha_id, linha_id, no) for linha_id in linha_ids],
+            )
+        return cur.rowcount
+
+def requeue_uncertain(campanha_id, db_path=DB_PATH):
+    """Decisão do operador: linhas incertas voltam para a fila (podem ser enviadas de novo)"""
+    with closing(connect(db_path)) as conn, _Transacao(conn):
+        cur = conn.execute(
+            """
+            UPDATE linhas_dist SET status = 'pendente', lease_no = NULL, lease_expira = NULL, disponivel_em = 0
+            WHERE campanha_id = ? AND status = 'incerta'
+            """,
+            (campanha_id,),
+        )
+        return cur.rowcount
+
+def pending_count(campanha_id, db_path=DB_PATH):
+    """Linhas que ainda podem ser enviadas (pendentes, reservadas ou em envio)"""
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(
+            """
+            SELECT COUNT(*) AS total FROM linhas_dist
+            WHERE campanha_id = ? AND status IN ('pendente', 'reservada', 'enviando')
+            """,
+            (campanha_id,),
+        ).fetchone()
+        return row["total"]
+
+def progress_summary(campanha_id, db_path=DB_PATH):
+    """Contagem por status das linhas e situação de cada nó ({'status': {...}, 'nos': [...]})"""
+    with closing(connect(db_path)) as conn:
+        status = {
+            r["status"]: r["total"]
+            for r in conn.execute(
+                "SELECT status, COUNT(*) AS total FROM linhas_dist WHERE campanha_id = ? GROUP BY status",
+                (campanha_id,),
+            )
+        }
+        nos = [
+            dict(r)
+            for r in conn.execute(
+                "SELECT no, ultimo_sinal, enviados, erros, estado FROM nos_dist WHERE campanha_id = ? ORDER BY no",
+                (campanha_id,),
+            )
+        ]
+    return {"status": status, "nos": nos}
+
+def campaign_rows(campanha_id, db_path=DB_PATH):
+    """Todas as linhas da campanha com status, nó e erro, na ordem da planilha"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            """
+            SELECT linha_id, nome, telefone, status, tentativas, no, erro, concluida_em
+            FROM linhas_dist WHERE campanha_id = ? ORDER BY linha_id
+            """,
+            (campanha_id,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+def sent_rows(campanha_id, db_path=DB_PATH):
+    """Linhas já enviadas da campanha (linha_id, telefone e mensagem), na ordem da planilha"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            """
+            SELECT linha_id, telefone, mensagem FROM linhas_dist
+            WHERE campanha_id = ? AND status = 'enviado' ORDER BY linha_id
+            """,
+            (campanha_id,),
+        ).fetchall()
+        return [dict(r) for r in rows]
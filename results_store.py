@@ -0,0 +1,279 @@
+# =====================================================
+# ARMAZENAMENTO DOS RESULTADOS DE ENVIO (SQLite local)
+# =====================================================
+# Guarda, por campanha, o status de cada contato (enviado/erro), as
+# confirmações de entrega/leitura e as respostas coletadas depois no
+# WhatsApp Web (com um cursor por conversa para a coleta incremental).
+# Também guarda a impressão (hash de Telefone + texto) de cada linha já
+# enviada de uma lista, para as campanhas delta.
+# Cada função abre sua própria conexão, então pode ser chamada de
+# qualquer thread/sessão do Streamlit.
+
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+DB_PATH = "resultados.db"
+
+# Ordem dos recibos: um status só é atualizado se "avançar" (ex.: entregue -> lido)
+RECIBO_ORDEM = {None: 0, "pendente": 1, "enviado": 2, "entregue": 3, "lido": 4}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS campanhas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario TEXT,
+    criada_em TEXT,
+    total INTEGER
+);
+CREATE TABLE IF NOT EXISTS envios (
+    campanha_id INTEGER NOT NULL,
+    telefone TEXT NOT NULL,
+    nome TEXT,
+    status TEXT,
+    erro TEXT,
+    enviado_em TEXT,
+    recibo TEXT,
+    recibo_em TEXT,
+    PRIMARY KEY (campanha_id, telefone)
+);
+CREATE INDEX IF NOT EXISTS idx_envios_telefone ON envios (telefone);
+CREATE TABLE IF NOT EXISTS respostas (
+    mensagem_id TEXT PRIMARY KEY,
+    usuario TEXT,
+    telefone TEXT,
+    campanha_id INTEGER,
+    conversa TEXT,
+    texto TEXT,
+    recebida_em TEXT,
+    coletada_em TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_respostas_telefone ON respostas (telefone);
+CREATE INDEX IF NOT EXISTS idx_respostas_campanha ON respostas (campanha_id);
+CREATE TABLE IF NOT EXISTS impressoes_envio (
+    usuario TEXT NOT NULL,
+    fonte TEXT NOT NULL,
+    impressao INTEGER NOT NULL,
+    telefone_hash INTEGER NOT NULL,
+    enviado_em TEXT,
+    PRIMARY KEY (usuario, fonte, impressao)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cursores_conversa (
+    usuario TEXT NOT NULL,
+    conversa TEXT NOT NULL,
+    assinatura TEXT,
+    ultimo_id TEXT,
+    atualizado_em TEXT,
+    PRIMARY KEY (usuario, conversa)
+);
+"""
+
+def connect(db_path=DB_PATH):
+    """Abre uma conexão com o banco, criando as tabelas se necessário"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+    return conn
+
+def create_campaign(usuario, total, db_path=DB_PATH):
+    """Registra uma nova campanha e retorna seu id"""
+    with closing(connect(db_path)) as conn, conn:
+        cur = conn.execute(
+            "INSERT INTO campanhas (usuario, criada_em, total) VALUES (?, ?, ?)",
+            (usuario, datetime.now().isoformat(timespec="seconds"), total),
+        )
+        return cur.lastrowid
+
+def latest_campaign(usuario, db_path=DB_PATH):
+    """Id da campanha mais recente do usuário (ou None)"""
+    with closing(connect(db_path)) as conn:
+        row = conn.execute(
+            "SELECT id FROM campanhas WHERE usuario = ? ORDER BY id DESC LIMIT 1", (usuario,)
+        ).fetchone()
+        return row["id"] if row else None
+
+def record_results(campanha_id, resultados, db_path=DB_PATH):
+    """Grava (em lote) o resultado de vários contatos
+
+    resultados: lista de dicts com telefone, nome, status, erro e enviado_em.
+    """
+    if not resultados:
+        return
+    with closing(connect(db_path)) as conn, conn:
+        conn.executemany(
+            """
+            INSERT INTO envios (campanha_id, telefone, nome, status, erro, enviado_em)
+            VALUES (:campanha_id, :telefone, :nome, :status, :erro, :enviado_em)
+            ON CONFLICT (campanha_id, telefone) DO UPDATE SET
+                nome = excluded.nome,
+                status = excluded.status,
+                erro = excluded.erro,
+                enviado_em = excluded.enviado_em
+            """,
+            [{**r, "campanha_id": campanha_id} for r in resultados],
+        )
+
+def campaign_results(campanha_id, db_path=DB_PATH):
+    """Todos os resultados da campanha, como lista de dicts"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT * FROM envios WHERE campanha_id = ? ORDER BY rowid", (campanha_id,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+def pending_receipts(campanha_id, db_path=DB_PATH):
+    """Contatos enviados com sucesso cujo recibo ainda pode mudar (não lidos)"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            """
+            SELECT telefone, nome, recibo FROM envios
+            WHERE campanha_id = ? AND status = 'enviado' AND COALESCE(recibo, '') != 'lido'
+            """,
+            (campanha_id,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+def update_receipts(campanha_id, recibos, db_path=DB_PATH):
+    """Atualiza em lote os recibos {telefone: status}, só quando o status avança. Retorna quantos mudaram"""
+    if not recibos:
+        return 0
+    agora = datetime.now().isoformat(timespec="seconds")
+    with closing(connect(db_path)) as conn, conn:
+        atuais = {
+            r["telefone"]: r["recibo"]
+            for r in conn.execute(
+                "SELECT telefone, recibo FROM envios WHERE campanha_id = ? AND status = 'enviado'",
+                (campanha_id,),
+            )
+        }
+        mudancas = [
+            (status, agora, campanha_id, telefone)
+            for telefone, status in recibos.items()
+            if telefone in atuais and RECIBO_ORDEM.get(status, 0) > RECIBO_ORDEM.get(atuais[telefone], 0)
+        ]
+        conn.executemany(
+            "UPDATE envios SET recibo = ?, recibo_em = ? WHERE campanha_id = ? AND telefone = ?",
+            mudancas,
+        )
+        return len(mudancas)
+
+def receipt_summary(campanha_id, db_path=DB_PATH):
+    """Contagem de contatos por status de envio e recibo"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            """
+            SELECT status, COALESCE(recibo, '-') AS recibo, COUNT(*) AS total
+            FROM envios WHERE campanha_id = ? GROUP BY status, recibo ORDER BY status, recibo
+            """,
+            (campanha_id,),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+def campaign_contacts_index(usuario, db_path=DB_PATH):
+    """Contatos já enviados pelo usuário: {telefone: id da campanha mais recente} e {nome: telefone}"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            """
+            SELECT e.telefone, e.nome, MAX(e.campanha_id) AS campanha_id
+            FROM envios e JOIN campanhas c ON c.id = e.campanha_id
+            WHERE c.usuario = ? AND e.status = 'enviado'
+            GROUP BY e.telefone
+            """,
+            (usuario,),
+        ).fetchall()
+    por_telefone = {r["telefone"]: r["campanha_id"] for r in rows}
+    por_nome = {str(r["nome"]).strip().lower(): r["telefone"] for r in rows if r["nome"]}
+    return por_telefone, por_nome
+
+def load_cursors(usuario, db_path=DB_PATH):
+    """Cursor de cada conversa do usuário: {conversa: {'assinatura', 'ultimo_id'}}"""
+    with closing(connect(db_path)) as conn:
+        rows = conn.execute(
+            "SELECT conversa, assinatura, ultimo_id FROM cursores_conversa WHERE usuario = ?", (usuario,)
+        ).fetchall()
+        return {r["conversa"]: {"assinatura": r["assinatura"], "ultimo_id": r["ultimo_id"]} for r in rows}
+
+def save_replies(usuario, respostas, cursores, db_path=DB_PATH):
+    """Grava respostas novas e avança os cursores das conversas, numa única transação
+
+    respostas: dicts com mensagem_id, telefone, campanha_id, conversa, texto e recebida_em.
+    cursores: {conversa: {'assinatura', 'ultimo_id'}} apenas das conversas alteradas.
+    Retorna quantas respostas eram realmente novas.
+    """
+    agora = datetime.now().isoformat(timespec="seconds")
+    with closing(connect(db_path)) as conn, conn:
+        antes = conn.total_changes
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO respostas
+                (mensagem_id, usuario, telefone, campanha_id, conversa, texto, recebida_em, coletada_em)
+            VALUES (:mensagem_id, :usuario, :telefone, :campanha_id, :conversa, :texto, :recebida_em, :coletada_em)
+            """,
+            [{**r, "usuario": usuario, "coletada_em": agora} for r in respostas],
+        )
+        novas = conn.total_changes - antes
+        conn.executemany(
+            """
+            INSERT INTO cursores_conversa (usuario, conversa, assinatura, ultimo_id, atualizado_em)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (usuario, conversa) DO UPDATE SET
+                assinatura = excluded.assinatura,
+                ultimo_id = COALESCE(excluded.ultimo_id, cursores_conversa.ultimo_id),
+                atualizado_em = excluded.atualizado_em
+            """,
+            [(usuario, conversa, c.get("assinatura"), c.get("ultimo_id"), agora) for conversa, c in cursores.items()],
+        )
+        return novas
+
+def list_replies(usuario, campanha_id=None, limite=None, db_path=DB_PATH):
+    """Respostas coletadas do usuário (opcionalmente de uma campanha), mais recentes primeiro"""
+    sql = """
+        SELECT r.campanha_id, r.telefone, e.nome, r.texto, r.recebida_em, r.coletada_em
+        FROM respostas r
+        LEFT JOIN envios e ON e.campanha_id = r.campanha_id AND e.telefone = r.telefone
+        WHERE r.usuario = ?
+    """
+    params = [usuario]
+    if campanha_id is not None:
+        sql += " AND r.campanha_id = ?"
+        params.append(campanha_id)
+    sql += " ORDER BY r.coletada_em DESC, r.rowid DESC"
+    if limite:
+        sql += " LIMIT ?"
+        params.append(limite)
+    with closing(connect(db_path)) as conn:
+        return [dict(r) for r in conn.execute(sql, params).fetchall()]
+
+def load_snapshot(usuario, fonte, db_path=DB_PATH):
+    """Impressões das linhas já enviadas da lista: (lista de impressões, lista de hashes de telefone)"""
+    with closing(connect(db_path)) as conn:
+        # Tuplas simples: a lista pode ter 100 mil linhas e sqlite3.Row custa caro aqui
+        conn.row_factory = None
+        rows = conn.execute(
+            "SELECT impressao, telefone_hash FROM impressoes_envio WHERE usuario = ? AND fonte = ?",
+            (usuario, fonte),
+        ).fetchall()
+    if not rows:
+        return [], []
+    impressoes, telefones = zip(*rows)
+    return list(impressoes), list(telefones)
+
+def save_snapshot(usuario, fonte, impressoes, db_path=DB_PATH):
+    """Grava (em lote) as impressões de linhas enviadas: lista de (impressao, telefone_hash)"""
+    if not impressoes:
+        return
+    agora = datetime.now().isoformat(timespec="seconds")
+    with closing(connect(db_path)) as conn, conn:
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO impressoes_envio (usuario, fonte, impressao, telefone_hash, enviado_em)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(usuario, fonte, int(impressao), int(telefone_hash), agora) for impressao, telefone_hash in impressoes],
+        )
+
+def clear_snapshot(usuario, fonte, db_path=DB_PATH):
+    """Esquece os envios anteriores da lista (a próxima campanha delta envia para todos). Retorna quantas apagou"""
+    with closing(connect(db_path)) as conn, conn:
+        return conn.execute(
+            "DELETE FROM impressoes_envio WHERE usuario = ? AND fonte = ?", (usuario, fonte)
+        ).rowcount
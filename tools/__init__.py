@@ -0,0 +1 @@
+# Verificações locais (sem WhatsApp nem planilha reais) dos transportes e da gravação de resultados
@@ -0,0 +1,219 @@
+# =====================================================
+# VERIFICAÇÃO DO ENVIO DISTRIBUÍDO (COORDENADOR + NÓS)
+# =====================================================
+# Publica uma campanha num SQLite temporário e roda vários nós
+# (worker.process_campaign) em processos separados, com um transporte
+# simulado que registra cada envio num arquivo por nó. Durante a campanha:
+#   - um nó é morto (SIGKILL) no meio de um envio, com outras linhas reservadas;
+#   - outro nó é congelado (SIGSTOP) além do lease e depois retomado.
+# No fim confere que cada linha foi enviada exatamente uma vez, que as
+# reservas do nó morto foram enviadas pelos outros e que a linha que ele
+# estava enviando ficou "incerta" em vez de ser enviada de novo.
+#
+#   python -m tools.check_coordinator [--linhas 300] [--nos 3]
+
+import argparse
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import closing
+
+import coordinator
+import worker
+from transports import FALHA_PERMANENTE, EnvioError, Transport
+
+LEASE = 3                # Segundos: curto para os leases vencerem durante a verificação
+ESPERA_FILA_VAZIA = 1    # No lugar dos 15s do worker.py, para a verificação não demorar
+TRAVAR_NO_ENVIO = 7      # O nó que vai morrer trava no 7º envio (meio do 2º lote de 5)
+
+def phone(linha_id):
+    return f"+55169{linha_id:08d}"
+
+class LogTransport(Transport):
+    """Transporte simulado: cada tentativa vira uma linha "telefone;ok|falha" no arquivo do nó
+
+    travar_em: número do envio em que o transporte registra o envio, cria o
+    arquivo `marcador` e trava (para o processo ser morto no meio do envio).
+    """
+    nome = "Simulado"
+
+    def __init__(self, arquivo, falhar=(), segundos=0.03, travar_em=None, marcador=None):
+        # os.write direto no descritor: o que foi registrado sobrevive a um SIGKILL
+        self._fd = os.open(arquivo, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self.falhar = set(falhar)
+        self.segundos = segundos
+        self.travar_em = travar_em
+        self.marcador = marcador
+        self.envios = 0
+        self._lock = threading.Lock()
+
+    def send(self, telefone, mensagem, anexo=None):
+        with self._lock:
+            self.envios += 1
+            envio = self.envios
+        if telefone in self.falhar:
+            os.write(self._fd, f"{telefone};falha\n".encode())
+            raise EnvioError("Número inválido ou não tem WhatsApp.", FALHA_PERMANENTE)
+        os.write(self._fd, f"{telefone};ok\n".encode())
+        if envio == self.travar_em:
+            open(self.marcador, "w").close()
+            time.sleep(3600)
+        time.sleep(self.segundos)
+
+    def close(self):
+        os.close(self._fd)
+
+def run_node(db, campanha_id, no, pasta, falhar, travar_em=None):
+    """Processo de um nó: worker.process_campaign com o transporte simulado"""
+    sys.stdout = open(os.path.join(pasta, f"{no}.log"), "w", buffering=1)
+    worker.ESPERA_FILA_VAZIA = ESPERA_FILA_VAZIA
+    args = argparse.Namespace(campanha=campanha_id, no=no, db=db, lote=5, lease=LEASE, intervalo=0)
+    transporte = LogTransport(
+        os.path.join(pasta, f"{no}.envios"), falhar=falhar,
+        travar_em=travar_em, marcador=os.path.join(pasta, f"{no}.travado"),
+    )
+    try:
+        codigo, _, _ = worker.process_campaign(args, transporte, lambda t: False, threading.Event())
+    finally:
+        transporte.close()
+    sys.exit(codigo)
+
+def wait_for(condicao, timeout, descricao):
+    limite = time.monotonic() + timeout
+    while not condicao():
+        if time.monotonic() > limite:
+            raise AssertionError(f"Tempo esgotado aguardando: {descricao}")
+        time.sleep(0.05)
+
+def sends_by_node(pasta, nos):
+    """{nó: [(telefone, resultado), ...]} lido dos arquivos de envio"""
+    envios = {}
+    for no in nos:
+        caminho = os.path.join(pasta, f"{no}.envios")
+        if not os.path.exists(caminho):
+            envios[no] = []
+            continue
+        with open(caminho) as f:
+            envios[no] = [tuple(linha.strip().split(";")) for linha in f if linha.strip()]
+    return envios
+
+def rows_by_status(db, campanha_id):
+    linhas = coordinator.campaign_rows(campanha_id, db_path=db)
+    return {linha["linha_id"]: linha for linha in linhas}
+
+def leases(db, campanha_id):
+    """{linha_id: (status, dono do lease)} das linhas com lease"""
+    with closing(coordinator.connect(db)) as conn:
+        return {
+            r["linha_id"]: (r["status"], r["lease_no"])
+            for r in conn.execute(
+                "SELECT linha_id, status, lease_no FROM linhas_dist WHERE campanha_id = ? AND lease_no IS NOT NULL",
+                (campanha_id,),
+            )
+        }
+
+def check_campaign(linhas, quantidade_nos):
+    with tempfile.TemporaryDirectory() as pasta:
+        db = os.path.join(pasta, "coordenador.db")
+        campanha_id = coordinator.publish_campaign(
+            "verificacao",
+            [{"linha_id": i, "nome": f"Contato {i}", "telefone": phone(i), "mensagem": f"Olá {i}"}
+             for i in range(linhas)],
+            intervalo=0, db_path=db,
+        )
+        falhar = {phone(i) for i in range(0, linhas, 50)}
+        contexto = multiprocessing.get_context("spawn")
+
+        normais = [f"no-{i}" for i in range(1, quantidade_nos + 1)]
+        morto, pausado = "no-morto", "no-pausado"
+        processos = {
+            no: contexto.Process(target=run_node, args=(db, campanha_id, no, pasta, falhar))
+            for no in normais + [pausado]
+        }
+        processos[morto] = contexto.Process(
+            target=run_node, args=(db, campanha_id, morto, pasta, falhar, TRAVAR_NO_ENVIO)
+        )
+        inicio = time.perf_counter()
+        for processo in processos.values():
+            processo.start()
+
+        # Nó morto no meio de um envio, ainda com outras linhas do lote reservadas
+        wait_for(lambda: os.path.exists(os.path.join(pasta, f"{morto}.travado")), 60, "nó travar no envio")
+        os.kill(processos[morto].pid, signal.SIGKILL)
+        processos[morto].join()
+        telefone_travado = sends_by_node(pasta, [morto])[morto][-1][0]
+        linha_travada = next(
+            i for i, linha in rows_by_status(db, campanha_id).items() if linha["telefone"] == telefone_travado
+        )
+        reservas = leases(db, campanha_id)
+        assert reservas[linha_travada] == (coordinator.ENVIANDO, morto), reservas.get(linha_travada)
+        reservadas_morto = [i for i, (status, no) in reservas.items() if no == morto and status == coordinator.RESERVADA]
+        assert reservadas_morto, "o nó morto deveria ter outras linhas reservadas"
+
+        # Nó congelado além do lease: as reservas dele passam para os outros e, ao voltar, ele não as envia
+        wait_for(lambda: len(sends_by_node(pasta, [pausado])[pausado]) >= 3, 60, "nó pausado enviar")
+        os.kill(processos[pausado].pid, signal.SIGSTOP)
+        time.sleep(2 * LEASE + 2 * ESPERA_FILA_VAZIA)
+        os.kill(processos[pausado].pid, signal.SIGCONT)
+
+        for no, processo in processos.items():
+            processo.join(120)
+            assert not processo.is_alive(), f"{no} não terminou"
+        tempo = time.perf_counter() - inicio
+        assert processos[morto].exitcode == -signal.SIGKILL
+        assert all(processos[no].exitcode == 0 for no in normais + [pausado]), {
+            no: p.exitcode for no, p in processos.items()
+        }
+
+        envios = sends_by_node(pasta, processos)
+        final = rows_by_status(db, campanha_id)
+        resumo = coordinator.progress_summary(campanha_id, db_path=db)
+        assert coordinator.pending_count(campanha_id, db_path=db) == 0
+
+    tentativas = Counter(telefone for lista in envios.values() for telefone, _ in lista)
+    por_linha = {i: tentativas[phone(i)] for i in range(linhas)}
+    duplicadas = {i: n for i, n in por_linha.items() if n > 1}
+    assert not duplicadas, f"linhas enviadas mais de uma vez: {duplicadas}"
+
+    # A linha que estava em envio quando o nó morreu: incerta, tentada uma única vez (pelo nó morto)
+    assert final[linha_travada]["status"] == coordinator.INCERTA, final[linha_travada]
+    assert [t for t, _ in envios[morto]].count(telefone_travado) == 1
+    # As demais reservas do nó morto foram enviadas por outros nós
+    for i in reservadas_morto:
+        assert final[i]["status"] in (coordinator.ENVIADO, coordinator.ERRO), final[i]
+        assert final[i]["no"] != morto, final[i]
+
+    for i, linha in final.items():
+        if i == linha_travada:
+            continue
+        esperado = coordinator.ERRO if phone(i) in falhar else coordinator.ENVIADO
+        assert linha["status"] == esperado, linha
+        assert por_linha[i] == 1, (i, por_linha[i])
+
+    enviados = Counter(linha["status"] for linha in final.values())
+    print(
+        f"coordenador: {linhas} linhas, {len(processos)} nós ({morto} morto no meio do envio, "
+        f"{pausado} congelado {2 * LEASE + 2 * ESPERA_FILA_VAZIA}s) em {tempo:.1f}s | "
+        f"{enviados[coordinator.ENVIADO]} enviadas, {enviados[coordinator.ERRO]} com erro, "
+        f"{enviados[coordinator.INCERTA]} incerta | nenhuma linha enviada duas vezes | "
+        f"{len(reservadas_morto)} reservas do nó morto enviadas por outros"
+    )
+    por_no = {no["no"]: no["enviados"] for no in resumo["nos"]}
+    print("enviadas por nó: " + ", ".join(f"{no} {n}" for no, n in sorted(por_no.items())))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica o envio distribuído com nós que caem ou travam")
+    parser.add_argument("--linhas", type=int, default=300)
+    parser.add_argument("--nos", type=int, default=3, help="Nós normais (além do que morre e do que congela)")
+    args = parser.parse_args(argv)
+
+    check_campaign(args.linhas, args.nos)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# =====================================================
+# VERIFICAÇÃO DO HttpApiTransport CONTRA A API SIMULADA
+# =====================================================
+# Roda o transporte HTTP contra tools/mock_api.py e confere:
+#   - envio individual em paralelo (uma requisição por mensagem);
+#   - endpoint de lote (uma requisição por lote, falhas por item);
+#   - respostas de lote malformadas (viram falha transiente, sem exceção);
+#   - reaproveitamento do id da mídia: um upload por arquivo, não por contato,
+#     comparado com um transporte que sobe o arquivo a cada envio;
+#   - áudio com texto: se só o texto falhar, o áudio não é enviado de novo;
+#   - telefones curtos falham como nos outros transportes, sem requisição.
+#
+#   python -m tools.check_http_transport [--contatos 200] [--mb 5] [--mb-por-segundo 100]
+
+import argparse
+import copy
+import itertools
+import time
+
+from tools.mock_api import MockApi
+from transports import FALHA_PERMANENTE, FALHA_TRANSIENTE, Anexo, EnvioError, HttpApiTransport
+
+def phones(n):
+    return [f"+55169{i:08d}" for i in range(n)]
+
+class NoMediaReuseTransport(HttpApiTransport):
+    """Linha de base: cada envio usa uma chave nova de anexo (um upload por contato)"""
+    _envios = itertools.count()
+
+    def _media_id(self, anexo):
+        copia = copy.copy(anexo)
+        copia.chave = f"{anexo.chave}:{next(self._envios)}"
+        return super()._media_id(copia)
+
+def check_parallel(contatos):
+    """Sem endpoint de lote: uma requisição por mensagem, falhas classificadas por contato"""
+    telefones = phones(contatos)
+    falhar = {telefones[3].lstrip('+')}
+    with MockApi(falhar=falhar) as api:
+        transporte = HttpApiTransport(api.url, lote=20)
+        try:
+            inicio = time.perf_counter()
+            resultados = []
+            for i in range(0, contatos, transporte.lote):
+                resultados += transporte.send_batch([(t, f"Olá {t}") for t in telefones[i:i + transporte.lote]])
+            tempo = time.perf_counter() - inicio
+        finally:
+            transporte.close()
+    assert api.requisicoes["mensagens"] == contatos, api.requisicoes
+    assert api.requisicoes["lote"] == 0, api.requisicoes
+    falhas = [i for i, r in enumerate(resultados) if r is not None]
+    assert falhas == [3], falhas
+    assert resultados[3].categoria == FALHA_PERMANENTE
+    print(f"individual: {contatos} mensagens, {api.requisicoes['mensagens']} requisições, {tempo:.2f}s")
+
+def check_batch(contatos):
+    """Com endpoint de lote: uma requisição por lote e o resultado distribuído por item"""
+    telefones = phones(contatos)
+    falhar = {telefones[5].lstrip('+'), telefones[-1].lstrip('+')}
+    with MockApi(falhar=falhar) as api:
+        transporte = HttpApiTransport(api.url, lote=20, batch_path="batch")
+        try:
+            inicio = time.perf_counter()
+            resultados = []
+            for i in range(0, contatos, transporte.lote):
+                resultados += transporte.send_batch([(t, f"Olá {t}") for t in telefones[i:i + transporte.lote]])
+            tempo = time.perf_counter() - inicio
+        finally:
+            transporte.close()
+    lotes = -(-contatos // 20)
+    assert api.requisicoes == {"mensagens": 0, "lote": lotes, "media": 0}, api.requisicoes
+    assert len(api.mensagens) == contatos
+    falhas = [i for i, r in enumerate(resultados) if r is not None]
+    assert falhas == [5, contatos - 1], falhas
+    assert all(resultados[i].categoria == FALHA_PERMANENTE for i in falhas)
+    print(f"lote: {contatos} mensagens, {api.requisicoes['lote']} requisições, {tempo:.2f}s")
+
+def check_malformed_batch():
+    """Corpos de lote inválidos não derrubam o envio: cada item vira EnvioError"""
+    casos = {
+        "json inválido": b"<html>erro</html>",
+        "sem results": b'{"ok": true}',
+        "results não é lista": b'{"results": {"status": 200}}',
+        "corpo não é objeto": b'[1, 2, 3]',
+        "item inválido": b'{"results": [{"status": 200}, "x", {"status": "abc"}]}',
+        "lista curta": b'{"results": [{"status": 200}]}',
+    }
+    itens = [(t, "Olá") for t in phones(3)]
+    for nome, corpo in casos.items():
+        with MockApi(resposta_lote=corpo) as api:
+            transporte = HttpApiTransport(api.url, batch_path="batch")
+            try:
+                resultados = transporte.send_batch(itens)
+            finally:
+                transporte.close()
+        assert len(resultados) == len(itens), nome
+        falhas = [r for r in resultados if r is not None]
+        assert falhas and all(isinstance(r, EnvioError) for r in falhas), (nome, resultados)
+        if nome not in ("item inválido", "lista curta"):
+            assert all(r.categoria == FALHA_TRANSIENTE for r in resultados), (nome, resultados)
+    assert resultados[0] is None  # "lista curta": o item com resultado foi enviado
+    print(f"lote malformado: {len(casos)} casos tratados como falha por item")
+
+def run_attachment(classe, anexo, telefones, mb_por_segundo, batch_path):
+    with MockApi(mb_por_segundo=mb_por_segundo) as api:
+        transporte = classe(api.url, lote=20, batch_path=batch_path)
+        try:
+            inicio = time.perf_counter()
+            resultados = []
+            for i in range(0, len(telefones), transporte.lote):
+                parte = telefones[i:i + transporte.lote]
+                resultados += transporte.send_batch([(t, "Segue o arquivo", anexo) for t in parte])
+            tempo = time.perf_counter() - inicio
+        finally:
+            transporte.close()
+    assert all(r is None for r in resultados), [r for r in resultados if r is not None][:3]
+    ids = {p[anexo.tipo]["id"] for p in api.mensagens}
+    return api, tempo, ids
+
+def check_media_reuse(contatos, mb, mb_por_segundo):
+    """O arquivo sobe uma vez por sessão e todas as mensagens usam o mesmo id de mídia"""
+    anexo = Anexo("catalogo.pdf", b"%PDF-1.4\n" + bytes(int(mb * 1024 * 1024)))
+    telefones = phones(contatos)
+    for batch_path in (None, "batch"):
+        modo = "lote" if batch_path else "individual"
+        api, tempo, ids = run_attachment(HttpApiTransport, anexo, telefones, mb_por_segundo, batch_path)
+        assert api.requisicoes["media"] == 1, api.requisicoes
+        assert api.uploads == [len(anexo.dados)]
+        assert len(ids) == 1 and len(api.mensagens) == contatos
+        assert all(p["document"]["filename"] == anexo.nome for p in api.mensagens)
+
+        base, tempo_base, ids_base = run_attachment(NoMediaReuseTransport, anexo, telefones, mb_por_segundo, batch_path)
+        assert base.requisicoes["media"] == contatos, base.requisicoes
+        assert len(ids_base) == contatos
+
+        enviado, enviado_base = sum(api.uploads) / 2**20, sum(base.uploads) / 2**20
+        print(
+            f"anexo ({modo}): {contatos} contatos, {mb:g} MB a {mb_por_segundo:g} MB/s | "
+            f"reaproveitando: 1 upload, {enviado:.1f} MB, {tempo / contatos * 1000:.1f} ms/msg | "
+            f"sem reaproveitar: {contatos} uploads, {enviado_base:.1f} MB, {tempo_base / contatos * 1000:.1f} ms/msg"
+        )
+
+def check_audio_caption():
+    """Áudio enviado e texto separado com falha: a exceção marca o anexo como enviado"""
+    anexo = Anexo("recado.ogg", b"OggS" + bytes(1024))
+    telefone = phones(1)[0]
+    with MockApi(falhar_texto={telefone.lstrip('+')}) as api:
+        transporte = HttpApiTransport(api.url)
+        try:
+            [erro] = transporte.send_batch([(telefone, "Ouça o recado", anexo)])
+            # Como o laço de envio faz na próxima tentativa: só o texto, sem o anexo
+            [erro_texto] = transporte.send_batch([(telefone, "Ouça o recado", None)])
+        finally:
+            transporte.close()
+    assert isinstance(erro, EnvioError) and erro.categoria == FALHA_PERMANENTE, erro
+    assert getattr(erro, "anexo_enviado", False), "falha do texto deveria marcar o áudio como enviado"
+    assert erro_texto is not None and not getattr(erro_texto, "anexo_enviado", False)
+    tipos = [p["type"] for p in api.mensagens]
+    assert tipos == ["audio", "text", "text"], tipos
+    assert api.requisicoes["media"] == 1
+    print("áudio com texto: falha só do texto não reenvia o áudio")
+
+def check_invalid_phone():
+    """Número curto: EnvioError permanente antes de qualquer requisição (individual e no lote)"""
+    itens = [("+55123", "Olá"), (phones(1)[0], "Olá")]
+    for batch_path in (None, "batch"):
+        with MockApi() as api:
+            transporte = HttpApiTransport(api.url, batch_path=batch_path)
+            try:
+                resultados = transporte.send_batch(itens)
+            finally:
+                transporte.close()
+        assert isinstance(resultados[0], EnvioError) and resultados[0].categoria == FALHA_PERMANENTE, resultados
+        assert resultados[1] is None, resultados
+        assert [p["to"] for p in api.mensagens] == [itens[1][0].lstrip('+')], api.mensagens
+    print("telefone curto: recusado sem chegar à API (individual e lote)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica o HttpApiTransport contra a API simulada")
+    parser.add_argument("--contatos", type=int, default=200)
+    parser.add_argument("--mb", type=float, default=5, help="Tamanho do anexo em MB")
+    parser.add_argument("--mb-por-segundo", type=float, default=100, help="Velocidade simulada do upload")
+    args = parser.parse_args(argv)
+
+    check_parallel(args.contatos)
+    check_batch(args.contatos)
+    check_malformed_batch()
+    check_media_reuse(min(args.contatos, 40), args.mb, args.mb_por_segundo)
+    check_audio_caption()
+    check_invalid_phone()
+    print("OK")
+
+if __name__ == "__main__":
+    main()
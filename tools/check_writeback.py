@@ -0,0 +1,122 @@
+# =====================================================
+# VERIFICAÇÃO DO ResultWriteback (GRAVAÇÃO EM LOTES)
+# =====================================================
+# Simula uma campanha grande gravando num destino em memória e confere:
+#   - quantas gravações e quantas linhas escritas no total, com o lote
+#     escalado pelo tamanho da tabela e com o lote fixo (linha de base);
+#   - que a tabela final tem o último status de cada linha;
+#   - um destino que falha uma vez (nada se perde e a próxima gravação leva tudo);
+#   - a gravação real num .xlsx temporário (aba de resultados relida do arquivo).
+#
+#   python -m tools.check_writeback [--linhas 50000]
+
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from writeback import ABA_RESULTADOS, COLUNAS_RESULTADO, ResultWriteback, excel_destination
+
+class MemoryDestination:
+    """Destino em memória que conta gravações e linhas escritas (cada gravação reescreve a tabela)"""
+
+    def __init__(self, falhas=0):
+        self.falhas = falhas
+        self.gravacoes = 0
+        self.linhas = 0
+        self.ultima = None
+
+    def __call__(self, df):
+        if self.falhas:
+            self.falhas -= 1
+            raise OSError("Arquivo aberto em outro programa")
+        self.gravacoes += 1
+        self.linhas += len(df)
+        self.ultima = df
+
+class FixedBatchWriteback(ResultWriteback):
+    """Linha de base: lote e intervalo fixos, sem escalar com a tabela"""
+
+    def limits(self):
+        return self.tamanho_lote, self.intervalo
+
+def simulate(classe, linhas):
+    """Registra um resultado por linha, como o laço de envio, e grava o resto no fim"""
+    destino = MemoryDestination()
+    writeback = classe(destino, linhas_origem=linhas)
+    inicio = time.perf_counter()
+    for i in range(linhas):
+        status = "Erro" if i % 97 == 0 else "Enviado"
+        writeback.add(i, f"Contato {i}", f"+55169{i:08d}", status, "2026-10-19 10:00:00",
+                      "Número inválido" if status == "Erro" else None)
+        writeback.maybe_flush()
+    writeback.flush()
+    tempo = time.perf_counter() - inicio
+    return destino, tempo
+
+def check_volume(linhas):
+    destino, tempo = simulate(ResultWriteback, linhas)
+    base, tempo_base = simulate(FixedBatchWriteback, linhas)
+
+    for d in (destino, base):
+        final = d.ultima
+        assert len(final) == linhas and list(final.columns) == COLUNAS_RESULTADO
+        assert final["Linha"].tolist() == list(range(2, linhas + 2))
+        assert (final["Status"] == "Erro").sum() == len(range(0, linhas, 97))
+    # Escalado: o total escrito fica proporcional ao tamanho da lista
+    assert destino.linhas <= 12 * linhas, destino.linhas
+    assert destino.gravacoes < base.gravacoes
+    print(
+        f"volume: {linhas} linhas | escalado: {destino.gravacoes} gravações, {destino.linhas} linhas escritas, "
+        f"{tempo:.2f}s | lote fixo: {base.gravacoes} gravações, {base.linhas} linhas escritas, {tempo_base:.2f}s"
+    )
+
+def check_failure():
+    """Falha na gravação mantém os pendentes e guarda o erro; a próxima gravação leva tudo"""
+    destino = MemoryDestination(falhas=1)
+    writeback = ResultWriteback(destino, tamanho_lote=10)
+    for i in range(10):
+        writeback.add(i, f"Contato {i}", f"+55169{i:08d}", "Enviado", "2026-10-19 10:00:00")
+    assert writeback.maybe_flush() is False
+    assert writeback.ultimo_erro and writeback.pendentes == 10
+    writeback.add(3, "Contato 3", "+5516900000003", "Erro", "2026-10-19 10:01:00", "Sem WhatsApp")
+    assert writeback.flush() is True
+    assert writeback.ultimo_erro is None and writeback.pendentes == 0
+    assert len(destino.ultima) == 10
+    assert destino.ultima.loc[3, "Status"] == "Erro" and destino.ultima.loc[3, "Erro"] == "Sem WhatsApp"
+    print("falha: pendentes mantidos e gravados na tentativa seguinte")
+
+def check_excel(linhas):
+    """Grava num .xlsx real (com uma aba de contatos já existente) e relê a aba de resultados"""
+    with tempfile.TemporaryDirectory() as pasta:
+        path = os.path.join(pasta, "contatos.xlsx")
+        pd.DataFrame({"Nome": ["A", "B"], "Telefone": ["1", "2"]}).to_excel(path, index=False)
+        writeback = ResultWriteback(excel_destination(path), linhas_origem=linhas - 1)
+        for i in range(linhas):
+            writeback.add(i, f"Contato {i}", f"+55169{i:08d}", "Enviado", "2026-10-19 10:00:00")
+            writeback.maybe_flush()
+        writeback.flush()
+        assert writeback.pendentes == 0 and writeback.ultimo_erro is None, writeback.ultimo_erro
+        abas = pd.read_excel(path, sheet_name=None, dtype=str)
+    assert set(abas) == {"Sheet1", ABA_RESULTADOS}, set(abas)
+    assert len(abas["Sheet1"]) == 2
+    resultados = abas[ABA_RESULTADOS]
+    assert len(resultados) == linhas and (resultados["Status"] == "Enviado").all()
+    # A última linha foi incluída no editor: sem número de linha da planilha
+    assert resultados["Linha"].isna().iloc[-1] and resultados["Linha"].iloc[0] == "2"
+    print(f"excel: {linhas} linhas gravadas em {writeback.gravacoes} gravações e relidas do arquivo")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verifica a gravação em lotes do ResultWriteback")
+    parser.add_argument("--linhas", type=int, default=50000)
+    args = parser.parse_args(argv)
+
+    check_volume(args.linhas)
+    check_failure()
+    check_excel(min(args.linhas, 500))
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# =====================================================
+# API DO WHATSAPP SIMULADA (SERVIDOR LOCAL)
+# =====================================================
+# Servidor HTTP local no formato usado pelo HttpApiTransport: mensagens
+# individuais, endpoint de lote e upload de mídia. Registra o que recebeu
+# para as verificações em tools/ e também serve para testar o app à mão:
+#
+#   python -m tools.mock_api --porta 8099
+#
+# (no app: meio de envio "API HTTP (Business)", URL http://127.0.0.1:8099)
+
+import argparse
+import json
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockApi:
+    """API simulada rodando numa thread. Use como context manager (url, mensagens, uploads...)
+
+    falhar: telefones (sem +) que recebem HTTP 400 - por requisição ou por item do lote.
+    falhar_texto: telefones cujas mensagens de texto (só elas) recebem HTTP 400.
+    resposta_lote: corpo bruto (bytes) devolvido pelo endpoint de lote no lugar do normal.
+    mb_por_segundo: velocidade simulada de recebimento dos uploads de mídia.
+    """
+
+    def __init__(self, porta=0, falhar=(), falhar_texto=(), resposta_lote=None, mb_por_segundo=None):
+        self.falhar = set(falhar)
+        self.falhar_texto = set(falhar_texto)
+        self.resposta_lote = resposta_lote
+        self.mb_por_segundo = mb_por_segundo
+        self.mensagens = []        # Payloads de mensagem recebidos (individuais e de lotes)
+        self.uploads = []          # Bytes de cada upload de mídia
+        self.requisicoes = {"mensagens": 0, "lote": 0, "media": 0}
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._servidor.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def _status(self, payload):
+        telefone = str(payload.get("to"))
+        if telefone in self.falhar or (payload.get("type") == "text" and telefone in self.falhar_texto):
+            return 400
+        return 200
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *_):
+                pass
+
+            def _responder(self, status, corpo):
+                dados = corpo if isinstance(corpo, bytes) else json.dumps(corpo).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.endswith("/media"):
+                    return self._media(corpo)
+                if self.path.endswith("/batch"):
+                    return self._lote(corpo)
+                payload = json.loads(corpo)
+                with api._lock:
+                    api.requisicoes["mensagens"] += 1
+                    api.mensagens.append(payload)
+                status = api._status(payload)
+                if status != 200:
+                    return self._responder(status, {"error": {"message": "Número inválido"}})
+                self._responder(200, {"messages": [{"id": f"wamid.{len(api.mensagens)}"}]})
+
+            def _lote(self, corpo):
+                payloads = json.loads(corpo)["messages"]
+                with api._lock:
+                    api.requisicoes["lote"] += 1
+                    api.mensagens.extend(payloads)
+                if api.resposta_lote is not None:
+                    return self._responder(200, api.resposta_lote)
+                resultados = [
+                    {"status": 200} if api._status(p) == 200 else {"status": 400, "error": "Número inválido"}
+                    for p in payloads
+                ]
+                self._responder(200, {"results": resultados})
+
+            def _media(self, corpo):
+                # multipart/form-data lido com o parser de e-mail (o módulo cgi saiu do Python 3.13)
+                cabecalho = f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode()
+                formulario = BytesParser(policy=policy.default).parsebytes(cabecalho + corpo)
+                arquivo = next(p for p in formulario.iter_parts() if p.get_param("name", header="content-disposition") == "file")
+                tamanho = len(arquivo.get_payload(decode=True))
+                if api.mb_por_segundo:
+                    time.sleep(tamanho / (api.mb_por_segundo * 1024 * 1024))
+                with api._lock:
+                    api.requisicoes["media"] += 1
+                    api.uploads.append(tamanho)
+                    media_id = f"media.{len(api.uploads)}"
+                self._responder(200, {"id": media_id})
+
+        return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API do WhatsApp simulada para testes locais")
+    parser.add_argument("--porta", type=int, default=8099)
+    parser.add_argument("--falhar", nargs="*", default=[], help="Telefones (sem +) que devem falhar")
+    args = parser.parse_args(argv)
+    with MockApi(args.porta, falhar=args.falhar) as api:
+        print(f"API simulada em {api.url} (Ctrl+C para sair)", flush=True)
+        try:
+            while True:
+                time.sleep(5)
+                print(f"{len(api.mensagens)} mensagens, {len(api.uploads)} uploads", flush=True)
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
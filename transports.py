@@ -0,0 +1,687 @@
+# =====================================================
+# MEIOS DE ENVIO (TRANSPORTES)
+# =====================================================
+# Toda campanha envia através de um Transport: WhatsApp Web via Selenium,
+# PyWhatKit ou uma API HTTP no estilo WhatsApp Business. O laço de envio
+# do app só conhece esta interface (send / send_batch / close) e as
+# categorias de falha abaixo.
+
+import base64
+import hashlib
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import (
+    TimeoutException,
+    StaleElementReferenceException,
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    WebDriverException,
+)
+from webdriver_manager.chrome import ChromeDriverManager
+
+# Categorias de falha no envio
+FALHA_TRANSIENTE = "transiente"   # Timeout, conexão instável, elemento "stale" -> tentar de novo depois
+FALHA_PERMANENTE = "permanente"   # Número inválido / sem WhatsApp -> não adianta repetir
+FALHA_SESSAO = "sessao"           # Deslogado, navegador travou/fechou, token expirado -> reconectar
+
+# Trechos de mensagens do WebDriver que indicam perda da sessão do navegador
+_SESSAO_MARCADORES = (
+    "invalid session id",
+    "no such window",
+    "session deleted",
+    "chrome not reachable",
+    "target window already closed",
+    "crashed",
+    "connection refused",
+    "max retries exceeded",
+)
+
+# Política de reenvio e reconexão (a mesma no app, nos nós distribuídos e no broker)
+RETRY_MAX_TENTATIVAS = 3      # Tentativas por contato para falhas transientes
+RETRY_BACKOFF_BASE = 30       # Segundos de espera após a 1ª falha (dobra a cada tentativa)
+RETRY_BACKOFF_MAX = 600       # Teto da espera entre tentativas
+RECONEXAO_MAX = 2             # Reconexões automáticas por campanha
+LOGIN_VERIFICACAO = 5         # Segundos entre verificações do login no WhatsApp Web
+
+def backoff_delay(tentativa):
+    """Tempo de espera (segundos) antes da próxima tentativa - backoff exponencial"""
+    return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** max(tentativa - 1, 0)))
+
+def wait_whatsapp_login(driver, timeout, aguardando=None, cancelar=None):
+    """Aguarda o WhatsApp Web já aberto mostrar a lista de conversas. Retorna True se logou
+
+    aguardando(driver) é chamado a cada verificação sem login (para mostrar o
+    QR Code); cancelar é um threading.Event que interrompe a espera.
+    """
+    fim = time.time() + timeout
+    while time.time() < fim:
+        if driver.find_elements(By.XPATH, '//div[@id="pane-side"]'):
+            return True
+        if aguardando is not None:
+            try:
+                aguardando(driver)
+            except Exception:
+                pass
+        if cancelar is not None:
+            if cancelar.wait(LOGIN_VERIFICACAO):
+                return False
+        else:
+            time.sleep(LOGIN_VERIFICACAO)
+    return False
+
+class EnvioError(Exception):
+    """Erro de envio já classificado em uma das categorias FALHA_*"""
+    def __init__(self, mensagem, categoria):
+        super().__init__(mensagem)
+        self.categoria = categoria
+
+def check_phone(telefone):
+    """Validação básica de comprimento (DDI + DDD + 9 + 8 dígitos = 13 dígitos, ou sem o 9 extra = 12)"""
+    if len(telefone.lstrip('+')) < 12:
+        raise EnvioError(f"Número de telefone inválido (muito curto): {telefone}", FALHA_PERMANENTE)
+
+def classify_error(exc):
+    """Classifica uma exceção do envio como transiente, permanente ou de sessão"""
+    if isinstance(exc, EnvioError):
+        return exc.categoria
+    if isinstance(exc, (InvalidSessionIdException, NoSuchWindowException)):
+        return FALHA_SESSAO
+    if isinstance(exc, (TimeoutException, StaleElementReferenceException)):
+        return FALHA_TRANSIENTE
+    texto = str(exc).lower()
+    if isinstance(exc, (WebDriverException, ConnectionError)):
+        if any(marcador in texto for marcador in _SESSAO_MARCADORES):
+            return FALHA_SESSAO
+        return FALHA_TRANSIENTE
+    if isinstance(exc, (ValueError, KeyError)):
+        # Dados da linha inválidos (telefone curto, coluna vazia...)
+        return FALHA_PERMANENTE
+    # Erro desconhecido: tratar como transiente (limitado pelo número de tentativas)
+    return FALHA_TRANSIENTE
+
+class Anexo:
+    """Arquivo anexado às mensagens (imagem, vídeo, áudio ou documento)
+
+    "chave" (sha1 do conteúdo) identifica o arquivo nos caches dos
+    transportes: o mesmo arquivo é preparado uma vez por sessão (cache da
+    página no WhatsApp Web, id da mídia na API), não uma por contato.
+    """
+    def __init__(self, nome, dados, mime=None):
+        self.nome = nome
+        self.dados = dados
+        self.mime = mime or mimetypes.guess_type(nome)[0] or "application/octet-stream"
+        self.chave = hashlib.sha1(dados).hexdigest()
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "rb") as f:
+            return cls(os.path.basename(path), f.read())
+
+    @property
+    def tipo(self):
+        """Tipo de mídia no WhatsApp: image, video, audio ou document"""
+        principal = self.mime.split("/")[0]
+        return principal if principal in ("image", "video", "audio") else "document"
+
+def create_chrome_driver(headless=False):
+    """Inicia o Chrome/Chromium controlado pelo Selenium. Levanta Exception se nenhuma tentativa funcionar"""
+    options = webdriver.ChromeOptions()
+    
+    # Detectar se estamos em ambiente Linux/Cloud
+    is_cloud = os.name != 'nt'
+    
+    if is_cloud or headless:
+        # === Flags obrigatórias para containers (Streamlit Cloud / Docker) ===
+        options.add_argument("--headless=new")          # Modo headless novo (mais estável)
+        options.add_argument("--no-sandbox")            # Obrigatório em containers
+        options.add_argument("--disable-dev-shm-usage") # Evita crash por /dev/shm pequeno
+        options.add_argument("--disable-gpu")           # Sem placa de vídeo
+        options.add_argument("--disable-software-rasterizer")
+        options.add_argument("--remote-debugging-port=9222")  # Necessário para DevTools
+        options.add_argument("--window-size=1920,1080")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--disable-background-timer-throttling")
+        options.add_argument("--disable-backgrounding-occluded-windows")
+        options.add_argument("--disable-renderer-backgrounding")
+        options.add_argument("--disable-features=VizDisplayCompositor")
+        options.add_argument("--single-process")        # Mais estável em containers
+        
+        # User-Agent moderno para o WhatsApp Web aceitar a conexão
+        # (o Chromium do Streamlit Cloud pode ser antigo e o WhatsApp exige Chrome 85+)
+        options.add_argument(
+            '--user-agent=Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 '
+            '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+        )
+        
+        # Definir localização do Chromium no Linux
+        if os.path.exists("/usr/bin/chromium"):
+            options.binary_location = "/usr/bin/chromium"
+        elif os.path.exists("/usr/bin/chromium-browser"):
+            options.binary_location = "/usr/bin/chromium-browser"
+        elif os.path.exists("/usr/bin/google-chrome"):
+            options.binary_location = "/usr/bin/google-chrome"
+    else:
+        # === Modo local (Windows com janela visível) ===
+        options.add_argument("--start-maximized")
+        options.add_argument("--disable-blink-features=AutomationControlled")
+        options.add_experimental_option("excludeSwitches", ["enable-automation"])
+        options.add_experimental_option('useAutomationExtension', False)
+    
+    # Tentar iniciar o driver
+    driver = None
+    errors = []
+    
+    # Tentativa 1: webdriver_manager (funciona bem no local/Windows)
+    if not is_cloud:
+        try:
+            service = Service(ChromeDriverManager().install())
+            driver = webdriver.Chrome(service=service, options=options)
+        except Exception as e1:
+            errors.append(f"webdriver_manager: {str(e1)[:100]}")
+    
+    # Tentativa 2: ChromeDriver no PATH (Cloud/Linux)
+    if driver is None:
+        try:
+            driver = webdriver.Chrome(options=options)
+        except Exception as e2:
+            errors.append(f"PATH: {str(e2)[:100]}")
+    
+    # Tentativa 3: Chromium-driver em caminhos conhecidos
+    if driver is None:
+        for chromedriver_path in ["/usr/bin/chromedriver", "/usr/lib/chromium/chromedriver", "/usr/lib/chromium-browser/chromedriver"]:
+            if os.path.exists(chromedriver_path):
+                try:
+                    service = Service(chromedriver_path)
+                    driver = webdriver.Chrome(service=service, options=options)
+                    break
+                except Exception as e3:
+                    errors.append(f"{chromedriver_path}: {str(e3)[:100]}")
+    
+    if driver is None:
+        raise Exception(" | ".join(errors))
+    
+    return driver
+
+class Transport:
+    """Interface dos meios de envio
+
+    send() envia uma mensagem (opcionalmente com um Anexo) e levanta
+    EnvioError (ou outra exceção, classificada por classify_error) em caso
+    de falha; se o anexo já saiu e só o texto falhou, a exceção leva
+    "anexo_enviado". send_many() envia várias mensagens para o mesmo
+    contato; se falhar no meio, a exceção leva em "enviadas" quantas já saíram.
+    send_batch() envia vários itens (telefone, mensagem ou lista de
+    mensagens[, anexo]) e devolve, na mesma ordem, None para sucesso ou a
+    exceção da falha. "lote" é quantos itens o laço de envio entrega por vez.
+    """
+    nome = "Transporte"
+    lote = 1
+    usa_navegador = False
+
+    def send(self, telefone, mensagem, anexo=None):
+        raise NotImplementedError
+
+    def send_many(self, telefone, mensagens, anexo=None):
+        # O anexo vai junto com a primeira mensagem
+        for enviadas, mensagem in enumerate(mensagens):
+            try:
+                self.send(telefone, mensagem, anexo if enviadas == 0 else None)
+            except Exception as e:
+                e.enviadas = enviadas
+                raise
+
+    def send_item(self, telefone, mensagem, anexo=None):
+        """Envia um item do lote: uma mensagem (str) ou várias para o mesmo contato (list)"""
+        if isinstance(mensagem, list):
+            self.send_many(telefone, mensagem, anexo)
+        else:
+            self.send(telefone, mensagem, anexo)
+
+    def send_batch(self, itens):
+        resultados = []
+        for item in itens:
+            try:
+                self.send_item(*item)
+                resultados.append(None)
+            except Exception as e:
+                resultados.append(e)
+        return resultados
+
+    def close(self):
+        pass
+
+# Anexos no WhatsApp Web: o arquivo vai uma única vez para o Cache Storage da
+# página (sobrevive à navegação entre conversas) e, a cada contato, é colado
+# na caixa de mensagem a partir do cache - sem passar os bytes de novo pelo
+# WebDriver nem pelo seletor de arquivos. O próprio WhatsApp Web continua
+# subindo a mídia para os servidores dele a cada envio.
+CACHE_ANEXOS = "whatsapp-sender-anexos"
+ANEXO_PARTE_BYTES = 1 << 20       # Bytes por chamada ao injetar o arquivo na página
+
+_JS_ANEXO_EM_CACHE = """
+const [chave, pronto] = arguments;
+caches.open('""" + CACHE_ANEXOS + """')
+  .then(c => c.match('/__anexos/' + chave))
+  .then(r => pronto(Boolean(r)), () => pronto(false));
+"""
+
+_JS_GUARDAR_ANEXO = """
+const [chave, mime, pronto] = arguments;
+const partes = (window.__anexoPartes || []).map(b64 => Uint8Array.from(atob(b64), c => c.charCodeAt(0)));
+delete window.__anexoPartes;
+caches.open('""" + CACHE_ANEXOS + """')
+  .then(c => c.put('/__anexos/' + chave, new Response(new Blob(partes, {type: mime}))))
+  .then(() => pronto(true), e => pronto(String(e)));
+"""
+
+_JS_COLAR_ANEXO = """
+const [chave, nome, mime, pronto] = arguments;
+caches.open('""" + CACHE_ANEXOS + """')
+  .then(c => c.match('/__anexos/' + chave))
+  .then(r => { if (!r) { throw new Error('arquivo fora do cache'); } return r.blob(); })
+  .then(blob => {
+    const caixa = document.querySelector('div[contenteditable="true"][data-tab="10"]');
+    if (!caixa) { throw new Error('caixa de mensagem não encontrada'); }
+    const dados = new DataTransfer();
+    dados.items.add(new File([blob], nome, {type: mime}));
+    caixa.focus();
+    caixa.dispatchEvent(new ClipboardEvent('paste', {clipboardData: dados, bubbles: true, cancelable: true}));
+    pronto(true);
+  })
+  .catch(e => pronto(String(e)));
+"""
+
+class SeleniumTransport(Transport):
+    """Envio pelo WhatsApp Web controlado via Selenium (um chat aberto por mensagem)"""
+    nome = "WhatsApp Web (Selenium)"
+    usa_navegador = True
+
+    def __init__(self, driver):
+        self.driver = driver
+        # Anexos já guardados no Cache Storage, por sessão do navegador (reconectar = cache novo)
+        self._anexos_sessao = None
+        self._anexos_em_cache = set()
+
+    def is_logged_out(self):
+        """Verifica se o WhatsApp Web voltou para a tela do QR Code"""
+        return bool(self.driver.find_elements(By.XPATH, '//div[@data-ref] | //canvas[@aria-label]'))
+
+    def _chat_error(self):
+        """Classifica por que a conversa não carregou"""
+        driver = self.driver
+        if driver.find_elements(By.XPATH, '//div[contains(text(), "inválido") or contains(text(), "invalid")]'):
+            return EnvioError("Número inválido ou não tem WhatsApp.", FALHA_PERMANENTE)
+        if self.is_logged_out():
+            return EnvioError("WhatsApp Web desconectado (QR Code na tela).", FALHA_SESSAO)
+        return EnvioError("A conversa não carregou a tempo.", FALHA_TRANSIENTE)
+
+    def send(self, telefone, mensagem, anexo=None):
+        if anexo is not None:
+            return self._send_with_attachment(telefone, mensagem, anexo)
+        driver = self.driver
+        # Remover o + para o link do WhatsApp (ele aceita apenas números)
+        phone_no = telefone.replace('+', '')
+
+        # Navegar para o chat específico com a mensagem já codificada na URL
+        link = f"https://web.whatsapp.com/send?phone={phone_no}&text={urllib.parse.quote(mensagem)}"
+        driver.get(link)
+
+        try:
+            # Esperar o botão de enviar aparecer e ser clicável
+            send_button = WebDriverWait(driver, 25).until(
+                EC.element_to_be_clickable((By.XPATH, '//span[@data-icon="send"]'))
+            )
+            time.sleep(1)
+            send_button.click()
+        except TimeoutException:
+            # Fallback: Tentar pressionar ENTER na caixa de texto
+            chat_boxes = driver.find_elements(By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]')
+            if chat_boxes:
+                chat_boxes[0].send_keys(Keys.ENTER)
+            else:
+                raise self._chat_error()
+
+        # Esperar um pouco para garantir o envio
+        time.sleep(3)
+
+    def _ensure_cached(self, anexo):
+        """Guarda o arquivo no Cache Storage do WhatsApp Web, uma vez por sessão do navegador"""
+        driver = self.driver
+        if self._anexos_sessao != driver.session_id:
+            self._anexos_sessao = driver.session_id
+            self._anexos_em_cache = set()
+        if anexo.chave in self._anexos_em_cache:
+            return
+        if not driver.execute_async_script(_JS_ANEXO_EM_CACHE, anexo.chave):
+            driver.execute_script("window.__anexoPartes = [];")
+            for inicio in range(0, len(anexo.dados), ANEXO_PARTE_BYTES):
+                parte = base64.b64encode(anexo.dados[inicio:inicio + ANEXO_PARTE_BYTES]).decode()
+                driver.execute_script("window.__anexoPartes.push(arguments[0]);", parte)
+            resultado = driver.execute_async_script(_JS_GUARDAR_ANEXO, anexo.chave, anexo.mime)
+            if resultado is not True:
+                raise EnvioError(f"Não foi possível preparar o anexo {anexo.nome}: {resultado}", FALHA_TRANSIENTE)
+        self._anexos_em_cache.add(anexo.chave)
+
+    def _send_with_attachment(self, telefone, mensagem, anexo):
+        """Abre a conversa, cola o anexo do cache da página e envia com a mensagem como legenda"""
+        driver = self.driver
+        driver.get(f"https://web.whatsapp.com/send?phone={telefone.replace('+', '')}")
+        try:
+            WebDriverWait(driver, 25).until(
+                EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]'))
+            )
+        except TimeoutException:
+            raise self._chat_error()
+
+        # Tempo de upload do script assíncrono proporcional ao tamanho do arquivo
+        driver.set_script_timeout(60 + len(anexo.dados) // (256 * 1024))
+        self._ensure_cached(anexo)
+        resultado = driver.execute_async_script(_JS_COLAR_ANEXO, anexo.chave, anexo.nome, anexo.mime)
+        if resultado is not True:
+            raise EnvioError(f"Não foi possível anexar {anexo.nome}: {resultado}", FALHA_TRANSIENTE)
+
+        # Pré-visualização da mídia: a legenda recebe o foco; o botão de enviar fica na prévia
+        try:
+            send_button = WebDriverWait(driver, 60).until(
+                EC.element_to_be_clickable((By.XPATH, '//span[@data-icon="send"]'))
+            )
+        except TimeoutException:
+            raise EnvioError(f"A prévia do anexo {anexo.nome} não abriu.", FALHA_TRANSIENTE)
+        for i, linha in enumerate(mensagem.split('\n') if mensagem else []):
+            if i:
+                driver.switch_to.active_element.send_keys(Keys.SHIFT, Keys.ENTER)
+            if linha:
+                driver.execute_script("document.execCommand('insertText', false, arguments[0]);", linha)
+        send_button.click()
+
+        # Só sair da conversa quando o upload terminar (relógio de "pendente" some das mensagens
+        # da conversa aberta; a lista de conversas em #pane-side também mostra esse ícone).
+        # Depois do clique a mensagem já saiu: falhar aqui não pode levar a um reenvio
+        try:
+            WebDriverWait(driver, 30 + len(anexo.dados) // (100 * 1024)).until_not(
+                EC.presence_of_element_located((By.XPATH, '//div[@id="main"]//span[@data-icon="msg-time"]'))
+            )
+        except TimeoutException:
+            raise EnvioError(
+                f"Envio incerto: a mensagem com {anexo.nome} saiu, mas o upload não terminou a tempo "
+                "(confira a conversa antes de reenviar).",
+                FALHA_PERMANENTE,
+            )
+        time.sleep(1)
+
+    def send_many(self, telefone, mensagens, anexo=None):
+        """Abre a conversa uma única vez e digita as demais mensagens no chat já aberto"""
+        self.send(telefone, mensagens[0], anexo)
+        for enviadas, mensagem in enumerate(mensagens[1:], start=1):
+            try:
+                self._type_in_open_chat(mensagem)
+            except Exception as e:
+                e.enviadas = enviadas
+                raise
+
+    def _type_in_open_chat(self, mensagem):
+        caixa = WebDriverWait(self.driver, 10).until(
+            EC.element_to_be_clickable((By.XPATH, '//div[@contenteditable="true"][@data-tab="10"]'))
+        )
+        caixa.click()
+        # insertText em vez de send_keys: o ChromeDriver não digita emojis (fora do BMP)
+        for i, linha in enumerate(mensagem.split('\n')):
+            if i:
+                caixa.send_keys(Keys.SHIFT, Keys.ENTER)
+            if linha:
+                self.driver.execute_script("document.execCommand('insertText', false, arguments[0]);", linha)
+        caixa.send_keys(Keys.ENTER)
+        time.sleep(1)
+
+class PyWhatKitTransport(Transport):
+    """Envio via pywhatkit (abre uma nova aba do navegador padrão por mensagem)"""
+    nome = "PyWhatKit"
+
+    def __init__(self, wait_time=25, close_time=10):
+        # Importação segura do pywhatkit (pode falhar em servidores sem tela)
+        try:
+            import pywhatkit
+        except Exception as e:
+            raise RuntimeError(f"O módulo PyWhatKit não está disponível neste ambiente: {e}")
+        self._kit = pywhatkit
+        self.wait_time = wait_time
+        self.close_time = close_time
+        self._arquivos = {}      # chave do anexo -> arquivo temporário
+
+    def send(self, telefone, mensagem, anexo=None):
+        check_phone(telefone)
+        if anexo is not None:
+            return self._send_image(telefone, mensagem, anexo)
+        self._kit.sendwhatmsg_instantly(
+            phone_no=telefone,
+            message=mensagem,
+            wait_time=self.wait_time,
+            tab_close=True,
+            close_time=self.close_time
+        )
+
+    def _send_image(self, telefone, mensagem, anexo):
+        """O pywhatkit só anexa imagens, a partir de um arquivo no disco (gravado uma vez por anexo)"""
+        if anexo.tipo != "image":
+            raise EnvioError(f"O PyWhatKit só envia imagens como anexo ({anexo.nome}).", FALHA_PERMANENTE)
+        caminho = self._arquivos.get(anexo.chave)
+        if caminho is None:
+            extensao = os.path.splitext(anexo.nome)[1] or ".png"
+            with tempfile.NamedTemporaryFile(suffix=extensao, delete=False) as arquivo:
+                arquivo.write(anexo.dados)
+            caminho = self._arquivos[anexo.chave] = arquivo.name
+        self._kit.sendwhats_image(
+            receiver=telefone,
+            img_path=caminho,
+            caption=mensagem,
+            wait_time=self.wait_time,
+            tab_close=True,
+            close_time=self.close_time
+        )
+
+    def close(self):
+        for caminho in self._arquivos.values():
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+        self._arquivos.clear()
+
+def _http_category(status):
+    """Categoria de falha a partir do status HTTP da API"""
+    if status in (401, 403):
+        return FALHA_SESSAO
+    if status == 429 or status >= 500 or status == 408:
+        return FALHA_TRANSIENTE
+    return FALHA_PERMANENTE
+
+def _http_error_message(dados, status):
+    """Mensagem de erro da resposta (formato {"error": {"message": ...}} ou {"error": "..."})"""
+    erro = dados.get("error") if isinstance(dados, dict) else None
+    if isinstance(erro, dict):
+        erro = erro.get("message")
+    return f"HTTP {status}: {erro}" if erro else f"HTTP {status}"
+
+class HttpApiTransport(Transport):
+    """Envio por uma API HTTP no estilo WhatsApp Business (Cloud API)
+
+    Usa um requests.Session com pool de conexões reaproveitadas, várias
+    requisições em voo ao mesmo tempo e, se batch_path for informado, envia
+    o lote inteiro numa única requisição ({"messages": [...]} ->
+    {"results": [{"status": ..., "error": ...}, ...]}).
+    """
+    nome = "API HTTP (Business)"
+
+    def __init__(self, base_url, token="", phone_number_id="", concorrencia=8, lote=20,
+                 batch_path=None, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.messages_path = f"{phone_number_id}/messages" if phone_number_id else "messages"
+        self.media_path = f"{phone_number_id}/media" if phone_number_id else "media"
+        self.batch_path = batch_path
+        self.timeout = timeout
+        self.lote = max(1, lote)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concorrencia, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        self._executor = ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix="http-envio")
+        # Anexos já enviados para a API: chave do anexo -> id da mídia (upload único por arquivo)
+        self._midias = {}
+        self._midias_lock = threading.Lock()
+
+    def _media_id(self, anexo):
+        """Sobe o arquivo para a API uma única vez e devolve o id da mídia para reaproveitar"""
+        with self._midias_lock:
+            # O lock também segura as demais threads do lote até o primeiro upload terminar
+            if anexo.chave in self._midias:
+                return self._midias[anexo.chave]
+            try:
+                resp = self.session.post(
+                    f"{self.base_url}/{self.media_path}",
+                    data={"messaging_product": "whatsapp", "type": anexo.mime},
+                    files={"file": (anexo.nome, anexo.dados, anexo.mime)},
+                    timeout=self.timeout + len(anexo.dados) // (256 * 1024),
+                )
+            except (requests.Timeout, requests.ConnectionError) as e:
+                raise EnvioError(f"Falha de conexão ao enviar o anexo {anexo.nome}: {e}", FALHA_TRANSIENTE)
+            try:
+                dados = resp.json()
+            except ValueError:
+                dados = None
+            if not resp.ok or not isinstance(dados, dict) or not dados.get("id"):
+                raise EnvioError(f"Upload de {anexo.nome}: {_http_error_message(dados, resp.status_code)}",
+                                 _http_category(resp.status_code) if not resp.ok else FALHA_TRANSIENTE)
+            self._midias[anexo.chave] = dados["id"]
+            return dados["id"]
+
+    def _payload(self, telefone, mensagem, anexo=None):
+        if anexo is None:
+            return {
+                "messaging_product": "whatsapp",
+                "to": telefone.lstrip('+'),
+                "type": "text",
+                "text": {"body": mensagem},
+            }
+        midia = {"id": self._media_id(anexo)}
+        if anexo.tipo != "audio" and mensagem:
+            midia["caption"] = mensagem
+        if anexo.tipo == "document":
+            midia["filename"] = anexo.nome
+        return {
+            "messaging_product": "whatsapp",
+            "to": telefone.lstrip('+'),
+            "type": anexo.tipo,
+            anexo.tipo: midia,
+        }
+
+    def _post(self, path, payload):
+        try:
+            return self.session.post(f"{self.base_url}/{path.lstrip('/')}", json=payload, timeout=self.timeout)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            raise EnvioError(f"Falha de conexão com a API: {e}", FALHA_TRANSIENTE)
+
+    def send(self, telefone, mensagem, anexo=None):
+        check_phone(telefone)
+        resp = self._post(self.messages_path, self._payload(telefone, mensagem, anexo))
+        if not resp.ok:
+            try:
+                dados = resp.json()
+            except ValueError:
+                dados = None
+            raise EnvioError(_http_error_message(dados, resp.status_code), _http_category(resp.status_code))
+        if anexo is not None and anexo.tipo == "audio" and mensagem:
+            # Áudio não aceita legenda: o texto vai numa mensagem separada. Se só ele falhar,
+            # o áudio já foi entregue e a próxima tentativa manda apenas o texto
+            try:
+                self.send(telefone, mensagem)
+            except Exception as e:
+                e.anexo_enviado = True
+                raise
+
+    def _send_safe(self, *item):
+        try:
+            self.send_item(*item)
+            return None
+        except Exception as e:
+            return e
+
+    def send_batch(self, itens):
+        if not itens:
+            return []
+        # O endpoint de lote recebe uma mensagem por item (sem listas nem áudio com texto)
+        if self.batch_path and not any(
+            isinstance(item[1], list) or (len(item) > 2 and item[2] is not None and item[2].tipo == "audio")
+            for item in itens
+        ):
+            return self._send_batch_request(itens)
+        # Sem endpoint de lote: requisições individuais em paralelo, no mesmo pool de conexões
+        futuros = [self._executor.submit(self._send_safe, *item) for item in itens]
+        return [f.result() for f in futuros]
+
+    def _send_batch_request(self, itens):
+        """Envia o lote numa única requisição e distribui o resultado por item"""
+        # Telefones inválidos falham aqui, como no envio individual, e ficam fora da requisição
+        saida = [None] * len(itens)
+        validos = []
+        for i, item in enumerate(itens):
+            try:
+                check_phone(item[0])
+                validos.append(i)
+            except EnvioError as e:
+                saida[i] = e
+        if validos:
+            for i, resultado in zip(validos, self._post_batch([itens[i] for i in validos])):
+                saida[i] = resultado
+        return saida
+
+    def _post_batch(self, itens):
+        """Uma requisição ao endpoint de lote: None ou a exceção de cada item, na mesma ordem"""
+        try:
+            resp = self._post(self.batch_path, {"messages": [self._payload(*item) for item in itens]})
+        except EnvioError as e:
+            return [e] * len(itens)
+        if not resp.ok:
+            erro = EnvioError(_http_error_message(None, resp.status_code), _http_category(resp.status_code))
+            return [erro] * len(itens)
+
+        try:
+            resultados = resp.json()["results"]
+        except (ValueError, KeyError, TypeError):
+            resultados = None
+        if not isinstance(resultados, list):
+            erro = EnvioError(f"HTTP {resp.status_code}: resposta do lote sem lista de resultados", FALHA_TRANSIENTE)
+            return [erro] * len(itens)
+
+        saida = []
+        for i in range(len(itens)):
+            item = resultados[i] if i < len(resultados) else {"status": 502, "error": "Sem resultado no lote"}
+            try:
+                status = int(item.get("status", 200))
+            except (AttributeError, TypeError, ValueError):
+                item, status = {"error": f"Resultado inválido no lote: {item!r}"[:200]}, 502
+            if 200 <= status < 300:
+                saida.append(None)
+            else:
+                saida.append(EnvioError(_http_error_message(item, status), _http_category(status)))
+        return saida
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,236 @@
+# =====================================================
+# NÓ DE ENVIO DISTRIBUÍDO
+# =====================================================
+# Processo de linha de comando que envia uma campanha publicada no banco
+# compartilhado (coordinator.py). Vários nós podem rodar ao mesmo tempo,
+# em máquinas diferentes, cada um com sua própria sessão do WhatsApp Web
+# ou credencial da API:
+#
+#   python worker.py --campanha 12 --headless
+#   python worker.py --campanha 12 --transporte http --api-url https://... --api-phone-id 123
+#
+# O nó reserva lotes de linhas com lease, renova o lease numa thread de
+# heartbeat enquanto envia e devolve as linhas não enviadas ao sair.
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import coordinator
+from transports import (
+    FALHA_PERMANENTE,
+    FALHA_SESSAO,
+    RECONEXAO_MAX,
+    classify_error,
+    create_chrome_driver,
+    wait_whatsapp_login,
+    SeleniumTransport,
+    HttpApiTransport,
+)
+
+LOGIN_TIMEOUT = 300          # Segundos aguardando o QR Code ser escaneado
+ESPERA_FILA_VAZIA = 15       # Segundos entre tentativas quando não há linhas disponíveis agora
+
+def log(no, mensagem):
+    print(f"[{time.strftime('%H:%M:%S')}] [{no}] {mensagem}", flush=True)
+
+def login_node(driver, no, timeout=LOGIN_TIMEOUT):
+    """Abre o WhatsApp Web e aguarda o login, salvando a tela (QR Code) em qr_<nó>.png"""
+    driver.get("https://web.whatsapp.com")
+    captura = f"qr_{no}.png"
+    avisos = []
+
+    def salvar_tela(d):
+        d.save_screenshot(captura)
+        if not avisos:
+            log(no, f"Aguardando login: escaneie o QR Code salvo em {captura}")
+            avisos.append(captura)
+
+    logado = wait_whatsapp_login(driver, timeout, aguardando=salvar_tela)
+    if logado and os.path.exists(captura):
+        os.remove(captura)
+    return logado
+
+def start_driver(args):
+    """Inicia o navegador e aguarda o login no WhatsApp Web. Retorna o driver ou None"""
+    try:
+        driver = create_chrome_driver(headless=args.headless)
+    except Exception as e:
+        log(args.no, f"Erro ao iniciar o navegador: {e}")
+        return None
+    if not login_node(driver, args.no):
+        log(args.no, "Login no WhatsApp Web não concluído a tempo.")
+        driver.quit()
+        return None
+    return driver
+
+def build_transport(args):
+    """Cria o transporte do nó conforme os argumentos (None se o navegador não conectar)"""
+    if args.transporte == "http":
+        return HttpApiTransport(
+            args.api_url,
+            token=args.api_token,
+            phone_number_id=args.api_phone_id,
+            concorrencia=args.concorrencia,
+            lote=args.api_lote,
+            batch_path=args.api_batch_path,
+        )
+    driver = start_driver(args)
+    return SeleniumTransport(driver) if driver is not None else None
+
+def reconnect(transport, args):
+    """Recupera o transporte após falha de sessão (só o Selenium consegue). Retorna True se puder continuar"""
+    if not isinstance(transport, SeleniumTransport):
+        return False
+    try:
+        transport.driver.quit()
+    except Exception:
+        pass
+    transport.driver = start_driver(args)
+    return transport.driver is not None
+
+def heartbeat_loop(args, parar):
+    """Renova os leases do nó a cada terço do lease até `parar` ser sinalizado"""
+    while not parar.wait(args.lease / 3):
+        try:
+            coordinator.heartbeat(args.campanha, args.no, lease=args.lease, db_path=args.db)
+        except Exception as e:
+            # Banco ocupado/inacessível: tenta de novo no próximo ciclo, antes de o lease vencer
+            log(args.no, f"Falha no heartbeat: {e}")
+
+def send_claimed(transport, lote, args, intervalo, cancelar):
+    """Envia um lote reservado. Retorna (enviados, erros, sessão_perdida)"""
+    enviados = erros = 0
+    for inicio in range(0, len(lote), transport.lote):
+        # Só envia as linhas cujo lease ainda é deste nó (fencing contra envio duplicado)
+        grupo = [
+            linha for linha in lote[inicio:inicio + transport.lote]
+            if coordinator.begin_send(args.campanha, args.no, linha["linha_id"], lease=args.lease, db_path=args.db)
+        ]
+        if not grupo:
+            continue
+        falhas = transport.send_batch([(linha["telefone"], linha["mensagem"]) for linha in grupo])
+        sessao_perdida = []
+        for linha, falha in zip(grupo, falhas):
+            if falha is None:
+                coordinator.complete(args.campanha, args.no, linha["linha_id"], db_path=args.db)
+                enviados += 1
+                continue
+            categoria = classify_error(falha)
+            if categoria == FALHA_SESSAO:
+                sessao_perdida.append(linha["linha_id"])
+                continue
+            status = coordinator.fail(
+                args.campanha, args.no, linha["linha_id"], str(falha)[:200],
+                definitiva=categoria == FALHA_PERMANENTE, db_path=args.db,
+            )
+            if status == coordinator.ERRO:
+                erros += 1
+            log(args.no, f"{linha['nome']} ({linha['telefone']}): {categoria} - {str(falha)[:100]} -> {status}")
+        if sessao_perdida:
+            # A mensagem não saiu: as linhas voltam para a fila (para este ou outro nó)
+            coordinator.release(args.campanha, args.no, sessao_perdida, db_path=args.db)
+            coordinator.release(args.campanha, args.no, db_path=args.db)
+            return enviados, erros, True
+        if cancelar.wait(intervalo):
+            break
+    return enviados, erros, False
+
+def process_campaign(args, transport, reconectar, cancelar):
+    """Reserva e envia lotes da campanha até acabar ou `cancelar` ser sinalizado
+
+    reconectar(transport) tenta recuperar o transporte após perda de sessão.
+    Ao sair (inclusive por exceção), devolve para a fila o que ainda estava
+    reservado. Retorna (código de saída, enviados, erros).
+    """
+    campanha = coordinator.campaign_info(args.campanha, db_path=args.db)
+    if campanha is None:
+        log(args.no, f"Campanha {args.campanha} não encontrada em {args.db}.")
+        return 2, 0, 0
+    intervalo = args.intervalo if args.intervalo is not None else campanha["intervalo"]
+    log(args.no, f"Enviando a campanha {args.campanha} via {transport.nome} (lote {args.lote}, lease {args.lease}s)")
+
+    parar = threading.Event()
+    batimentos = threading.Thread(target=heartbeat_loop, args=(args, parar), daemon=True)
+    batimentos.start()
+    total_enviados = total_erros = reconexoes = 0
+    codigo = 0
+    try:
+        while not cancelar.is_set():
+            lote = coordinator.claim_batch(
+                args.campanha, args.no, quantidade=args.lote, lease=args.lease, db_path=args.db
+            )
+            if not lote:
+                if coordinator.pending_count(args.campanha, db_path=args.db) == 0:
+                    break
+                # Linhas com outros nós ou aguardando o backoff de uma nova tentativa
+                cancelar.wait(ESPERA_FILA_VAZIA)
+                continue
+            enviados, erros, sessao_perdida = send_claimed(transport, lote, args, intervalo, cancelar)
+            total_enviados += enviados
+            total_erros += erros
+            if sessao_perdida:
+                reconexoes += 1
+                log(args.no, "Sessão perdida: linhas devolvidas para a fila, reconectando...")
+                if reconexoes > RECONEXAO_MAX or not reconectar(transport):
+                    log(args.no, "Não foi possível reconectar. Encerrando este nó.")
+                    codigo = 1
+                    break
+    finally:
+        parar.set()
+        # Saída normal, cancelamento, Ctrl+C ou SIGTERM: o que ainda estava reservado volta para a fila
+        devolvidas = coordinator.release(args.campanha, args.no, db_path=args.db)
+        coordinator.heartbeat(args.campanha, args.no, lease=args.lease, estado="encerrado", db_path=args.db)
+        log(args.no, f"Encerrado: {total_enviados} enviados, {total_erros} erros, {devolvidas} linhas devolvidas.")
+    return codigo, total_enviados, total_erros
+
+def run(args):
+    """Laço principal do nó. Retorna o código de saída do processo"""
+    if coordinator.campaign_info(args.campanha, db_path=args.db) is None:
+        log(args.no, f"Campanha {args.campanha} não encontrada em {args.db}.")
+        return 2
+    transport = build_transport(args)
+    if transport is None:
+        return 1
+    try:
+        codigo, _, _ = process_campaign(args, transport, lambda t: reconnect(t, args), threading.Event())
+    finally:
+        transport.close()
+        if isinstance(transport, SeleniumTransport) and transport.driver is not None:
+            transport.driver.quit()
+    return codigo
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Nó de envio de uma campanha distribuída do WhatsApp Sender Pro")
+    parser.add_argument("--campanha", type=int, required=True, help="Id da campanha publicada no app")
+    parser.add_argument("--db", default=coordinator.DB_PATH, help="Banco compartilhado de coordenação")
+    parser.add_argument("--no", default=f"{socket.gethostname()}-{os.getpid()}", help="Nome deste nó")
+    parser.add_argument("--lote", type=int, default=coordinator.LOTE_PADRAO, help="Linhas reservadas por vez")
+    parser.add_argument("--lease", type=int, default=coordinator.LEASE_PADRAO, help="Validade da reserva (segundos)")
+    parser.add_argument("--intervalo", type=int, default=None,
+                        help="Segundos entre mensagens (padrão: o da campanha)")
+    parser.add_argument("--transporte", choices=["selenium", "http"], default="selenium")
+    parser.add_argument("--headless", action="store_true", help="Navegador sem janela (QR Code salvo em arquivo)")
+    parser.add_argument("--api-url", default=os.environ.get("WHATSAPP_API_URL", ""))
+    parser.add_argument("--api-token", default=os.environ.get("WHATSAPP_API_TOKEN", ""))
+    parser.add_argument("--api-phone-id", default=os.environ.get("WHATSAPP_API_PHONE_ID", ""))
+    parser.add_argument("--api-batch-path", default=None)
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--api-lote", type=int, default=20)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # SIGTERM (docker stop, systemd) encerra pelo mesmo caminho do Ctrl+C, liberando as reservas
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+    try:
+        return run(args)
+    except KeyboardInterrupt:
+        return 130
+
+if __name__ == "__main__":
+    sys.exit(main())
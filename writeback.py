@@ -0,0 +1,118 @@
+# =====================================================
+# GRAVAÇÃO DO STATUS DE ENVIO NA PLANILHA DE ORIGEM
+# =====================================================
+# O resultado de cada linha (status, data/hora e motivo do erro) fica em
+# memória durante o envio e é gravado em lotes periódicos numa aba
+# própria da planilha: no arquivo Excel ou no Google Sheets (através da
+# GSheetsConnection já usada pelo app). Nunca uma gravação por linha.
+
+import os
+import time
+
+import pandas as pd
+
+ABA_RESULTADOS = "Resultados Envio"
+WRITEBACK_LOTE = 50          # Resultados novos que disparam uma gravação
+WRITEBACK_INTERVALO = 60     # Segundos máximos entre gravações (se houver algo novo)
+WRITEBACK_FRACAO = 10        # Com a tabela grande, o lote cresce para 1/10 das linhas já registradas
+
+COLUNAS_RESULTADO = ["Linha", "Nome", "Telefone", "Status", "Data/Hora", "Erro"]
+
+def excel_destination(path, aba=ABA_RESULTADOS):
+    """Destino que (re)escreve a aba de resultados dentro do arquivo .xlsx"""
+    def gravar(df):
+        if os.path.exists(path):
+            with pd.ExcelWriter(path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+                df.to_excel(writer, sheet_name=aba, index=False)
+        else:
+            with pd.ExcelWriter(path, engine="openpyxl") as writer:
+                df.to_excel(writer, sheet_name=aba, index=False)
+    return gravar
+
+def gsheets_destination(conn, spreadsheet, aba=ABA_RESULTADOS):
+    """Destino que grava a aba de resultados no Google Sheets (uma requisição por lote)"""
+    estado = {"criada": False}
+
+    def gravar(df):
+        if not estado["criada"]:
+            try:
+                conn.create(spreadsheet=spreadsheet, worksheet=aba, data=df)
+                estado["criada"] = True
+                return
+            except Exception:
+                # A aba já existe: seguir com update
+                estado["criada"] = True
+        conn.update(spreadsheet=spreadsheet, worksheet=aba, data=df)
+    return gravar
+
+class ResultWriteback:
+    """Acumula o resultado de cada linha em memória e grava a tabela em lotes periódicos
+
+    Cada gravação reescreve a aba inteira (o openpyxl salva o arquivo todo e
+    o GSheetsConnection.update substitui a aba), então o lote e o intervalo
+    crescem junto com a tabela: o volume total gravado fica proporcional ao
+    tamanho da lista, não ao quadrado dele.
+    """
+
+    def __init__(self, destino, tamanho_lote=WRITEBACK_LOTE, intervalo=WRITEBACK_INTERVALO, linhas_origem=None):
+        self.destino = destino
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        # Linhas com id menor que isso vieram da planilha (id = posição); as demais foram incluídas no editor
+        self.linhas_origem = linhas_origem
+        self.resultados = {}
+        self.pendentes = 0
+        self.gravacoes = 0
+        self.ultimo_erro = None
+        self._ultima_gravacao = time.monotonic()
+
+    def add(self, linha_id, nome, telefone, status, quando, erro=None):
+        """Registra (em memória) o resultado de uma linha; a última informação da linha prevalece"""
+        linha = ""
+        if self.linhas_origem is None or linha_id < self.linhas_origem:
+            linha = int(linha_id) + 2  # +1 do cabeçalho, +1 porque a planilha começa em 1
+        self.resultados[linha_id] = {
+            "Linha": linha,
+            "Nome": nome,
+            "Telefone": telefone,
+            "Status": status,
+            "Data/Hora": quando,
+            "Erro": erro or "",
+        }
+        self.pendentes += 1
+
+    def limits(self):
+        """Lote e intervalo atuais, escalados pelo tamanho da tabela: (resultados, segundos)"""
+        lote = max(self.tamanho_lote, len(self.resultados) // WRITEBACK_FRACAO)
+        return lote, self.intervalo * lote / self.tamanho_lote
+
+    def maybe_flush(self):
+        """Grava se o lote encheu ou se passou o intervalo desde a última gravação"""
+        lote, intervalo = self.limits()
+        if self.pendentes and (
+            self.pendentes >= lote
+            or time.monotonic() - self._ultima_gravacao >= intervalo
+        ):
+            return self.flush()
+        return False
+
+    def flush(self):
+        """Grava a tabela completa de resultados no destino. Em caso de erro, mantém tudo para a próxima"""
+        if not self.pendentes:
+            return False
+        try:
+            self.destino(self.to_dataframe())
+        except Exception as e:
+            self.ultimo_erro = str(e)
+            self._ultima_gravacao = time.monotonic()
+            return False
+        self.pendentes = 0
+        self.gravacoes += 1
+        self.ultimo_erro = None
+        self._ultima_gravacao = time.monotonic()
+        return True
+
+    def to_dataframe(self):
+        """Resultados acumulados como DataFrame (ordem das linhas da planilha)"""
+        linhas = [self.resultados[linha_id] for linha_id in sorted(self.resultados)]
+        return pd.DataFrame(linhas, columns=COLUNAS_RESULTADO)